@@ -13,13 +13,17 @@
 # for more details.
 #
 
+import time
+import eventlet
 import webob
 from urlparse import urlsplit
+from oslo.config import cfg
 
 from nova.compute import API
 from nova.compute import HostAPI
 from nova.compute.cloudlet_api import CloudletAPI as CloudletAPI
 from nova import exception
+from nova import utils
 from nova.api.openstack import extensions
 from nova.api.openstack import wsgi
 try:
@@ -38,6 +42,55 @@ logging.config.fileConfig('/var/log/openstackpp/cloudlet_log.conf')
 LOG = logging.getLogger(__name__)
 authorize = extensions.extension_authorizer('compute', 'cloudlet')
 
+cloudlet_api_opts = [
+    cfg.IntOpt('compute_node_cache_ttl',
+               default=60,
+               help='Seconds a cached address of a compute node is used '
+                    'before compute nodes are listed again'),
+    cfg.FloatOpt('handoff_schedule_timeout',
+                 default=10.0,
+                 help='Seconds to wait for a handoff destination VM to be '
+                      'scheduled to a compute node'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(cloudlet_api_opts, group='cloudlet')
+
+
+class ComputeNodeAddressCache(object):
+
+    """hypervisor_hostname to host_ip map of compute nodes
+
+    The map is listed again once it is older than ttl, or when a node is
+    missing from it, e.g. a compute node added since the last listing.
+    """
+
+    def __init__(self, host_api, ttl):
+        self.host_api = host_api
+        self.ttl = ttl
+        self.addresses = dict()
+        self.updated_at = 0
+
+    def _refresh(self, context):
+        addresses = dict()
+        for node in self.host_api.compute_node_get_all(context):
+            node_name = node.get('hypervisor_hostname', None)
+            if node_name is not None:
+                addresses[str(node_name)] = node.get('host_ip', None)
+        self.addresses = addresses
+        self.updated_at = time.time()
+
+    def get(self, context, hypervisor_hostname):
+        refreshed = False
+        if time.time() - self.updated_at > self.ttl:
+            self._refresh(context)
+            refreshed = True
+        host_ip = self.addresses.get(str(hypervisor_hostname), None)
+        if host_ip is None and not refreshed:
+            self._refresh(context)
+            host_ip = self.addresses.get(str(hypervisor_hostname), None)
+        return host_ip
+
 
 class Cloudlet(extensions.ExtensionDescriptor):
 
@@ -53,6 +106,13 @@ class Cloudlet(extensions.ExtensionDescriptor):
             self, 'servers', CloudletController())
         return [servers_extension]
 
+    def get_resources(self):
+        resource = extensions.ResourceExtension(
+            'os-cloudlet', CloudletResourceController(),
+            collection_actions={'base_vms': 'GET'},
+            member_actions={'status': 'GET'})
+        return [resource]
+
 
 class CloudletController(wsgi.Controller):
 
@@ -61,6 +121,8 @@ class CloudletController(wsgi.Controller):
         self.cloudlet_api = CloudletAPI()
         self.host_api = HostAPI()
         self.compute_api = API()
+        self.compute_node_cache = ComputeNodeAddressCache(
+            self.host_api, CONF.cloudlet.compute_node_cache_ttl)
 
     def _get_instance(self, context, instance_id, want_objects=False):
         try:
@@ -80,32 +142,16 @@ class CloudletController(wsgi.Controller):
         LOG.debug("return handoff information")
         if 'server' not in resp_obj.obj:
             return
-        compute_nodes = self.host_api.compute_node_get_all(context)
         instance_id = resp_obj.obj['server'].get('id', None)
 
         # wait until the VM instance is scheduled to the compute node
         # Need fix: seperate one API into two; one for assigning VM to compute
         # node, the other for setting up port forwarding
-        repeat_count = 0
-        MAX_COUNT = 30
-        while repeat_count < MAX_COUNT:
-            instance = self.compute_api.get(context, instance_id)
-            instance_hostname = instance.get('node', None)
-            if instance_hostname is None:
-                import time
-                time.sleep(0.1)
-                msg = "waiting for VM scheduling %d/%d..."\
-                    % (repeat_count, MAX_COUNT)
-                LOG.debug(msg)
-                repeat_count += 1
-            else:
-                break
+        instance_hostname = self._wait_for_scheduling(context, instance_id)
 
         dest_ip = None
-        for node in compute_nodes:
-            node_name = node.get('hypervisor_hostname', None)
-            if str(node_name) == str(instance_hostname):
-                dest_ip = node.get('host_ip', None)
+        if instance_hostname is not None:
+            dest_ip = self.compute_node_cache.get(context, instance_hostname)
 
         # set port forwarding
         if dest_ip:
@@ -116,15 +162,40 @@ class CloudletController(wsgi.Controller):
             )
             server_url = resp_obj.obj['server']['links'][0]['href']
             server_ipaddr = urlsplit(server_url).netloc.split(":")[0]
+            # prepare tells the source to wait until os-cloudlet status
+            # reports that the destination VM has fetched its base VM
             resp_obj.obj['handoff'] = {
                 "server_ip": str(server_ipaddr),
                 "server_port": int(source_port),
+                "prepare": True,
             }
         else:
             resp_obj.obj['handoff'] = {
                 "error": "cannot setup port forwarding"
             }
 
+    def _wait_for_scheduling(self, context, instance_id):
+        """Return the node the instance is scheduled to, or None if it is
+        not scheduled within handoff_schedule_timeout. Yields to other
+        requests between checks, backing off from 10 ms up to 0.5 s.
+        """
+        deadline = time.time() + CONF.cloudlet.handoff_schedule_timeout
+        delay = 0.01
+        while True:
+            instance = self.compute_api.get(context, instance_id)
+            instance_hostname = instance.get('node', None)
+            if instance_hostname is not None:
+                return instance_hostname
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                LOG.warning("VM %s is not scheduled in %.1f seconds" %
+                            (instance_id,
+                             CONF.cloudlet.handoff_schedule_timeout))
+                return None
+            LOG.debug("waiting for VM scheduling...")
+            eventlet.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.5)
+
     @wsgi.extends
     def create(self, req, body):
         context = req.environ['nova.context']
@@ -153,9 +224,14 @@ class CloudletController(wsgi.Controller):
 
         LOG.info(_("Importing base VM %r..."), id)
         instance = self._get_instance(context, id, want_objects=True)
-        disk_meta, memory_meta = self.cloudlet_api.cloudlet_create_base(
-            context, instance, baseVM_name)
-        return {'base-disk': disk_meta, 'base-memory': memory_meta}
+        disk_meta, memory_meta, diskhash_meta, memhash_meta = \
+            self.cloudlet_api.cloudlet_create_base(context, instance,
+                                                   baseVM_name)
+        # base VM is created asynchronously. Progress is at
+        # GET os-cloudlet/{id}/status
+        return {'base-disk': disk_meta, 'base-memory': memory_meta,
+                'base-disk-hash': diskhash_meta,
+                'base-memory-hash': memhash_meta}
 
     @wsgi.action('cloudlet-overlay-finish')
     def cloudlet_overlay_finish(self, req, id, body):
@@ -220,3 +296,62 @@ class CloudletController(wsgi.Controller):
             return {'handoff': "%s" % residue_id}
         else:
             return {'handoff': "%s" % handoff_url}
+
+
+class CloudletResourceController(wsgi.Controller):
+
+    """Base VM lookup and progress of cloudlet operations"""
+
+    def __init__(self, *args, **kwargs):
+        super(CloudletResourceController, self).__init__(*args, **kwargs)
+        self.cloudlet_api = CloudletAPI()
+        self.compute_api = API()
+
+    def status(self, req, id):
+        """Return progress of base VM creation and readiness of a handoff
+        destination. The instance is terminated once its base VM is
+        created, so deleted instances are looked up too
+        """
+        context = req.environ['nova.context']
+        authorize(context)
+        try:
+            with utils.temporary_mutation(context, read_deleted="yes"):
+                instance = self.compute_api.get(context, id,
+                                                want_objects=True)
+        except exception.InstanceNotFound:
+            msg = _("Server not found")
+            raise webob.exc.HTTPNotFound(explanation=msg)
+
+        cloudlet_status = dict()
+        base_status = self.cloudlet_api.cloudlet_base_status(context,
+                                                             instance)
+        if base_status is not None:
+            cloudlet_status['cloudlet-base'] = base_status
+        handoff_status = self.cloudlet_api.cloudlet_handoff_status(instance)
+        if handoff_status is not None:
+            cloudlet_status['cloudlet-handoff'] = handoff_status
+        if not cloudlet_status:
+            msg = _("Server has no cloudlet operation in progress")
+            raise webob.exc.HTTPNotFound(explanation=msg)
+        return cloudlet_status
+
+    def base_vms(self, req):
+        """List base VMs in the same form as images API, only those with
+        base_sha256_uuid of the sha256 query parameter if it is given
+        """
+        context = req.environ['nova.context']
+        authorize(context)
+        base_sha256_uuid = req.GET.get('sha256', None)
+        base_vms = self.cloudlet_api.find_base_vms(context, base_sha256_uuid)
+        return {'base_vms': [self._base_vm_view(image_meta)
+                             for image_meta in base_vms]}
+
+    def _base_vm_view(self, image_meta):
+        return {
+            'id': image_meta['id'],
+            'name': image_meta.get('name', None),
+            'status': image_meta.get('status', None),
+            'minDisk': image_meta.get('min_disk', 0),
+            'minRam': image_meta.get('min_ram', 0),
+            'metadata': image_meta.get('properties', None) or {},
+            }
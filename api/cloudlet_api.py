@@ -16,8 +16,11 @@
 #   limitations under the License.
 #
 
+import time
+import socket
+import functools
+import urllib
 import eventlet
-import threading
 from urlparse import urlparse
 from urlparse import urlsplit
 import httplib
@@ -41,17 +44,218 @@ except ImportError as e:
 
 from hashlib import sha256
 
+from cloudlet_common.forwarder import HandoffPortForwarder
+
 import logging
 
 LOG = logging.getLogger(__name__)
+handoff_forward_opts = [
+    cfg.StrOpt('handoff_forward_port_range',
+               default='',
+               help='Ports used to forward VM handoff streams to compute '
+                    'nodes, as first:last. Empty means any free port'),
+    cfg.IntOpt('handoff_forward_idle_timeout',
+               default=300,
+               help='Seconds without traffic after which a forwarded VM '
+                    'handoff stream, or a port nobody connected to, is '
+                    'closed'),
+    cfg.IntOpt('handoff_dest_catalog_ttl',
+               default=300,
+               help='Seconds the base VMs and flavors listed from a handoff '
+                    'destination are reused. A base VM or flavor missing '
+                    'from the cached list makes it listed again'),
+    cfg.IntOpt('base_vm_index_refresh_interval',
+               default=10,
+               help='Minimum seconds between asking glance for base VM '
+                    'images changed since the last lookup'),
+    cfg.IntOpt('base_vm_index_resync_interval',
+               default=600,
+               help='Seconds after which base VM images are listed from '
+                    'glance again in full, dropping deleted ones that '
+                    'incremental updates did not report'),
+    cfg.IntOpt('handoff_forward_buffer_size',
+               default=1024 * 1024,
+               help='Bytes moved at a time by a forwarded VM handoff stream'),
+    ]
+
 CONF = cfg.CONF
 CONF.import_opt('reclaim_instance_interval', 'nova.compute.cloudlet_manager')
+CONF.register_opts(handoff_forward_opts, group='cloudlet')
 
 
 class HandoffError(Exception):
     pass
 
 
+class HTTPConnectionPool(object):
+
+    """Keep-alive HTTP connections to handoff destinations"""
+
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle
+        self.idle = dict()      # netloc -> idle connections
+
+    def request(self, netloc, method, path, body=None, headers=None):
+        """Return (status, body) of the response. A request failing on a
+        reused connection, which the server may have closed, is sent again
+        on a new connection if it was not sent yet or is a GET.
+        """
+        while True:
+            idle_conns = self.idle.setdefault(netloc, list())
+            reused = len(idle_conns) > 0
+            if reused:
+                conn = idle_conns.pop()
+            else:
+                conn = httplib.HTTPConnection(netloc)
+            try:
+                conn.request(method, path, body, headers or {})
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if reused:
+                    continue
+                raise
+            try:
+                response = conn.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if reused and method == "GET":
+                    continue
+                raise
+            if response.will_close or len(idle_conns) >= self.max_idle:
+                conn.close()
+            else:
+                idle_conns.append(conn)
+            return response.status, data
+
+
+class DestinationCatalog(object):
+
+    """Base VMs and flavors of a handoff destination, indexed by
+    base_sha256_uuid and by (vcpus, ram)
+    """
+
+    def __init__(self, image_list, flavor_list):
+        self.updated_at = time.time()
+        self.base_images = dict()
+        for image_item in image_list:
+            properties = image_item.get("metadata", None)
+            if properties is None or len(properties) == 0:
+                continue
+            if properties.get(CloudletAPI.PROPERTY_KEY_CLOUDLET_TYPE) != \
+                    CloudletAPI.IMAGE_TYPE_BASE_DISK:
+                continue
+            base_sha256_uuid = properties.get(
+                CloudletAPI.PROPERTY_KEY_BASE_UUID)
+            # first match wins as when the list was scanned
+            self.base_images.setdefault(base_sha256_uuid, image_item['id'])
+        self.flavors = dict()
+        for flavor in flavor_list:
+            key = (int(flavor['vcpus']), int(flavor['ram']))
+            self.flavors.setdefault(
+                key, (flavor['links'][0]['href'], flavor['id']))
+
+    def is_stale(self, ttl):
+        return time.time() - self.updated_at > ttl
+
+    def find_base_image(self, base_sha256_uuid):
+        return self.base_images.get(base_sha256_uuid, None)
+
+    def find_flavor(self, cpu_count, memory_mb):
+        return self.flavors.get((int(cpu_count), int(memory_mb)), None)
+
+
+class BaseVMIndex(object):
+
+    """Base disk images visible to a project, indexed by base_sha256_uuid
+
+    The index is built from a full listing of cloudlet base disk images.
+    Later lookups, at most every refresh_interval seconds, ask glance only
+    for images changed since the newest update seen.
+    """
+
+    def __init__(self, refresh_interval, resync_interval):
+        self.refresh_interval = refresh_interval
+        self.resync_interval = resync_interval
+        self.images = dict()        # image id -> image meta
+        self.by_sha256 = dict()     # base_sha256_uuid -> image ids
+        self.changes_since = None
+        self.checked_at = 0
+        self.synced_at = 0
+
+    def _add(self, image_meta):
+        self._remove(image_meta['id'])
+        properties = image_meta.get('properties', None) or {}
+        base_sha256_uuid = properties.get(CloudletAPI.PROPERTY_KEY_BASE_UUID,
+                                          None)
+        self.images[image_meta['id']] = image_meta
+        self.by_sha256.setdefault(base_sha256_uuid, set()).add(
+            image_meta['id'])
+
+    def _remove(self, image_id):
+        image_meta = self.images.pop(image_id, None)
+        if image_meta is None:
+            return
+        properties = image_meta.get('properties', None) or {}
+        base_sha256_uuid = properties.get(CloudletAPI.PROPERTY_KEY_BASE_UUID,
+                                          None)
+        image_ids = self.by_sha256.get(base_sha256_uuid, set())
+        image_ids.discard(image_id)
+        if not image_ids:
+            self.by_sha256.pop(base_sha256_uuid, None)
+
+    def refresh(self, list_images):
+        """
+        :param list_images: list_images(filters) returning glance image meta
+        """
+        now = time.time()
+        if now - self.checked_at < self.refresh_interval:
+            return
+        filters = {
+            'property-%s' % CloudletAPI.PROPERTY_KEY_CLOUDLET_TYPE:
+            CloudletAPI.IMAGE_TYPE_BASE_DISK,
+            }
+        resync = now - self.synced_at > self.resync_interval
+        if resync:
+            self.images = dict()
+            self.by_sha256 = dict()
+            self.changes_since = None
+        else:
+            filters['changes-since'] = self.changes_since
+        latest = None
+        for image_meta in list_images(filters):
+            if image_meta.get('deleted', False) or \
+                    image_meta.get('status', None) in ('deleted', 'killed'):
+                self._remove(image_meta['id'])
+            else:
+                self._add(image_meta)
+            updated_at = image_meta.get('updated_at', None)
+            if updated_at is not None and \
+                    (latest is None or updated_at > latest):
+                latest = updated_at
+        if latest is not None:
+            if hasattr(latest, 'isoformat'):
+                latest = latest.isoformat()
+            self.changes_since = latest
+        elif self.changes_since is None:
+            self.changes_since = time.strftime("%Y-%m-%dT%H:%M:%S",
+                                               time.gmtime(now))
+        self.checked_at = now
+        if resync:
+            self.synced_at = now
+
+    def find(self, base_sha256_uuid=None):
+        if base_sha256_uuid is None:
+            return self.images.values()
+        return [self.images[image_id]
+                for image_id in self.by_sha256.get(base_sha256_uuid, ())]
+
+
+_http_pool = HTTPConnectionPool()
+_dest_catalogs = dict()     # (netloc, path) of destination -> catalog
+_base_vm_indexes = dict()   # project id -> base VM index
+
+
 class CloudletAPI(nova_rpc.ComputeAPI):
 
     PROPERTY_KEY_CLOUDLET = "is_cloudlet"
@@ -59,6 +263,10 @@ class CloudletAPI(nova_rpc.ComputeAPI):
     PROPERTY_KEY_NETWORK_INFO = "network"
     PROPERTY_KEY_BASE_UUID = "base_sha256_uuid"
     PROPERTY_KEY_BASE_RESOURCE = "base_resource_xml_str"
+    # final phase of base VM creation kept on the base disk image, since
+    # system metadata of the terminated instance is not readable
+    PROPERTY_KEY_BASE_PHASE = "cloudlet_base_phase"
+    PROPERTY_KEY_BASE_BYTES = "cloudlet_base_bytes"
 
     IMAGE_TYPE_BASE_DISK = "cloudlet_base_disk"
     IMAGE_TYPE_BASE_MEM = "cloudlet_base_memory"
@@ -69,6 +277,26 @@ class CloudletAPI(nova_rpc.ComputeAPI):
     INSTANCE_TYPE_RESUMED_BASE = "cloudlet_resumed_base_instance"
     INSTANCE_TYPE_SYNTHESIZED_VM = "cloudlet_synthesized_vm"
 
+    # progress of base VM creation saved at instance system metadata
+    SYSMETA_BASE_PHASE = "cloudlet_base_phase"
+    SYSMETA_BASE_BYTES_DONE = "cloudlet_base_bytes_done"
+    SYSMETA_BASE_BYTES_TOTAL = "cloudlet_base_bytes_total"
+    SYSMETA_BASE_UPLOAD_STARTED_AT = "cloudlet_base_upload_started_at"
+    SYSMETA_BASE_UPDATED_AT = "cloudlet_base_updated_at"
+
+    BASE_PHASE_QUEUED = "queued"
+    BASE_PHASE_DISK_SNAPSHOT = "disk_snapshot"
+    BASE_PHASE_MEMORY_SNAPSHOT = "memory_snapshot"
+    BASE_PHASE_UPLOADING = "uploading"
+    BASE_PHASE_COMPLETE = "complete"
+    BASE_PHASE_ERROR = "error"
+
+    # readiness of a handoff destination VM to receive the stream
+    SYSMETA_HANDOFF_BASE = "cloudlet_handoff_base"
+    HANDOFF_BASE_FETCHING = "fetching"
+    HANDOFF_BASE_READY = "ready"
+    HANDOFF_BASE_ERROR = "error"
+
     def __init__(self):
         # super(CloudletAPI, self).__init__(
         #        topic=CONF.compute_topic,
@@ -77,6 +305,27 @@ class CloudletAPI(nova_rpc.ComputeAPI):
         self.nova_api = nova_api.API()
         self.image_api = image.API()
 
+    def _list_images(self, context, filters):
+        if hasattr(self.nova_api, "image_service"):
+            # icehouse
+            return self.nova_api.image_service.detail(context,
+                                                      filters=filters)
+        else:
+            # kilo
+            return self.image_api.get_all(context, filters=filters)
+
+    def find_base_vms(self, context, base_sha256_uuid=None):
+        """Return glance meta of base disk images visible to the project,
+        only those of the given base VM if base_sha256_uuid is set
+        """
+        index = _base_vm_indexes.get(context.project_id, None)
+        if index is None:
+            index = BaseVMIndex(CONF.cloudlet.base_vm_index_refresh_interval,
+                                CONF.cloudlet.base_vm_index_resync_interval)
+            _base_vm_indexes[context.project_id] = index
+        index.refresh(functools.partial(self._list_images, context))
+        return index.find(base_sha256_uuid)
+
     def _cloudlet_create_image(self, context, instance, name, image_type,
                                extra_properties=None):
         """Create new image entry in the image service.  This new image
@@ -175,25 +424,29 @@ class CloudletAPI(nova_rpc.ComputeAPI):
             context, instance, memhash_name, snapshot,
             extra_properties=memhash_properties)
 
-        # add reference for the other base vm information to get it later
-        disk_properties.update({
-            CloudletAPI.IMAGE_TYPE_BASE_MEM: recv_mem_meta['id'],
-            CloudletAPI.IMAGE_TYPE_BASE_DISK_HASH: recv_diskhash_meta['id'],
-            CloudletAPI.IMAGE_TYPE_BASE_MEM_HASH: recv_memhash_meta['id'],
-            })
+        # the compute node adds references for the other base vm
+        # information once they are uploaded, so that the base disk is not
+        # usable as a base VM before them
         recv_disk_meta = self._cloudlet_create_image(
             context, instance, disk_name, snapshot,
             extra_properties=disk_properties)
 
+        system_meta = instance.system_metadata
+        system_meta[CloudletAPI.SYSMETA_BASE_PHASE] = \
+            CloudletAPI.BASE_PHASE_QUEUED
+        system_meta[CloudletAPI.SYSMETA_BASE_BYTES_DONE] = "0"
+        system_meta[CloudletAPI.SYSMETA_BASE_BYTES_TOTAL] = "0"
+        instance.system_metadata = system_meta
         instance.task_state = task_states.IMAGE_SNAPSHOT
         instance.save(expected_task_state=[None])
 
-        # api request
+        # api request. Base VM creation takes long, so do not wait for it
+        # and let the caller follow it with cloudlet_base_status
         version = self.client.target.version
         cctxt = self.client.prepare(
             server=nova_rpc._compute_host(None, instance), version=version
         )
-        cctxt.call(context, 'cloudlet_create_base',
+        cctxt.cast(context, 'cloudlet_create_base',
                    instance=instance,
                    vm_name=base_name,
                    disk_meta_id=recv_disk_meta['id'],
@@ -201,7 +454,81 @@ class CloudletAPI(nova_rpc.ComputeAPI):
                    diskhash_meta_id=recv_diskhash_meta['id'],
                    memoryhash_meta_id=recv_memhash_meta['id']
                    )
-        return recv_disk_meta, recv_mem_meta
+        return recv_disk_meta, recv_mem_meta, \
+            recv_diskhash_meta, recv_memhash_meta
+
+    def cloudlet_handoff_status(self, instance):
+        """Return readiness of a handoff destination VM, or None if the
+        instance is not receiving VM handoff
+        """
+        system_meta = instance.system_metadata
+        base_phase = system_meta.get(CloudletAPI.SYSMETA_HANDOFF_BASE, None)
+        if base_phase is None:
+            return None
+        if instance.vm_state == vm_states.ERROR and \
+                base_phase != CloudletAPI.HANDOFF_BASE_READY:
+            # spawn failed before the base VM was fetched
+            base_phase = CloudletAPI.HANDOFF_BASE_ERROR
+        return {'base': base_phase}
+
+    def cloudlet_base_status(self, context, instance):
+        """Return phase, bytes processed and ETA in seconds of base VM
+        creation from the instance, or None if it did not create a base VM.
+        bytes_total grows as the memory snapshot and hash lists are
+        generated, so the ETA is a lower bound until the memory snapshot
+        phase ends. Once the instance is terminated, the final phase is
+        read from its base disk image.
+        """
+        system_meta = instance.system_metadata
+        phase = system_meta.get(CloudletAPI.SYSMETA_BASE_PHASE, None)
+        if phase is None:
+            if instance.deleted:
+                return self._cloudlet_base_final_status(context, instance)
+            return None
+        bytes_done = int(system_meta.get(
+            CloudletAPI.SYSMETA_BASE_BYTES_DONE, 0))
+        bytes_total = int(system_meta.get(
+            CloudletAPI.SYSMETA_BASE_BYTES_TOTAL, 0))
+        started_at = float(system_meta.get(
+            CloudletAPI.SYSMETA_BASE_UPLOAD_STARTED_AT, 0))
+        updated_at = float(system_meta.get(
+            CloudletAPI.SYSMETA_BASE_UPDATED_AT, 0))
+
+        eta = None
+        if phase == CloudletAPI.BASE_PHASE_COMPLETE:
+            eta = 0
+        elif phase != CloudletAPI.BASE_PHASE_ERROR and started_at and \
+                updated_at > started_at and 0 < bytes_done < bytes_total:
+            throughput = bytes_done / (updated_at - started_at)
+            eta = int((bytes_total - bytes_done) / throughput)
+        return {
+            "phase": phase,
+            "bytes_done": bytes_done,
+            "bytes_total": bytes_total,
+            "eta": eta,
+            }
+
+    def _cloudlet_base_final_status(self, context, instance):
+        filters = {
+            'property-instance_uuid': instance['uuid'],
+            'property-%s' % CloudletAPI.PROPERTY_KEY_CLOUDLET_TYPE:
+            CloudletAPI.IMAGE_TYPE_BASE_DISK,
+            }
+        for image_meta in self._list_images(context, filters):
+            properties = image_meta.get('properties', None) or {}
+            phase = properties.get(CloudletAPI.PROPERTY_KEY_BASE_PHASE, None)
+            if phase is None:
+                continue
+            bytes_total = int(properties.get(
+                CloudletAPI.PROPERTY_KEY_BASE_BYTES, 0))
+            return {
+                "phase": phase,
+                "bytes_done": bytes_total,
+                "bytes_total": bytes_total,
+                "eta": 0,
+                }
+        return None
+
     def _create_reservations(self, context, instance, original_task_state,project_id, user_id):
         instance_vcpus = instance.vcpus
         instance_memory_mb = instance.memory_mb
@@ -252,6 +579,7 @@ class CloudletAPI(nova_rpc.ComputeAPI):
         recv_residue_meta = None
         parsed_handoff_url = urlsplit(handoff_url)
         residue_glance_id = None
+        dest_status_url = None
         if parsed_handoff_url.scheme == "file":
             # save the VM residue to glance file
             dest_vm_name = parsed_handoff_url.netloc
@@ -270,7 +598,8 @@ class CloudletAPI(nova_rpc.ComputeAPI):
         elif parsed_handoff_url.scheme == "http":
             # handoff to other OpenStack
             # Send message to the destination
-            ret_value = self._prepare_handoff_dest(urlparse(handoff_url),
+            dest_end_point = urlparse(handoff_url)
+            ret_value = self._prepare_handoff_dest(dest_end_point,
                                                    dest_token,
                                                    instance,
                                                    dest_vmname)
@@ -281,6 +610,13 @@ class CloudletAPI(nova_rpc.ComputeAPI):
                 raise HandoffError(msg)
             handoff_url = "tcp://%s:%s" % (handoff_dest_addr['server_ip'],
                                            handoff_dest_addr['server_port'])
+            # the source compute node waits for the destination to fetch
+            # its base VM before it pauses the VM for streaming
+            dest_server_id = ret_value.get("server", dict()).get("id", None)
+            if handoff_dest_addr.get("prepare", False) and dest_server_id:
+                dest_status_url = "%s://%s%s/os-cloudlet/%s/status" % (
+                    dest_end_point.scheme, dest_end_point.netloc,
+                    dest_end_point.path, dest_server_id)
 
         # api request
         version = self.client.target.version
@@ -290,7 +626,8 @@ class CloudletAPI(nova_rpc.ComputeAPI):
         cctxt.cast(context, 'cloudlet_handoff',
                    instance=instance,reservations=quotas.reservations,
                    handoff_url=handoff_url,
-                   residue_glance_id=residue_glance_id)
+                   residue_glance_id=residue_glance_id,
+                   dest_status_url=dest_status_url, dest_token=dest_token)
         return residue_glance_id
 
     def _prepare_handoff_dest(self, end_point, dest_token,
@@ -307,42 +644,22 @@ class CloudletAPI(nova_rpc.ComputeAPI):
             instance.get("metadata", dict()).get("overlay_url", None)
 
         # find matching base VM
-        image_list = self._get_server_info(end_point, dest_token, "images")
-        basevm_uuid = None
-        for image_item in image_list:
-            properties = image_item.get("metadata", None)
-            if properties is None or len(properties) == 0:
-                continue
-            if properties.get(CloudletAPI.PROPERTY_KEY_CLOUDLET_TYPE) != \
-                    CloudletAPI.IMAGE_TYPE_BASE_DISK:
-                continue
-            base_sha256_uuid = properties.get(
-                CloudletAPI.PROPERTY_KEY_BASE_UUID)
-            if base_sha256_uuid == requested_basevm_id:
-                basevm_uuid = image_item['id']
-                break
+        basevm_uuid = self._find_dest_base_vm(end_point, dest_token,
+                                              requested_basevm_id)
         if basevm_uuid is None:
             msg = "Cannot find matching Base VM with (%s) at (%s)" %\
                 (str(requested_basevm_id), end_point.netloc)
             raise HandoffError(msg)
 
         # Find matching flavor.
-        def find_matching_flavor(flavor_list, cpu_count, memory_mb):
-            for flavor in flavor_list:
-                vcpu = int(flavor['vcpus'])
-                ram_mb = int(flavor['ram'])
-                if vcpu == cpu_count and ram_mb == memory_mb:
-                    flavor_ref = flavor['links'][0]['href']
-                    flavor_id = flavor['id']
-                    return flavor_ref, flavor_id
-            return None, None
-        flavor_list = self._get_server_info(end_point, dest_token, "flavors")
-        flavor_ref, flavor_id = find_matching_flavor(
-            flavor_list, flavor_cpu, flavor_memory)
-        if flavor_ref is None or flavor_id is None:
+        matching_flavor = self._lookup_dest_catalog(
+            end_point, dest_token,
+            lambda catalog: catalog.find_flavor(flavor_cpu, flavor_memory))
+        if matching_flavor is None:
             msg = "Cannot find matching flavor with cpu=%d, memory=%d at %s" %\
                 (flavor_cpu, flavor_memory, end_point.netloc)
             raise HandoffError(msg)
+        flavor_ref, flavor_id = matching_flavor
 
         # generate request
         meta_data = {
@@ -362,16 +679,57 @@ class CloudletAPI(nova_rpc.ComputeAPI):
         headers = {
             "X-Auth-Token": dest_token,
             "Content-type": "application/json"}
-        conn = httplib.HTTPConnection(end_point[1])
-        conn.request("POST", "%s/servers" % end_point[2], params, headers)
         LOG.info("request handoff to %s" % (end_point.netloc))
-        response = conn.getresponse()
-        data = response.read()
+        status, data = _http_pool.request(end_point[1], "POST",
+                                          "%s/servers" % end_point[2],
+                                          params, headers)
         dd = jsonutils.loads(data)
-        conn.close()
 
         return dd
 
+    def _find_dest_base_vm(self, end_point, token, base_sha256_uuid):
+        """Return image id of the base disk at the destination, asking its
+        os-cloudlet extension and falling back to its image catalog
+        """
+        headers = {"X-Auth-Token": token, "Content-type": "application/json"}
+        query = urllib.urlencode({"sha256": base_sha256_uuid})
+        try:
+            status, data = _http_pool.request(
+                end_point[1], "GET",
+                "%s/os-cloudlet/base_vms?%s" % (end_point[2], query),
+                None, headers)
+        except (httplib.HTTPException, socket.error) as e:
+            LOG.debug("cannot ask base VM of %s: %s" %
+                      (end_point.netloc, str(e)))
+            status = None
+        if status == 200:
+            base_vms = jsonutils.loads(data).get("base_vms", [])
+            if len(base_vms) > 0:
+                return base_vms[0]['id']
+            return None
+        # destination without base VM lookup
+        return self._lookup_dest_catalog(
+            end_point, token,
+            lambda catalog: catalog.find_base_image(base_sha256_uuid))
+
+    def _lookup_dest_catalog(self, end_point, token, lookup):
+        """Return lookup(catalog) on the cached catalog of the destination,
+        listing its images and flavors again if the catalog is stale or
+        lookup finds nothing in it
+        """
+        key = (end_point.netloc, end_point.path)
+        catalog = _dest_catalogs.get(key, None)
+        if catalog is not None and \
+                not catalog.is_stale(CONF.cloudlet.handoff_dest_catalog_ttl):
+            value = lookup(catalog)
+            if value is not None:
+                return value
+        catalog = DestinationCatalog(
+            self._get_server_info(end_point, token, "images"),
+            self._get_server_info(end_point, token, "flavors"))
+        _dest_catalogs[key] = catalog
+        return lookup(catalog)
+
     def _get_server_info(self, end_point, token, request_list):
         if not request_list in ('images', 'flavors', 'extensions', 'servers'):
             LOG.debug("Error, Cannot support listing for %s\n" % request_list)
@@ -385,58 +743,29 @@ class CloudletAPI(nova_rpc.ComputeAPI):
             end_string = "%s/%s/detail" % (end_point[2], request_list)
 
         # HTTP response
-        conn = httplib.HTTPConnection(end_point[1])
-        conn.request("GET", end_string, params, headers)
-        response = conn.getresponse()
-        data = response.read()
+        status, data = _http_pool.request(end_point[1], "GET", end_string,
+                                          params, headers)
         dd = jsonutils.loads(data)
-        conn.close()
         return dd[request_list]
 
     def handoff_port_forwarding(self, dest_ip, dest_port):
         # type(dest_ip) = netaddr.ip.IPAddress at kilo
-        o = PortForwarding(str(dest_ip), int(dest_port))
-        # port forwarding server will finish automatically whne a client
-        # disconnects
-        o.start()
-        return o.source_port
-
-
-class PortForwarding(threading.Thread):
-
-    """Forward VM handoff packet to the compute node"""
-
-    def __init__(self, dest_ip, dest_port, source_port=None):
-        self.dest_ip = dest_ip
-        self.dest_port = dest_port
-        if source_port is None:
-            import socket
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.bind(('0.0.0.0', 0))   # get free TCP port
-            local_port = int(sock.getsockname()[1])
-            self.source_port = local_port
-        else:
-            self.source_port = source_port
-        threading.Thread.__init__(self, target=self.port_forwarding)
-
-    def port_forwarding(self):
-        local_addr = ('0.0.0.0', self.source_port)
-        remote_addr = (self.dest_ip, self.dest_port)
-        LOG.info("Port forwarding starts from %s to %s" % (str(local_addr),
-                                                           str(remote_addr)))
-        listener = eventlet.listen(local_addr)
-        client, addr = listener.accept()
-        server = eventlet.connect(remote_addr)
-        eventlet.spawn_n(self.forward, client, server, self.closed_callback)
-        eventlet.spawn_n(self.forward, server, client)
-
-    def closed_callback(self):
-        LOG.info("Port forwarding finished.")
-
-    def forward(self, source, dest, cb=lambda: None):
-        while True:
-            d = source.recv(32384)
-            if d == '':
-                cb()
-                break
-            dest.sendall(d)
+        # the stream is closed automatically when a client disconnects
+        return _get_port_forwarder().forward(str(dest_ip), int(dest_port))
+
+
+_port_forwarder = None
+
+
+def _get_port_forwarder():
+    global _port_forwarder
+    if _port_forwarder is None:
+        port_range = None
+        if CONF.cloudlet.handoff_forward_port_range:
+            first, last = CONF.cloudlet.handoff_forward_port_range.split(":")
+            port_range = (int(first), int(last))
+        _port_forwarder = HandoffPortForwarder(
+            port_range=port_range,
+            idle_timeout=CONF.cloudlet.handoff_forward_idle_timeout,
+            buffer_size=CONF.cloudlet.handoff_forward_buffer_size)
+    return _port_forwarder
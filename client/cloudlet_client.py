@@ -71,6 +71,40 @@ def get_list(server_address, token, end_point, request_list):
     return dd[request_list]
 
 
+def find_basevm(server_address, token, end_point, base_sha256_uuid):
+    """Return base disk image having base_sha256_uuid, or None.
+
+    Ask base VM lookup of os-cloudlet extension, and look through the whole
+    image list if the server does not support it.
+    """
+    params = urllib.urlencode({"sha256": base_sha256_uuid})
+    headers = {"X-Auth-Token": token, "Content-type": "application/json"}
+    conn = httplib.HTTPConnection(end_point[1])
+    conn.request("GET", "%s/os-cloudlet/base_vms?%s" % (end_point[2], params),
+                 "", headers)
+    response = conn.getresponse()
+    data = response.read()
+    conn.close()
+    if response.status == 200:
+        base_vms = json.loads(data).get("base_vms", [])
+        if len(base_vms) > 0:
+            return base_vms[0]
+        return None
+
+    image_list = get_list(server_address, token, end_point, "images")
+    for image in image_list:
+        properties = image.get("metadata", None)
+        if properties is None or len(properties) == 0:
+            continue
+        if properties.get(CLOUDLET_TYPE.PROPERTY_KEY_CLOUDLET_TYPE) != \
+                CLOUDLET_TYPE.IMAGE_TYPE_BASE_DISK:
+            continue
+        if properties.get(CLOUDLET_TYPE.PROPERTY_KEY_BASE_UUID) == \
+                base_sha256_uuid:
+            return image
+    return None
+
+
 def request_synthesis(server_address, token, end_point, key_name=None,
                       server_name=None, overlay_url=None):
     # read meta data from vm overlay URL
@@ -86,27 +120,19 @@ def request_synthesis(server_address, token, end_point, key_name=None,
     requested_basevm_id = meta_info['base_vm_sha256']
 
     # find matching base VM
-    image_list = get_list(server_address, token, end_point, "images")
     basevm_uuid = None
     basevm_xml = None
     basevm_name = None
     basevm_disk = 0
-    for image in image_list:
-        properties = image.get("metadata", None)
-        if properties is None or len(properties) == 0:
-            continue
-        if properties.get(CLOUDLET_TYPE.PROPERTY_KEY_CLOUDLET_TYPE) != \
-                CLOUDLET_TYPE.IMAGE_TYPE_BASE_DISK:
-            continue
-        base_sha256_uuid = properties.get(CLOUDLET_TYPE.PROPERTY_KEY_BASE_UUID)
-        if base_sha256_uuid == requested_basevm_id:
-            basevm_uuid = image['id']
-            basevm_name = image['name']
-            basevm_xml = properties.get(
-                CLOUDLET_TYPE.PROPERTY_KEY_BASE_RESOURCE,
-                None)
-            basevm_disk = image.get('minDisk', 0)
-            break
+    image = find_basevm(server_address, token, end_point, requested_basevm_id)
+    if image is not None:
+        properties = image.get("metadata", None) or {}
+        basevm_uuid = image['id']
+        basevm_name = image['name']
+        basevm_xml = properties.get(
+            CLOUDLET_TYPE.PROPERTY_KEY_BASE_RESOURCE,
+            None)
+        basevm_disk = image.get('minDisk', 0)
     if basevm_uuid is None:
         raise CloudletClientError("Cannot find matching Base VM with (%s)" %
                                   str(requested_basevm_id))
@@ -164,27 +190,19 @@ def _request_handoff_recv(server_address, token, end_point,
     requested_basevm_id = meta_info['base_vm_sha256']
 
     # find matching base VM
-    image_list = get_list(server_address, token, end_point, "images")
     basevm_uuid = None
     basevm_xml = None
     basevm_name = None
     basevm_disk = 0
-    for image in image_list:
-        properties = image.get("metadata", None)
-        if properties is None or len(properties) == 0:
-            continue
-        if properties.get(CLOUDLET_TYPE.PROPERTY_KEY_CLOUDLET_TYPE) != \
-                CLOUDLET_TYPE.IMAGE_TYPE_BASE_DISK:
-            continue
-        base_sha256_uuid = properties.get(CLOUDLET_TYPE.PROPERTY_KEY_BASE_UUID)
-        if base_sha256_uuid == requested_basevm_id:
-            basevm_uuid = image['id']
-            basevm_name = image['name']
-            basevm_xml = properties.get(
-                CLOUDLET_TYPE.PROPERTY_KEY_BASE_RESOURCE,
-                None)
-            basevm_disk = image.get('minDisk', 0)
-            break
+    image = find_basevm(server_address, token, end_point, requested_basevm_id)
+    if image is not None:
+        properties = image.get("metadata", None) or {}
+        basevm_uuid = image['id']
+        basevm_name = image['name']
+        basevm_xml = properties.get(
+            CLOUDLET_TYPE.PROPERTY_KEY_BASE_RESOURCE,
+            None)
+        basevm_disk = image.get('minDisk', 0)
     if basevm_uuid is None:
         raise CloudletClientError(
             "Cannot find matching Base VM with (%s)" %
@@ -278,6 +296,21 @@ def request_cloudlet_base(server_address, token, end_point,
     return data
 
 
+def request_cloudlet_base_status(server_address, token, end_point,
+                                 server_uuid):
+    headers = {"X-Auth-Token": token, "Content-type": "application/json"}
+    conn = httplib.HTTPConnection(end_point[1])
+    command = "%s/os-cloudlet/%s/status" % (end_point[2], server_uuid)
+    conn.request("GET", command, "", headers)
+    response = conn.getresponse()
+    data = response.read()
+    conn.close()
+    if response.status != 200:
+        raise CloudletClientError("cannot get status of %s: %s" %
+                                  (server_uuid, data))
+    return json.loads(data).get('cloudlet-base')
+
+
 def request_cloudlet_overlay_start(server_address, token, end_point,
                                    image_name, key_name):
     # get right iamge
@@ -484,19 +517,11 @@ def request_import_basevm(server_address, token,
         PackagingUtil._get_basevm_attribute(import_filepath)
 
     # check duplicated base VM
-    image_list = get_list(server_address, token, endpoint, "images")
-    for image in image_list:
-        properties = image.get("metadata", None)
-        if properties is None or len(properties) == 0:
-            continue
-        if properties.get(CLOUDLET_TYPE.PROPERTY_KEY_CLOUDLET_TYPE) != \
-                CLOUDLET_TYPE.IMAGE_TYPE_BASE_DISK:
-            continue
-        base_sha256_uuid = properties.get(CLOUDLET_TYPE.PROPERTY_KEY_BASE_UUID)
-        if base_sha256_uuid == base_hashvalue:
-            msg = "Duplicated base VM is already exists on the system\n"
-            msg += "Image UUID of duplicated Base VM: %s\n" % image['id']
-            raise CloudletClientError(msg)
+    image = find_basevm(server_address, token, endpoint, base_hashvalue)
+    if image is not None:
+        msg = "Duplicated base VM is already exists on the system\n"
+        msg += "Image UUID of duplicated Base VM: %s\n" % image['id']
+        raise CloudletClientError(msg)
 
     # decompress files
     temp_dir = mkdtemp(prefix="cloudlet-base-")
@@ -746,6 +771,7 @@ def get_cloudlet_base_list(server_address, uname, password):
 
 def main(argv=None):
     CMD_CREATE_BASE = "create-base"
+    CMD_BASE_STATUS = "base-status"
     CMD_EXPORT_BASE = "export-base"
     CMD_IMPORT_BASE = "import-base"
     CMD_CREATE_OVERLAY = "create-overlay"
@@ -756,6 +782,7 @@ def main(argv=None):
     CMD_EXT_LIST = "ext-list"
     commands = {
         CMD_CREATE_BASE: "create base vm from the running instance",
+        CMD_BASE_STATUS: "show progress of base vm creation",
         CMD_CREATE_OVERLAY: "create VM overlay from the customizaed VM",
         CMD_DOWNLOAD: "Download VM overlay",
         CMD_SYNTHESIS: "VM Synthesis (Need downloadable URLs for VM overlay)",
@@ -788,6 +815,21 @@ def main(argv=None):
         request_cloudlet_base(settings.server_address, token,
                               urlparse(endpoint), instance_uuid,
                               snapshot_name)
+    elif args[0] == CMD_BASE_STATUS:
+        if len(args) != 2:
+            msg = "Error: base VM status needs [VM UUID]\n"
+            msg += " 1) VM UUID: UUID of an instance creating base VM\n"
+            sys.stderr.write(msg)
+            sys.exit(1)
+        instance_uuid = args[1]
+        try:
+            ret = request_cloudlet_base_status(settings.server_address, token,
+                                               urlparse(endpoint),
+                                               instance_uuid)
+            pprint(ret)
+        except CloudletClientError as e:
+            sys.stderr.write("Error: %s\n" % str(e))
+            sys.exit(1)
     elif args[0] == CMD_CREATE_OVERLAY:
         if len(args) != 3:
             msg = "Error: creating VM overlay needs [VM UUID] and [new name]\n"
@@ -0,0 +1,23 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""Helpers shared by the cloudlet driver, the cloudlet API and the
+handoff processes of elijah-provisioning
+
+Modules here do not import nova, so handoff-proc can load them and they
+can be tested without a nova tree. fabfile.py deploys the package next to
+nova in dist-packages.
+"""
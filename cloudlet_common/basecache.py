@@ -0,0 +1,285 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import hashlib
+import logging
+import os
+import shutil
+import time
+
+import eventlet
+
+LOG = logging.getLogger(__name__)
+
+
+class CloudletBaseCache(object):
+
+    """Compute-node cache of base VMs keyed by base_sha256_uuid
+
+    The disk, memory and both hash lists of a base VM are cached together
+    under <cache_dir>/<base_sha256_uuid>/, so that several glance copies of
+    the same base VM share one cache entry. Base VMs in use by an instance
+    or pinned are never evicted.
+
+    Base VM artifacts used to be cached one file per glance image in the
+    libvirt image cache, named by the sha1 of the image id. If legacy_dir
+    points there, such files are hard linked into the new entry instead of
+    being downloaded again, and the legacy memory and hash files are
+    removed. The legacy disk is left to the libvirt image cache manager,
+    since VMs resumed before the upgrade may still run on it.
+    """
+
+    ARTIFACT_DISK = "disk"
+    ARTIFACT_MEMORY = "memory"
+    ARTIFACT_DISK_HASH = "disk_hash"
+    ARTIFACT_MEMORY_HASH = "memory_hash"
+    ARTIFACTS = (ARTIFACT_DISK, ARTIFACT_MEMORY,
+                 ARTIFACT_DISK_HASH, ARTIFACT_MEMORY_HASH)
+    PART_SUFFIX = ".part"
+
+    def __init__(self, cache_dir, fetch_func, max_bytes=0, policy='lru',
+                 pinned=None, legacy_dir=None):
+        """
+        :param fetch_func: called as fetch_func(context, path, image_id,
+                           user_id, project_id) to download a glance image
+        """
+        self.cache_dir = cache_dir
+        self.fetch_func = fetch_func
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.pinned = set(pinned or [])
+        self.legacy_dir = legacy_dir
+        self.users = dict()         # base_sha256_uuid -> instance uuids
+        self.entries = dict()       # base_sha256_uuid -> entry info
+        self.stats = {'hits': 0, 'misses': 0, 'shared_fetches': 0,
+                      'evictions': 0, 'legacy_adopted': 0}
+        self._inflight = dict()     # base_sha256_uuid -> fetching thread
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self._scan()
+
+    def _base_dir(self, base_uuid):
+        return os.path.join(self.cache_dir, base_uuid)
+
+    def paths(self, base_uuid):
+        """Return a dict of artifact name to its path in the cache"""
+        base_dir = self._base_dir(base_uuid)
+        return dict((artifact, os.path.join(base_dir, artifact))
+                    for artifact in self.ARTIFACTS)
+
+    @staticmethod
+    def _disk_usage(paths):
+        # base disk is sparse; account for the blocks actually used
+        return sum(os.stat(path).st_blocks * 512 for path in paths)
+
+    def _scan(self):
+        for base_uuid in os.listdir(self.cache_dir):
+            paths = self.paths(base_uuid).values()
+            if not all(os.path.exists(path) for path in paths):
+                # left behind by a fetch interrupted by a restart
+                LOG.info("cloudlet, removing partial base VM %s from cache"
+                         % base_uuid)
+                shutil.rmtree(self._base_dir(base_uuid), ignore_errors=True)
+                continue
+            self.entries[base_uuid] = {
+                'size': self._disk_usage(paths),
+                'last_used': os.path.getmtime(self._base_dir(base_uuid)),
+                'use_count': 0,
+                }
+
+    def get(self, context, instance, base_uuid, image_ids, acquire=False):
+        """Return paths of the cached base VM in ARTIFACTS order, fetching
+        it on a miss
+
+        :param image_ids: dict of artifact name to glance image id
+        :param acquire: mark the base VM as used by the instance
+        """
+        return self.prefetch(context, instance, base_uuid, image_ids,
+                             acquire=acquire).wait()
+
+    def prefetch(self, context, instance, base_uuid, image_ids,
+                 acquire=False):
+        """Start fetching the base VM in the background
+
+        All artifacts are downloaded concurrently. Instances asking for a
+        base VM that is already being fetched share the same download.
+        Returns a BaseVMPrefetch handle to wait on.
+        """
+        if acquire:
+            self.acquire(base_uuid, instance['uuid'])
+        if base_uuid in self.entries:
+            self.stats['hits'] += 1
+            LOG.debug("cloudlet, base VM cache hit: %s" % base_uuid)
+            self._touch(base_uuid)
+            return BaseVMPrefetch(self.paths(base_uuid))
+
+        fetch_thread = self._inflight.get(base_uuid, None)
+        if fetch_thread is None:
+            self.stats['misses'] += 1
+            LOG.info("cloudlet, base VM cache miss: %s" % base_uuid)
+            fetch_thread = eventlet.spawn(self._fetch, context, instance,
+                                          base_uuid, image_ids)
+            self._inflight[base_uuid] = fetch_thread
+        else:
+            self.stats['shared_fetches'] += 1
+            LOG.info("cloudlet, waiting for base VM %s being fetched" %
+                     base_uuid)
+        return BaseVMPrefetch(self.paths(base_uuid), fetch_thread)
+
+    def _touch(self, base_uuid):
+        entry = self.entries[base_uuid]
+        entry['last_used'] = time.time()
+        entry['use_count'] += 1
+        os.utime(self._base_dir(base_uuid), None)
+
+    def _legacy_path(self, image_id):
+        if self.legacy_dir is None:
+            return None
+        return os.path.join(self.legacy_dir,
+                            hashlib.sha1(image_id).hexdigest())
+
+    def _adopt_legacy(self, artifact, image_id, path):
+        legacy_path = self._legacy_path(image_id)
+        if legacy_path is None or not os.path.exists(legacy_path):
+            return False
+        try:
+            os.link(legacy_path, path)
+        except OSError as e:
+            LOG.warning("cloudlet, cannot reuse %s of the legacy cache: %s"
+                        % (legacy_path, str(e)))
+            return False
+        if artifact != self.ARTIFACT_DISK:
+            os.remove(legacy_path)
+        self.stats['legacy_adopted'] += 1
+        return True
+
+    def _fetch(self, context, instance, base_uuid, image_ids):
+        paths = self.paths(base_uuid)
+        base_dir = self._base_dir(base_uuid)
+        if not os.path.isdir(base_dir):
+            os.makedirs(base_dir)
+
+        timings = dict()
+
+        def _fetch_artifact(artifact):
+            path = paths[artifact]
+            if os.path.exists(path):
+                return
+            if self._adopt_legacy(artifact, image_ids[artifact], path):
+                LOG.debug("cloudlet, reused %s of base VM %s from the "
+                          "legacy cache" % (artifact, base_uuid))
+                return
+            start = time.time()
+            tmp_path = path + self.PART_SUFFIX
+            try:
+                self.fetch_func(context, tmp_path, image_ids[artifact],
+                                instance['user_id'], instance['project_id'])
+                os.rename(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            timings[artifact] = time.time() - start
+            LOG.debug("cloudlet, fetched %s of base VM %s" %
+                      (artifact, base_uuid))
+
+        try:
+            fetch_threads = [eventlet.spawn(_fetch_artifact, artifact)
+                             for artifact in self.ARTIFACTS]
+            error = None
+            for fetch_thread in fetch_threads:
+                try:
+                    fetch_thread.wait()
+                except Exception as e:
+                    error = error or e
+            if error is not None:
+                raise error
+            self.entries[base_uuid] = {
+                'size': self._disk_usage(paths.values()),
+                'last_used': 0,
+                'use_count': 0,
+                }
+            self._touch(base_uuid)
+        finally:
+            del self._inflight[base_uuid]
+            if base_uuid not in self.entries:
+                # a partial entry is neither usable nor in the budget
+                shutil.rmtree(base_dir, ignore_errors=True)
+        self._evict()
+        return timings
+
+    def acquire(self, base_uuid, instance_uuid):
+        """Mark the base VM as used by a running instance"""
+        self.users.setdefault(base_uuid, set()).add(instance_uuid)
+
+    def release(self, instance_uuid):
+        for base_uuid, instance_uuids in self.users.items():
+            instance_uuids.discard(instance_uuid)
+            if not instance_uuids:
+                del self.users[base_uuid]
+
+    def pin(self, base_uuid):
+        self.pinned.add(base_uuid)
+
+    def unpin(self, base_uuid):
+        self.pinned.discard(base_uuid)
+
+    def total_size(self):
+        return sum(entry['size'] for entry in self.entries.values())
+
+    def _evict(self):
+        if not self.max_bytes:
+            return
+        candidates = [base_uuid for base_uuid in self.entries
+                      if base_uuid not in self.pinned and
+                      base_uuid not in self.users and
+                      base_uuid not in self._inflight]
+        if self.policy == 'lfu':
+            sort_key = lambda base_uuid: (
+                self.entries[base_uuid]['use_count'],
+                self.entries[base_uuid]['last_used'])
+        else:
+            sort_key = lambda base_uuid: self.entries[base_uuid]['last_used']
+        candidates.sort(key=sort_key)
+        while self.total_size() > self.max_bytes and candidates:
+            base_uuid = candidates.pop(0)
+            LOG.info("cloudlet, evicting base VM %s from cache" % base_uuid)
+            del self.entries[base_uuid]
+            shutil.rmtree(self._base_dir(base_uuid), ignore_errors=True)
+            self.stats['evictions'] += 1
+        if self.total_size() > self.max_bytes:
+            LOG.warning("cloudlet, base VM cache exceeds its budget "
+                        "since every cached base VM is pinned or in use")
+
+
+class BaseVMPrefetch(object):
+
+    """Handle of a base VM fetch started by CloudletBaseCache.prefetch"""
+
+    def __init__(self, paths, fetch_thread=None):
+        self.paths = paths
+        self.fetch_thread = fetch_thread
+        # seconds spent fetching each artifact, empty on a cache hit
+        self.fetch_timings = dict()
+
+    def ready(self):
+        return self.fetch_thread is None or self.fetch_thread.dead
+
+    def wait(self):
+        """Return paths of base disk, memory, disk hash and memory hash"""
+        if self.fetch_thread is not None:
+            self.fetch_timings = self.fetch_thread.wait()
+        return [self.paths[artifact]
+                for artifact in CloudletBaseCache.ARTIFACTS]
@@ -0,0 +1,64 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+
+class ChunkBitmap(object):
+
+    """Set of modified disk chunks kept as a bitmap
+
+    It costs one bit per disk chunk instead of an object per chunk, which
+    matters for a VM whose whole disk counts as modified.
+    """
+
+    def __init__(self, chunks=(), runs=()):
+        self._bits = bytearray()
+        self._count = 0
+        self.update(chunks)
+        self.add_runs(runs)
+
+    def add(self, chunk):
+        chunk = int(chunk)
+        index = chunk >> 3
+        if index >= len(self._bits):
+            self._bits.extend(bytearray(index + 1 - len(self._bits)))
+        mask = 1 << (chunk & 7)
+        if not self._bits[index] & mask:
+            self._bits[index] |= mask
+            self._count += 1
+
+    def update(self, chunks):
+        for chunk in chunks:
+            self.add(chunk)
+
+    def add_runs(self, runs):
+        """Add chunks given as [start, length, ...]"""
+        for start, length in zip(runs[::2], runs[1::2]):
+            self.update(xrange(start, start + length))
+
+    def __contains__(self, chunk):
+        index = chunk >> 3
+        return index < len(self._bits) and \
+            bool(self._bits[index] & (1 << (chunk & 7)))
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for index, byte in enumerate(self._bits):
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        yield (index << 3) + bit
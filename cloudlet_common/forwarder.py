@@ -0,0 +1,246 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import logging
+import os
+import socket
+import time
+
+import eventlet
+from eventlet.hubs import trampoline
+
+LOG = logging.getLogger(__name__)
+
+
+_SPLICE_F_MOVE = 1
+_SPLICE_F_NONBLOCK = 2
+_F_SETPIPE_SZ = 1031
+
+
+def _load_splice():
+    """Return splice(2) of libc, or None if it is not available"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        splice = libc.splice
+    except (OSError, AttributeError):
+        return None
+    splice.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int,
+                       ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint]
+    splice.restype = ctypes.c_ssize_t
+    return splice
+
+
+class _IdleTimeout(Exception):
+    pass
+
+
+class ForwardingError(Exception):
+    pass
+
+
+class HandoffPortForwarder(object):
+
+    """Forward VM handoff streams from clients to compute nodes
+
+    Each forwarded stream gets a port from the configured range, accepts
+    one client and relays both directions in green threads. Data is moved
+    between sockets inside the kernel with splice(2) through a pipe, or
+    through a large user-space buffer where splice is not available.
+    Streams idle for longer than idle_timeout are closed and their ports
+    are reused.
+    """
+
+    def __init__(self, port_range=None, idle_timeout=300,
+                 buffer_size=1024 * 1024, bind_address='0.0.0.0'):
+        self.bind_address = bind_address
+        self.idle_timeout = idle_timeout
+        self.buffer_size = buffer_size
+        self.free_ports = None
+        if port_range:
+            first, last = port_range
+            self.free_ports = range(first, last + 1)
+        self.streams = dict()   # source port -> stream info
+        self.splice = _load_splice()
+
+    def _listen(self):
+        if self.free_ports is None:
+            return eventlet.listen((self.bind_address, 0))
+        for port in list(self.free_ports):
+            try:
+                listener = eventlet.listen((self.bind_address, port))
+            except socket.error:
+                continue
+            self.free_ports.remove(port)
+            return listener
+        raise ForwardingError("No free port for handoff forwarding")
+
+    def forward(self, dest_ip, dest_port):
+        """Start forwarding a new port to dest_ip:dest_port and return it"""
+        listener = self._listen()
+        source_port = listener.getsockname()[1]
+        stream = {
+            'dest': (dest_ip, dest_port),
+            'bytes_to_dest': 0,
+            'bytes_from_dest': 0,
+            'started_at': time.time(),
+            'last_active': time.time(),
+            }
+        self.streams[source_port] = stream
+        LOG.info("Port forwarding starts from %d to %s:%d" %
+                 (source_port, dest_ip, dest_port))
+        stream['thread'] = eventlet.spawn(self._serve, listener,
+                                          source_port, stream)
+        return source_port
+
+    def close(self, source_port):
+        """Stop forwarding source_port, closing its listener and stream"""
+        stream = self.streams.get(source_port, None)
+        if stream is None:
+            return
+        if stream['thread']:
+            stream['thread'].kill()
+        else:
+            # not started yet, it cleans up as soon as it starts
+            stream['closed'] = True
+
+    def _serve(self, listener, source_port, stream):
+        client = server = None
+        pumps = list()
+        try:
+            if stream.get('closed', False):
+                return
+            with eventlet.Timeout(self.idle_timeout):
+                client, addr = listener.accept()
+            listener.close()
+            listener = None
+            server = eventlet.connect(stream['dest'])
+            stream['last_active'] = time.time()
+            pumps = [eventlet.spawn(self._pump, stream, client, server,
+                                    'bytes_to_dest'),
+                     eventlet.spawn(self._pump, stream, server, client,
+                                    'bytes_from_dest')]
+            for pump in pumps:
+                pump.wait()
+        except eventlet.Timeout:
+            LOG.warning("No client connected to handoff port %d in %d "
+                        "seconds" % (source_port, self.idle_timeout))
+        except Exception as e:
+            LOG.warning("Port forwarding to %s:%d failed: %s" %
+                        (stream['dest'][0], stream['dest'][1], str(e)))
+        finally:
+            for pump in pumps:
+                pump.kill()
+            for sock in (listener, client, server):
+                if sock is not None:
+                    sock.close()
+            del self.streams[source_port]
+            if self.free_ports is not None:
+                self.free_ports.append(source_port)
+            LOG.info("Port forwarding finished. %d bytes to %s:%d, "
+                     "%d bytes back in %.1f seconds" %
+                     (stream['bytes_to_dest'], stream['dest'][0],
+                      stream['dest'][1], stream['bytes_from_dest'],
+                      time.time() - stream['started_at']))
+
+    def _wait(self, stream, sock, read=False, write=False):
+        """Wait until sock is ready, unless the whole stream is idle"""
+        while True:
+            try:
+                trampoline(sock, read=read, write=write,
+                           timeout=self.idle_timeout,
+                           timeout_exc=_IdleTimeout)
+                return
+            except _IdleTimeout:
+                if time.time() - stream['last_active'] >= self.idle_timeout:
+                    raise
+
+    def _pump(self, stream, source, dest, counter):
+        try:
+            if self.splice is not None:
+                self._pump_splice(stream, source, dest, counter)
+            else:
+                self._pump_buffer(stream, source, dest, counter)
+        except _IdleTimeout:
+            LOG.warning("Closing handoff stream to %s:%d idle for %d "
+                        "seconds" % (stream['dest'][0], stream['dest'][1],
+                                     self.idle_timeout))
+        except (socket.error, OSError) as e:
+            LOG.debug("handoff stream closed: %s" % str(e))
+        finally:
+            # let the other side see EOF, which ends the other direction
+            for sock, how in ((dest, socket.SHUT_WR),
+                              (source, socket.SHUT_RD)):
+                try:
+                    sock.shutdown(how)
+                except socket.error:
+                    pass
+
+    def _pump_buffer(self, stream, source, dest, counter):
+        while True:
+            try:
+                data = source.recv(self.buffer_size)
+            except socket.error as e:
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                self._wait(stream, source, read=True)
+                continue
+            if not data:
+                return
+            dest.sendall(data)
+            stream[counter] += len(data)
+            stream['last_active'] = time.time()
+
+    def _splice(self, fd_in, fd_out, length):
+        nbytes = self.splice(fd_in, None, fd_out, None, length,
+                             _SPLICE_F_MOVE | _SPLICE_F_NONBLOCK)
+        if nbytes < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return None
+            raise OSError(err, os.strerror(err))
+        return nbytes
+
+    def _pump_splice(self, stream, source, dest, counter):
+        pipe_read, pipe_write = os.pipe()
+        try:
+            chunk_size = self.buffer_size
+            try:
+                fcntl.fcntl(pipe_write, _F_SETPIPE_SZ, self.buffer_size)
+            except IOError:
+                # pipe keeps the default capacity of 64KB
+                chunk_size = min(chunk_size, 64 * 1024)
+            while True:
+                nbytes = self._splice(source.fileno(), pipe_write, chunk_size)
+                if nbytes is None:
+                    self._wait(stream, source, read=True)
+                    continue
+                if nbytes == 0:
+                    return
+                remaining = nbytes
+                while remaining > 0:
+                    sent = self._splice(pipe_read, dest.fileno(), remaining)
+                    if sent is None:
+                        self._wait(stream, dest, write=True)
+                        continue
+                    remaining -= sent
+                stream[counter] += nbytes
+                stream['last_active'] = time.time()
+        finally:
+            os.close(pipe_read)
+            os.close(pipe_write)
@@ -0,0 +1,120 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import os
+
+from elijah.provisioning.configuration import Const as Cloudlet_Const
+from elijah.provisioning.configuration import VMOverlayCreationMode
+
+
+class HandoffModeSelector(object):
+
+    """Choose compression and deduplication of VM handoff for the link
+
+    Each profile has a rough per-core rate of input bytes and the ratio of
+    output to input size. With the compression pipelined with the transfer,
+    a profile delivers min(rate * cores, bandwidth / ratio) input bytes per
+    second. The profile with the highest rate is chosen before a handoff
+    starts, given the idle cores and the bandwidth last measured to the
+    destination, and kept for the whole handoff.
+    """
+
+    # (compression, level, diff algorithm, input bytes/s per core, ratio)
+    PROFILES = (
+        ('COMPRESSION_GZIP', 1, 'none', 60 * 1024 * 1024, 0.45),
+        ('COMPRESSION_LZMA', 1, 'none', 15 * 1024 * 1024, 0.35),
+        ('COMPRESSION_LZMA', 5, 'xdelta3', 5 * 1024 * 1024, 0.28),
+        ('COMPRESSION_LZMA', 9, 'xdelta3', 2 * 1024 * 1024, 0.25),
+        )
+    # weight of a new bandwidth measurement
+    ALPHA = 0.5
+
+    def __init__(self, default_bandwidth):
+        self.default_bandwidth = default_bandwidth
+        self.bandwidth = dict()     # destination -> bytes/s
+        self.profiles = [profile for profile in self.PROFILES
+                         if hasattr(Cloudlet_Const, profile[0])]
+
+    @staticmethod
+    def idle_cores():
+        cpu_count = os.sysconf('SC_NPROCESSORS_ONLN')
+        load = os.getloadavg()[0]
+        return max(1, min(cpu_count, int(cpu_count - load)))
+
+    @staticmethod
+    def rate(profile, cores, bandwidth):
+        """input bytes per second delivered by the profile"""
+        return min(profile[3] * cores, bandwidth / profile[4])
+
+    def choose(self, destination, cores):
+        bandwidth = self.bandwidth.get(destination, self.default_bandwidth)
+        if not self.profiles:
+            return None
+        return max(self.profiles,
+                   key=lambda profile: self.rate(profile, cores, bandwidth))
+
+    def observe(self, destination, profile, cores, wire_rate):
+        """Update the bandwidth to the destination from the rate at which
+        the profile is sending. The link is only known to be the limit when
+        the profile sends slower than the cores could compress.
+        """
+        if wire_rate <= 0:
+            return
+        bandwidth = self.bandwidth.get(destination, self.default_bandwidth)
+        if profile is not None and \
+                wire_rate >= 0.8 * profile[3] * cores * profile[4]:
+            # compression bound, the link can take at least this
+            measured = max(bandwidth, wire_rate)
+        else:
+            measured = wire_rate
+        self.bandwidth[destination] = \
+            self.ALPHA * measured + (1 - self.ALPHA) * bandwidth
+
+    def to_mode(self, profile, cores):
+        """VMOverlayCreationMode of the profile, compressing with the cores
+        """
+        if profile is None:
+            return None
+        mode = VMOverlayCreationMode.get_pipelined_multi_process_finite_queue(
+            num_cores=cores)
+        mode.COMPRESSION_ALGORITHM_TYPE = getattr(Cloudlet_Const, profile[0])
+        mode.COMPRESSION_ALGORITHM_SPEED = profile[1]
+        mode.DISK_DIFF_ALGORITHM = profile[2]
+        mode.MEMORY_DIFF_ALGORITHM = profile[2]
+        return mode
+
+    def tuner(self, destination):
+        return HandoffModeTuner(self, destination)
+
+
+class HandoffModeTuner(object):
+
+    """Handoff mode of one transfer, whose measured rate updates the
+    bandwidth to its destination for the next transfer
+    """
+
+    def __init__(self, selector, destination):
+        self.selector = selector
+        self.destination = destination
+        self.cores = selector.idle_cores()
+        self.profile = selector.choose(destination, self.cores)
+
+    def mode(self):
+        return self.selector.to_mode(self.profile, self.cores)
+
+    def finish(self, progress):
+        """Observe the bytes the transfer put on the wire"""
+        self.selector.observe(self.destination, self.profile, self.cores,
+                              progress.throughput())
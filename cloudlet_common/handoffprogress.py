@@ -0,0 +1,80 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import collections
+import os
+import time
+
+
+class HandoffProgress(object):
+
+    """Progress of a VM handoff measured on this side
+
+    bytes_func returns the bytes transferred so far, such as those relayed
+    to the destination or those written to the residue or launch files.
+    Output of handoff-proc/handoff-server-proc is kept as a short tail used
+    to report failures and read results, instead of being logged as it
+    arrives.
+    """
+
+    TAIL_LINES = 50
+
+    def __init__(self, phase, bytes_func=None, bytes_total=None):
+        self.start_time = time.time()
+        self.phase = phase
+        self.bytes_func = bytes_func
+        self.bytes_sent = 0
+        self.bytes_total = bytes_total
+        self.output_tail = collections.deque(maxlen=self.TAIL_LINES)
+
+    def feed(self, line):
+        self.output_tail.append(line.rstrip("\n"))
+
+    def sample(self):
+        """Measure bytes transferred. Return True if they grew"""
+        if self.bytes_func is None:
+            return False
+        try:
+            nbytes = self.bytes_func()
+        except OSError:
+            return False
+        if nbytes <= self.bytes_sent:
+            return False
+        self.bytes_sent = nbytes
+        return True
+
+    def last_line(self):
+        if len(self.output_tail) == 0:
+            return ''
+        return self.output_tail[-1]
+
+    def throughput(self):
+        """bytes per second"""
+        elapsed = time.time() - self.start_time
+        if elapsed <= 0:
+            return 0.0
+        return self.bytes_sent / elapsed
+
+    def percent(self):
+        if not self.bytes_total:
+            return None
+        return min(100, int(self.bytes_sent * 100 / self.bytes_total))
+
+
+def allocated_bytes(*paths):
+    """Bytes allocated to the files, which are written sparsely"""
+    return sum(os.stat(path).st_blocks * 512
+               for path in paths if os.path.exists(path))
@@ -0,0 +1,107 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import collections
+import logging
+import os
+
+import eventlet
+from eventlet import tpool
+
+from cloudlet_common.hashindex import BaseHashIndex
+
+LOG = logging.getLogger(__name__)
+
+
+class BaseHashDictCache(object):
+
+    """Disk and memory hash dictionaries of recently used base VMs
+
+    Hash dictionaries are needed to create a VM residue at handoff. They are
+    loaded once per base VM and shared by all instances of that base VM.
+    With use_index, the first load also writes a BaseHashIndex next to each
+    hash list, so later loads, even after a restart, only map the index.
+    The least recently used entry is dropped beyond max_entries.
+    """
+
+    INDEX_SUFFIX = ".idx"
+
+    def __init__(self, max_entries, parse_func, use_index=False):
+        """
+        :param parse_func: parse_func(diskhash_path, memhash_path) returning
+                           (basedisk_hashdict, basemem_hashdict), run in a
+                           native thread
+        """
+        self.max_entries = max(1, max_entries)
+        self.parse_func = parse_func
+        self.use_index = use_index
+        self.entries = collections.OrderedDict()  # base_sha256_uuid -> loader
+
+    def preload(self, base_uuid, diskhash_path, memhash_path):
+        """Start loading hash dictionaries in the background"""
+        loader = self.entries.pop(base_uuid, None)
+        if loader is None:
+            LOG.debug("cloudlet, loading hash dictionaries of base VM %s" %
+                      base_uuid)
+            loader = eventlet.spawn(self._load, base_uuid,
+                                    diskhash_path, memhash_path)
+        self.entries[base_uuid] = loader
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return loader
+
+    def get(self, base_uuid, diskhash_path, memhash_path):
+        """Return (basedisk_hashdict, basemem_hashdict), loading them if
+        they are not cached yet
+        """
+        loader = self.preload(base_uuid, diskhash_path, memhash_path)
+        try:
+            return loader.wait()
+        except Exception:
+            # load again at the next request
+            if self.entries.get(base_uuid, None) is loader:
+                del self.entries[base_uuid]
+            raise
+
+    def _load(self, base_uuid, diskhash_path, memhash_path):
+        diskindex_path = diskhash_path + self.INDEX_SUFFIX
+        memindex_path = memhash_path + self.INDEX_SUFFIX
+        if self.use_index and os.path.exists(diskindex_path) and \
+                os.path.exists(memindex_path):
+            try:
+                return (BaseHashIndex(diskindex_path),
+                        BaseHashIndex(memindex_path))
+            except ValueError as e:
+                # written by an older driver, built again below
+                LOG.info("cloudlet, rebuilding hash index of base VM "
+                         "%s: %s" % (base_uuid, str(e)))
+
+        # parsing, sorting and packing take seconds of CPU for a large base
+        # VM, so keep them off the hub that serves RPC and heartbeats
+        basedisk_hashdict, basemem_hashdict = tpool.execute(
+            self.parse_func, diskhash_path, memhash_path)
+        if not self.use_index:
+            return basedisk_hashdict, basemem_hashdict
+        try:
+            tpool.execute(BaseHashIndex.build, diskindex_path,
+                          basedisk_hashdict)
+            tpool.execute(BaseHashIndex.build, memindex_path,
+                          basemem_hashdict)
+        except Exception as e:
+            LOG.warning("cloudlet, cannot build hash index of base VM "
+                        "%s: %s" % (base_uuid, str(e)))
+            return basedisk_hashdict, basemem_hashdict
+        return BaseHashIndex(diskindex_path), BaseHashIndex(memindex_path)
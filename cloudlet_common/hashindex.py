@@ -0,0 +1,167 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import mmap
+import os
+import struct
+import zlib
+
+try:
+    from elijah.provisioning import msgpack
+except ImportError as e:
+    import msgpack
+
+
+class BaseHashIndex(object):
+
+    """Read-only mapping over an on-disk, memory-mapped hash dictionary
+
+    Keys and values are msgpack encoded and kept in an open addressing
+    table of at least twice as many slots as records, indexed by the CRC32
+    of the encoded key, so a lookup mostly reads one slot of the mapped
+    file and no dictionary is built in memory. When pickled, only the path
+    of the index is saved, so another process maps the same file instead
+    of copying its content. This module does not import nova, so that
+    handoff-proc can unpickle it.
+    """
+
+    MAGIC = "CLHIDX02"
+    HEADER = struct.Struct("!8sQQ")         # magic, record count, slots
+    SLOT = struct.Struct("!QIQI")           # key offset/length, value o/l
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as index_file:
+            self._map = mmap.mmap(index_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        if len(self._map) < self.HEADER.size:
+            raise ValueError("Invalid hash index file: %s" % path)
+        magic, self._count, self._slots = \
+            self.HEADER.unpack_from(self._map, 0)
+        if magic != self.MAGIC or not self._slots or len(self._map) < \
+                self.HEADER.size + self._slots * self.SLOT.size:
+            raise ValueError("Invalid hash index file: %s" % path)
+
+    def __reduce__(self):
+        return (BaseHashIndex, (self.path,))
+
+    @staticmethod
+    def _hash(packed_key):
+        return zlib.crc32(packed_key) & 0xffffffff
+
+    @classmethod
+    def build(cls, path, hashdict):
+        slot_count = max(1, 2 * len(hashdict))
+        table = [None] * slot_count
+        for key, value in hashdict.iteritems():
+            packed_key = msgpack.packb(key)
+            slot = cls._hash(packed_key) % slot_count
+            while table[slot] is not None:
+                slot = (slot + 1) % slot_count
+            table[slot] = (packed_key, msgpack.packb(value))
+
+        tmp_path = path + ".part"
+        try:
+            with open(tmp_path, "wb") as index_file:
+                index_file.write(cls.HEADER.pack(
+                    cls.MAGIC, len(hashdict), slot_count))
+                offset = cls.HEADER.size + cls.SLOT.size * slot_count
+                empty = cls.SLOT.pack(0, 0, 0, 0)
+                for entry in table:
+                    if entry is None:
+                        index_file.write(empty)
+                        continue
+                    key, value = entry
+                    index_file.write(cls.SLOT.pack(
+                        offset, len(key), offset + len(key), len(value)))
+                    offset += len(key) + len(value)
+                for entry in table:
+                    if entry is not None:
+                        index_file.write(entry[0])
+                        index_file.write(entry[1])
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.rename(tmp_path, path)
+
+    def _slot(self, slot):
+        return self.SLOT.unpack_from(
+            self._map, self.HEADER.size + slot * self.SLOT.size)
+
+    def _find(self, key):
+        """Return (value offset, value length) of key, or None"""
+        packed_key = msgpack.packb(key)
+        key_len = len(packed_key)
+        slot = self._hash(packed_key) % self._slots
+        while True:
+            key_offset, stored_len, value_offset, value_len = \
+                self._slot(slot)
+            if not key_offset:
+                return None
+            if stored_len == key_len and \
+                    self._map[key_offset:key_offset + key_len] == packed_key:
+                return value_offset, value_len
+            slot = (slot + 1) % self._slots
+
+    def _unpack(self, offset, length):
+        return msgpack.unpackb(self._map[offset:offset + length])
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    has_key = __contains__
+
+    def __getitem__(self, key):
+        found = self._find(key)
+        if found is None:
+            raise KeyError(key)
+        return self._unpack(*found)
+
+    def get(self, key, default=None):
+        found = self._find(key)
+        if found is None:
+            return default
+        return self._unpack(*found)
+
+    def iteritems(self):
+        for slot in xrange(self._slots):
+            key_offset, key_len, value_offset, value_len = self._slot(slot)
+            if key_offset:
+                yield (self._unpack(key_offset, key_len),
+                       self._unpack(value_offset, value_len))
+
+    def iterkeys(self):
+        for key, _ in self.iteritems():
+            yield key
+
+    __iter__ = iterkeys
+
+    def itervalues(self):
+        for _, value in self.iteritems():
+            yield value
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def values(self):
+        return list(self.itervalues())
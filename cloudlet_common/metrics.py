@@ -0,0 +1,103 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import collections
+import contextlib
+import os
+import time
+
+
+class PhaseTimer(object):
+
+    """Wall-clock time spent in each phase of a cloudlet operation"""
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.started = time.time()
+        self.phases = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start)
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def to_dict(self):
+        timings = dict((name, round(seconds, 3))
+                       for name, seconds in self.phases.items())
+        timings['total'] = round(time.time() - self.started, 3)
+        return timings
+
+
+class CloudletMetrics(object):
+
+    """Histograms of phase durations of this compute node, written with
+    the cache counters to a file in Prometheus text format
+    """
+
+    BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300,
+               600, 1800)
+
+    def __init__(self, path):
+        self.path = path
+        self.histograms = dict()    # (operation, phase) -> histogram
+
+    def observe(self, operation, timings):
+        for phase, seconds in timings.items():
+            histogram = self.histograms.setdefault(
+                (operation, phase),
+                {'buckets': [0] * len(self.BUCKETS), 'count': 0, 'sum': 0.0})
+            for index, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    histogram['buckets'][index] += 1
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+
+    def write(self, counters):
+        """
+        :param counters: list of (metric type, metric name, labels, value)
+        """
+        if not self.path:
+            return
+        lines = ["# TYPE cloudlet_phase_seconds histogram"]
+        for (operation, phase), histogram in sorted(self.histograms.items()):
+            labels = 'operation="%s",phase="%s"' % (operation, phase)
+            for bound, count in zip(self.BUCKETS, histogram['buckets']):
+                lines.append('cloudlet_phase_seconds_bucket{%s,le="%s"} %d' %
+                             (labels, bound, count))
+            lines.append('cloudlet_phase_seconds_bucket{%s,le="+Inf"} %d' %
+                         (labels, histogram['count']))
+            lines.append('cloudlet_phase_seconds_sum{%s} %f' %
+                         (labels, histogram['sum']))
+            lines.append('cloudlet_phase_seconds_count{%s} %d' %
+                         (labels, histogram['count']))
+        typed = set()
+        for metric_type, name, labels, value in counters:
+            if name not in typed:
+                lines.append("# TYPE %s %s" % (name, metric_type))
+                typed.add(name)
+            label_str = ",".join('%s="%s"' % item
+                                 for item in sorted(labels.items()))
+            lines.append("%s{%s} %s" % (name, label_str, value))
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.rename(tmp_path, self.path)
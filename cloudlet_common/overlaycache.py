@@ -0,0 +1,231 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import httplib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from hashlib import sha256
+from urlparse import urlsplit
+
+from eventlet import semaphore
+
+try:
+    from elijah.provisioning import msgpack
+except ImportError as e:
+    import msgpack
+
+LOG = logging.getLogger(__name__)
+
+
+class OverlayCache(object):
+
+    """Compute-node cache of decompressed VM overlays
+
+    Entries are keyed by overlay URL and validated against the ETag (or
+    Last-Modified and Content-Length) returned by a HEAD request, or against
+    mtime and size for local files. An entry in use by a synthesis is never
+    evicted. An overlay whose entry is outdated or cannot be validated while
+    in use is downloaded to a private directory instead, removed at release.
+    """
+
+    OVERLAY_FILE = "overlay"
+    META_FILE = "meta"
+    INFO_FILE = "info"
+    PRIVATE_PREFIX = "private-"
+
+    def __init__(self, cache_dir, max_bytes=0):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.users = dict()         # entry key -> instance uuids
+        self.entries = dict()       # entry key -> entry info
+        self.private = dict()       # instance uuid -> private directories
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._locks = dict()        # entry key -> semaphore
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self._scan()
+
+    @staticmethod
+    def _key(overlay_url):
+        return sha256(overlay_url).hexdigest()
+
+    def _entry_path(self, key, fname=''):
+        return os.path.join(self.cache_dir, key, fname)
+
+    def _scan(self):
+        for key in os.listdir(self.cache_dir):
+            if key.startswith(self.PRIVATE_PREFIX):
+                # left by a previous process
+                shutil.rmtree(self._entry_path(key), ignore_errors=True)
+                continue
+            info_path = self._entry_path(key, self.INFO_FILE)
+            if not os.path.exists(info_path):
+                continue
+            with open(info_path) as info_file:
+                info = json.loads(info_file.read())
+            info['last_used'] = os.path.getmtime(self._entry_path(key))
+            self.entries[key] = info
+
+    @staticmethod
+    def get_validator(overlay_url):
+        """Return a string that changes whenever the overlay changes, or None
+        if the overlay cannot be validated
+        """
+        parsed_url = urlsplit(overlay_url)
+        if parsed_url.scheme in ('', 'file'):
+            path = parsed_url.path if parsed_url.scheme else overlay_url
+            if not os.path.exists(path):
+                return None
+            stat = os.stat(path)
+            return "%d|%d" % (stat.st_mtime, stat.st_size)
+        if parsed_url.scheme == 'https':
+            conn = httplib.HTTPSConnection(parsed_url.netloc)
+        elif parsed_url.scheme == 'http':
+            conn = httplib.HTTPConnection(parsed_url.netloc)
+        else:
+            return None
+        request_path = parsed_url.path
+        if parsed_url.query:
+            request_path += "?" + parsed_url.query
+        try:
+            conn.request("HEAD", request_path)
+            response = conn.getresponse()
+            response.read()
+        except (httplib.HTTPException, IOError) as e:
+            LOG.debug("cloudlet, cannot validate overlay %s: %s" %
+                      (overlay_url, str(e)))
+            return None
+        finally:
+            conn.close()
+        if response.status != 200:
+            return None
+        etag = response.getheader('etag', None)
+        if etag:
+            return etag
+        last_modified = response.getheader('last-modified', None)
+        content_length = response.getheader('content-length', None)
+        if last_modified and content_length:
+            return "%s|%s" % (last_modified, content_length)
+        return None
+
+    def get(self, overlay_url, instance_uuid, download_func):
+        """Return (meta_info, path of decompressed overlay, overlay id)
+
+        On a miss, download_func(decomp_path) downloads and decompresses the
+        overlay into decomp_path and returns its meta info. The entry is used
+        by instance_uuid until release() is called.
+        """
+        key = self._key(overlay_url)
+        validator = self.get_validator(overlay_url)
+
+        with self._locks.setdefault(key, semaphore.Semaphore(1)):
+            info = self.entries.get(key, None)
+            if info is not None and validator is not None and \
+                    info['validator'] == validator:
+                self.stats['hits'] += 1
+                LOG.debug("cloudlet, overlay cache hit: %s" % overlay_url)
+            elif info is not None and key in self.users:
+                # outdated or not validated, but still used by others
+                self.stats['misses'] += 1
+                LOG.info("cloudlet, overlay %s in use, downloading a "
+                         "private copy" % overlay_url)
+                return self._get_private(instance_uuid, download_func)
+            else:
+                self.stats['misses'] += 1
+                LOG.info("cloudlet, overlay cache miss: %s" % overlay_url)
+                info = self._add(key, overlay_url, validator, download_func)
+            info['last_used'] = time.time()
+            os.utime(self._entry_path(key), None)
+            self.users.setdefault(key, set()).add(instance_uuid)
+            # only once in use, so that the new entry is not evicted
+            self._evict()
+            with open(self._entry_path(key, self.META_FILE), "rb") as f:
+                meta_info = msgpack.unpackb(f.read())
+            return (meta_info, self._entry_path(key, self.OVERLAY_FILE),
+                    info['overlay_id'])
+
+    def _get_private(self, instance_uuid, download_func):
+        private_dir = tempfile.mkdtemp(prefix=self.PRIVATE_PREFIX,
+                                       dir=self.cache_dir)
+        self.private.setdefault(instance_uuid, []).append(private_dir)
+        overlay_path = os.path.join(private_dir, self.OVERLAY_FILE)
+        try:
+            meta_info = download_func(overlay_path)
+        except Exception:
+            self.release(instance_uuid)
+            raise
+        overlay_id = sha256(msgpack.packb(meta_info)).hexdigest()
+        return (meta_info, overlay_path, overlay_id)
+
+    def _add(self, key, overlay_url, validator, download_func):
+        self._remove(key)
+        entry_dir = self._entry_path(key)
+        os.makedirs(entry_dir)
+        try:
+            meta_info = download_func(
+                self._entry_path(key, self.OVERLAY_FILE))
+            meta_raw = msgpack.packb(meta_info)
+            with open(self._entry_path(key, self.META_FILE), "wb") as f:
+                f.write(meta_raw)
+        except Exception:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            raise
+        info = {
+            'url': overlay_url,
+            'validator': validator,
+            'overlay_id': sha256(meta_raw).hexdigest(),
+            'size': os.path.getsize(self._entry_path(key, self.OVERLAY_FILE)),
+            }
+        if validator is not None:
+            # an overlay that cannot be validated is used only once
+            with open(self._entry_path(key, self.INFO_FILE), "w") as f:
+                f.write(json.dumps(info))
+        info['last_used'] = time.time()
+        self.entries[key] = info
+        return info
+
+    def release(self, instance_uuid):
+        for private_dir in self.private.pop(instance_uuid, []):
+            shutil.rmtree(private_dir, ignore_errors=True)
+        for key, instance_uuids in self.users.items():
+            instance_uuids.discard(instance_uuid)
+            if not instance_uuids:
+                del self.users[key]
+                if self.entries[key]['validator'] is None:
+                    self._remove(key)
+
+    def _remove(self, key):
+        self.entries.pop(key, None)
+        shutil.rmtree(self._entry_path(key), ignore_errors=True)
+
+    def total_size(self):
+        return sum(info['size'] for info in self.entries.values())
+
+    def _evict(self):
+        if not self.max_bytes:
+            return
+        candidates = [key for key in self.entries if key not in self.users]
+        candidates.sort(key=lambda key: self.entries[key]['last_used'])
+        while self.total_size() > self.max_bytes and candidates:
+            key = candidates.pop(0)
+            LOG.info("cloudlet, evicting overlay %s from cache" %
+                     self.entries[key]['url'])
+            self._remove(key)
+            self.stats['evictions'] += 1
@@ -0,0 +1,165 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import ctypes
+import ctypes.util
+import logging
+import os
+
+from eventlet import tpool
+
+from cloudlet_common.basecache import CloudletBaseCache
+
+LOG = logging.getLogger(__name__)
+
+_POSIX_FADV_WILLNEED = 3
+_POSIX_FADV_DONTNEED = 4
+_libc = None
+
+
+def _fadvise(path, advice):
+    """Advise the kernel about the whole file. Returns False if
+    posix_fadvise is not available
+    """
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if hasattr(_libc, 'posix_fadvise'):
+            _libc.posix_fadvise.argtypes = [ctypes.c_int, ctypes.c_int64,
+                                            ctypes.c_int64, ctypes.c_int]
+    if not hasattr(_libc, 'posix_fadvise'):
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return _libc.posix_fadvise(fd, 0, 0, advice) == 0
+    finally:
+        os.close(fd)
+
+
+def _read_through(path, chunk_size=1024 * 1024):
+    with open(path, "rb") as f:
+        while f.read(chunk_size):
+            pass
+
+
+def _mem_available():
+    """Return available memory in bytes, or None if unknown"""
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, ValueError):
+        pass
+    return None
+
+
+class BaseVMPageCacheWarmer(object):
+
+    """Page cache warmer of base VMs on this compute node
+
+    No resumed domain is kept: a running domain cannot be handed over to a
+    new nova instance, since its name, UUID and NICs are fixed when it is
+    restored. Only what a restore reads is kept hot: the base VM is fetched
+    and pinned in the base VM cache, and its memory snapshot is kept in the
+    page cache. A resume of a warm base VM saves the fetch and the disk
+    reads, not the restore itself. Base VMs are dropped, lowest priority
+    first, when available memory falls below the reserve.
+    """
+
+    def __init__(self, base_cache, base_uuids, reserved_bytes, pinned=None):
+        """
+        :param pinned: base VMs pinned by configuration, which stay pinned
+                       when dropped from the page cache
+        """
+        self.base_cache = base_cache
+        self.pinned = set(pinned or [])
+        self.base_uuids = list(base_uuids)      # in priority order
+        self.reserved_bytes = reserved_bytes
+        self.warm = set()
+        self.stats = {'hits': 0, 'misses': 0, 'warms': 0, 'releases': 0}
+
+    def record_resume(self, base_uuid):
+        """Record a resume of the base VM. Returns True if it was warm"""
+        if base_uuid in self.warm:
+            self.stats['hits'] += 1
+            return True
+        self.stats['misses'] += 1
+        return False
+
+    def hit_rate(self):
+        total = self.stats['hits'] + self.stats['misses']
+        if total == 0:
+            return 0.0
+        return float(self.stats['hits']) / total
+
+    def refresh(self, context, find_image_ids):
+        """Warm configured base VMs while memory allows, and drop warm ones
+        under memory pressure
+
+        :param find_image_ids: function returning the glance image ids of
+                               a base VM, or None if it is not in glance
+        """
+        mem_available = _mem_available()
+        if mem_available is not None and \
+                mem_available < self.reserved_bytes:
+            for base_uuid in reversed(self.base_uuids):
+                if base_uuid in self.warm:
+                    self._release(base_uuid)
+                    break
+            return
+
+        for base_uuid in self.base_uuids:
+            if base_uuid in self.warm:
+                continue
+            if base_uuid not in self.base_cache.entries:
+                image_ids = find_image_ids(base_uuid)
+                if image_ids is None:
+                    continue
+                fetch_instance = {'uuid': None,
+                                  'user_id': context.user_id,
+                                  'project_id': context.project_id}
+                self.base_cache.get(context, fetch_instance, base_uuid,
+                                    image_ids)
+            memory_path = self.base_cache.paths(base_uuid)[
+                CloudletBaseCache.ARTIFACT_MEMORY]
+            memory_size = os.path.getsize(memory_path)
+            if mem_available is not None and \
+                    mem_available - memory_size < self.reserved_bytes:
+                break
+            self._warm(base_uuid, memory_path)
+            if mem_available is not None:
+                mem_available -= memory_size
+
+    def _warm(self, base_uuid, memory_path):
+        LOG.info("cloudlet, warming base VM %s" % base_uuid)
+        self.base_cache.pin(base_uuid)
+        if not _fadvise(memory_path, _POSIX_FADV_WILLNEED):
+            tpool.execute(_read_through, memory_path)
+        self.warm.add(base_uuid)
+        self.stats['warms'] += 1
+
+    def _release(self, base_uuid):
+        LOG.info("cloudlet, dropping base VM %s from the page cache "
+                 "under memory pressure" % base_uuid)
+        self.warm.discard(base_uuid)
+        if base_uuid not in self.pinned:
+            self.base_cache.unpin(base_uuid)
+        memory_path = self.base_cache.paths(base_uuid)[
+            CloudletBaseCache.ARTIFACT_MEMORY]
+        if os.path.exists(memory_path):
+            _fadvise(memory_path, _POSIX_FADV_DONTNEED)
+        self.stats['releases'] += 1
@@ -0,0 +1,153 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import functools
+import json
+import logging
+import os
+
+from eventlet import semaphore
+
+LOG = logging.getLogger(__name__)
+
+
+def _synchronized(method):
+    @functools.wraps(method)
+    def _locked(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return _locked
+
+
+class CloudletVMRegistry(object):
+
+    """Cloudlet VMs running on this node, journaled to disk
+
+    Synthesized VMs, used for VM handoff, and resumed base VMs, used for
+    overlay creation, are kept in memory. Their FUSE mountpoint, QMP
+    channel, launch files and disk size are appended to a journal of JSON
+    lines, so that a restarted nova-compute can reattach or clean them up.
+    The journal is compacted when it is loaded and once it grows well
+    beyond the live records.
+    """
+
+    SYNTHESIZED = 'synthesized'
+    RESUMED = 'resumed'
+    COMPACT_MIN_LINES = 100
+
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+        self.vms = {self.SYNTHESIZED: dict(), self.RESUMED: dict()}
+        self.records = dict()       # instance uuid -> journal record
+        self.journal_lines = 0
+        self._lock = semaphore.Semaphore(1)
+
+    def _synthesized_record(self, domain, vm):
+        fuse = vm.fuse
+        record = {
+            'kind': self.SYNTHESIZED,
+            'domain': domain,
+            'fuse_mountpoint': fuse.mountpoint,
+            'fuse_pid': getattr(fuse, 'pid', None) or
+            getattr(getattr(fuse, 'proc', None), 'pid', None),
+            'qemu_logfile': vm.qemu_logfile,
+            'qmp_channel': vm.qmp_channel,
+            'launch_files': getattr(vm, 'launch_files', None) or
+            [path for path in (getattr(vm, 'launch_disk', None),
+                               getattr(vm, 'launch_mem', None))
+             if isinstance(path, basestring)],
+            }
+        try:
+            record['disk_size'] = os.path.getsize(
+                os.path.join(fuse.mountpoint, 'disk', 'image'))
+        except (OSError, TypeError):
+            record['disk_size'] = None
+        return record
+
+    def _append(self, entry):
+        if not self.journal_path:
+            return
+        try:
+            with open(self.journal_path, "a") as journal:
+                journal.write(json.dumps(entry) + "\n")
+                journal.flush()
+                os.fsync(journal.fileno())
+        except (IOError, OSError) as e:
+            LOG.warning("cloudlet, cannot write VM journal: %s" % str(e))
+            return
+        self.journal_lines += 1
+        if self.journal_lines > max(self.COMPACT_MIN_LINES,
+                                    10 * len(self.records)):
+            self._compact()
+
+    def _compact(self):
+        tmp_path = self.journal_path + ".tmp"
+        with open(tmp_path, "w") as journal:
+            for instance_uuid, record in self.records.items():
+                journal.write(json.dumps({
+                    'op': 'add', 'uuid': instance_uuid,
+                    'record': record}) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.rename(tmp_path, self.journal_path)
+        self.journal_lines = len(self.records)
+
+    @_synchronized
+    def load(self):
+        """Replay the journal. Return records of VMs launched by a previous
+        process. They stay in the journal until they are added again or
+        popped, so that a VM the caller skips is looked at again after the
+        next restart.
+        """
+        records = dict()
+        if self.journal_path and os.path.exists(self.journal_path):
+            with open(self.journal_path) as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # torn write at a crash
+                        continue
+                    instance_uuid = entry.get('uuid', None)
+                    if entry.get('op') == 'add':
+                        records[instance_uuid] = entry['record']
+                    elif entry.get('op') == 'remove':
+                        records.pop(instance_uuid, None)
+        self.records = dict(records)
+        if self.journal_path:
+            self._compact()
+        return records
+
+    @_synchronized
+    def add(self, kind, instance_uuid, domain, vm):
+        if kind == self.SYNTHESIZED:
+            record = self._synthesized_record(domain, vm)
+        else:
+            record = {'kind': kind, 'domain': domain}
+        self.vms[kind][instance_uuid] = vm
+        self.records[instance_uuid] = record
+        self._append({'op': 'add', 'uuid': instance_uuid, 'record': record})
+
+    @_synchronized
+    def get(self, kind, instance_uuid):
+        return self.vms[kind].get(instance_uuid, None)
+
+    @_synchronized
+    def pop(self, kind, instance_uuid):
+        vm = self.vms[kind].pop(instance_uuid, None)
+        if self.records.pop(instance_uuid, None) is not None:
+            self._append({'op': 'remove', 'uuid': instance_uuid})
+        return vm
@@ -0,0 +1,116 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import collections
+import contextlib
+import heapq
+import itertools
+
+from eventlet import event
+
+
+class CloudletWorkScheduler(object):
+
+    """Admission control of cloudlet operations on this compute node
+
+    Synthesis, overlay creation, base VM creation and VM handoff all load
+    disk, CPU and network. An operation runs once a slot is free in total
+    and for its type. Waiting operations are admitted by priority, then in
+    arrival order, so a burst queues up instead of slowing every job down.
+    """
+
+    HANDOFF = 'handoff'
+    SYNTHESIS = 'synthesis'
+    OVERLAY = 'overlay'
+    BASE = 'base'
+    PRIORITIES = {HANDOFF: 0, SYNTHESIS: 1, OVERLAY: 2, BASE: 3}
+
+    def __init__(self, max_total, limits, max_queued):
+        """
+        :param max_total: operations running at once, 0 for no limit
+        :param limits: operation type -> running at once, 0 for no limit
+        :param max_queued: operation type -> waiting beyond which new
+                           operations are refused, 0 for no limit
+        """
+        self.max_total = max_total
+        self.limits = limits
+        self.max_queued = max_queued
+        self.running = collections.defaultdict(int)
+        self.waiting = list()       # heap of [priority, seq, type, event]
+        self.seq = itertools.count()
+        self.stats = collections.defaultdict(int)
+
+    def _can_run(self, operation):
+        if self.max_total and sum(self.running.values()) >= self.max_total:
+            return False
+        limit = self.limits.get(operation, 0)
+        return not limit or self.running[operation] < limit
+
+    def queue_depth(self, operation):
+        return sum(1 for entry in self.waiting if entry[2] == operation)
+
+    def refuse(self, operation):
+        self.stats['%s_refused' % operation] += 1
+
+    def is_full(self, operation):
+        """True if a new operation of the type would be refused"""
+        max_queued = self.max_queued.get(operation, 0)
+        return bool(max_queued) and not self._can_run(operation) and \
+            self.queue_depth(operation) >= max_queued
+
+    def _dispatch(self):
+        blocked = list()
+        while self.waiting:
+            entry = heapq.heappop(self.waiting)
+            if self._can_run(entry[2]):
+                self.running[entry[2]] += 1
+                entry[3].send(True)
+            elif self.max_total and \
+                    sum(self.running.values()) >= self.max_total:
+                heapq.heappush(self.waiting, entry)
+                break
+            else:
+                # its type is at its limit, others may use the free slot
+                blocked.append(entry)
+        for entry in blocked:
+            heapq.heappush(self.waiting, entry)
+
+    def _release(self, operation):
+        self.running[operation] -= 1
+        self._dispatch()
+
+    @contextlib.contextmanager
+    def slot(self, operation):
+        """Run the block once the operation is admitted"""
+        self.stats[operation] += 1
+        if self._can_run(operation):
+            self.running[operation] += 1
+        else:
+            entry = [self.PRIORITIES.get(operation, len(self.PRIORITIES)),
+                     next(self.seq), operation, event.Event()]
+            heapq.heappush(self.waiting, entry)
+            try:
+                entry[3].wait()
+            except BaseException:
+                if entry[3].ready():
+                    self._release(operation)
+                else:
+                    self.waiting.remove(entry)
+                    heapq.heapify(self.waiting)
+                raise
+        try:
+            yield
+        finally:
+            self._release(operation)
@@ -0,0 +1,158 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import json
+import logging
+import os
+import shutil
+import time
+from hashlib import sha256
+
+from cloudlet_common.basecache import CloudletBaseCache
+
+LOG = logging.getLogger(__name__)
+
+
+def copy_chunks(src_path, dest_path, chunks, chunk_size):
+    """Copy the given chunks of src_path to the same offsets of dest_path,
+    which must already exist
+    """
+    with open(src_path, "rb") as src, open(dest_path, "r+b") as dest:
+        for chunk in sorted(chunks):
+            offset = chunk * chunk_size
+            src.seek(offset)
+            dest.seek(offset)
+            dest.write(src.read(chunk_size))
+
+
+class SynthesisCache(object):
+
+    """Compute-node cache of synthesized launch disks and memory snapshots
+
+    An entry holds the launch images of a (base VM, VM overlay) pair as they
+    were right after synthesis, before the VM is resumed. A VM launched from
+    an entry uses its images as the read-only base of cloudletfs, so the
+    entry is never evicted while such a VM is running.
+    """
+
+    DISK_FILE = "disk"
+    MEMORY_FILE = "memory"
+    INFO_FILE = "info"
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.users = dict()         # entry key -> instance uuids
+        self.entries = dict()       # entry key -> entry info
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._adding = set()        # entry keys being filled
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self._scan()
+
+    @staticmethod
+    def _key(base_uuid, overlay_id):
+        return sha256("%s-%s" % (base_uuid, overlay_id)).hexdigest()
+
+    def _entry_path(self, key, fname=''):
+        return os.path.join(self.cache_dir, key, fname)
+
+    def _scan(self):
+        for key in os.listdir(self.cache_dir):
+            info_path = self._entry_path(key, self.INFO_FILE)
+            if not os.path.exists(info_path):
+                # incomplete entry
+                shutil.rmtree(self._entry_path(key), ignore_errors=True)
+                continue
+            with open(info_path) as info_file:
+                info = json.loads(info_file.read())
+            info['last_used'] = os.path.getmtime(self._entry_path(key))
+            self.entries[key] = info
+
+    def get(self, base_uuid, overlay_id, instance_uuid):
+        """Return (launch disk, launch memory) of a cached synthesized VM
+        used by instance_uuid until release() is called, or None
+        """
+        key = self._key(base_uuid, overlay_id)
+        info = self.entries.get(key, None)
+        if info is None:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        info['last_used'] = time.time()
+        os.utime(self._entry_path(key), None)
+        self.users.setdefault(key, set()).add(instance_uuid)
+        return (self._entry_path(key, self.DISK_FILE),
+                self._entry_path(key, self.MEMORY_FILE))
+
+    def add(self, base_uuid, overlay_id, fill_func):
+        """Add the launch images of a synthesized VM to the cache
+
+        fill_func(disk_path, memory_path) writes the launch disk and memory
+        snapshot into the entry. It is not called if the entry is already
+        cached or being added.
+        """
+        key = self._key(base_uuid, overlay_id)
+        if key in self.entries or key in self._adding:
+            return
+        self._adding.add(key)
+        entry_dir = self._entry_path(key)
+        disk_path = self._entry_path(key, self.DISK_FILE)
+        memory_path = self._entry_path(key, self.MEMORY_FILE)
+        try:
+            os.makedirs(entry_dir)
+            fill_func(disk_path, memory_path)
+            info = {
+                'base_uuid': base_uuid,
+                'overlay_id': overlay_id,
+                'size': CloudletBaseCache._disk_usage([disk_path,
+                                                       memory_path]),
+                }
+            with open(self._entry_path(key, self.INFO_FILE), "w") as f:
+                f.write(json.dumps(info))
+            info['last_used'] = time.time()
+            self.entries[key] = info
+        finally:
+            self._adding.discard(key)
+            if key not in self.entries:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+        self._evict()
+
+    def is_used_by(self, instance_uuid):
+        for instance_uuids in self.users.values():
+            if instance_uuid in instance_uuids:
+                return True
+        return False
+
+    def release(self, instance_uuid):
+        for key, instance_uuids in self.users.items():
+            instance_uuids.discard(instance_uuid)
+            if not instance_uuids:
+                del self.users[key]
+
+    def total_size(self):
+        return sum(info['size'] for info in self.entries.values())
+
+    def _evict(self):
+        candidates = [key for key in self.entries if key not in self.users]
+        candidates.sort(key=lambda key: self.entries[key]['last_used'])
+        while self.total_size() > self.max_bytes and candidates:
+            key = candidates.pop(0)
+            LOG.info("cloudlet, evicting synthesized VM %s from cache" %
+                     self.entries[key]['overlay_id'])
+            del self.entries[key]
+            shutil.rmtree(self._entry_path(key), ignore_errors=True)
+            self.stats['evictions'] += 1
@@ -0,0 +1,185 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import logging
+import os
+import sys
+import time
+
+import eventlet
+from eventlet import event
+
+LOG = logging.getLogger(__name__)
+
+
+class ProgressFile(object):
+
+    """File wrapper reporting how many bytes the image service has read"""
+
+    def __init__(self, fileobj, callback):
+        self.fileobj = fileobj
+        self.callback = callback
+
+    def read(self, *args):
+        data = self.fileobj.read(*args)
+        self.callback(len(data))
+        return data
+
+    def __iter__(self):
+        while True:
+            data = self.read(64 * 1024)
+            if not data:
+                break
+            yield data
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+
+class BaseVMUploader(object):
+
+    """Upload base VM artifacts to glance with a bounded worker pool
+
+    An artifact starts uploading as soon as it is marked ready. An artifact
+    can depend on others: its data still uploads right away, but its final
+    metadata update, such as the references to the other images, is made
+    only after all of theirs are uploaded and updated.
+    """
+
+    PROGRESS_LOG_STEP = 10  # percent
+
+    def __init__(self, upload_func, max_workers, progress_callback=None,
+                 delete_func=None, update_func=None):
+        """
+        :param upload_func: upload_func(filepath, meta_id, metadata,
+                            progress_callback) uploading a single file
+        :param max_workers: maximum number of concurrent uploads
+        :param progress_callback: called with (name, bytes_sent, bytes_total)
+        :param delete_func: delete_func(meta_id) deleting an image whose
+                            upload started before abort
+        :param update_func: update_func(meta_id, metadata) making the final
+                            metadata update of an artifact
+        """
+        self.upload_func = upload_func
+        self.delete_func = delete_func
+        self.update_func = update_func
+        self.pool = eventlet.GreenPool(max(1, max_workers))
+        self.progress_callback = progress_callback
+        self.progress = dict()
+        self._artifacts = dict()
+        self._ready = dict()
+        self._done = dict()
+        self._waiters = list()
+
+    def add(self, name, filepath, meta_id, metadata, depends_on=(),
+            final_metadata=None):
+        """
+        :param depends_on: names of artifacts that must be done before
+                           final_metadata is applied
+        :param final_metadata: metadata applied with update_func once the
+                               data is uploaded and depends_on are done
+        """
+        self._artifacts[name] = (filepath, meta_id, metadata,
+                                 tuple(depends_on), final_metadata)
+        self.progress[name] = {'bytes_sent': 0, 'bytes_total': None,
+                               'state': 'waiting', 'started': False}
+        self._ready[name] = event.Event()
+        self._done[name] = event.Event()
+        self._waiters.append(eventlet.spawn(self._run, name))
+
+    def mark_ready(self, name):
+        """The file of the artifact is final and can be uploaded"""
+        if not self._ready[name].ready():
+            self._ready[name].send(True)
+
+    def abort(self):
+        """Stop waiting and running uploads, and delete images that already
+        received data
+        """
+        for waiter in self._waiters:
+            waiter.kill()
+        for upload in list(self.pool.coroutines_running):
+            upload.kill()
+        if self.delete_func is None:
+            return
+        for name, artifact in self._artifacts.items():
+            if not self.progress[name]['started']:
+                continue
+            meta_id = artifact[1]
+            try:
+                self.delete_func(meta_id)
+            except Exception as e:
+                LOG.warning("cloudlet, cannot delete partial image %s "
+                            "of %s: %s" % (meta_id, name, str(e)))
+
+    def wait(self):
+        """Wait for every upload. At the first failure, abort the others
+        and raise it
+        """
+        for waiter in self._waiters:
+            try:
+                waiter.wait()
+            except Exception:
+                exc_info = sys.exc_info()
+                self.abort()
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+    def _run(self, name):
+        _filepath, meta_id, _metadata, depends_on, final_metadata = \
+            self._artifacts[name]
+        try:
+            self._ready[name].wait()
+            self.pool.spawn(self._upload, name).wait()
+            for dependency in depends_on:
+                self._done[dependency].wait()
+            if final_metadata is not None:
+                self.progress[name]['state'] = 'updating'
+                self.update_func(meta_id, final_metadata)
+                self.progress[name]['state'] = 'done'
+        except Exception as e:
+            self.progress[name]['state'] = 'failed'
+            self._done[name].send_exception(e)
+            raise
+        self._done[name].send(True)
+
+    def _upload(self, name):
+        filepath, meta_id, metadata = self._artifacts[name][:3]
+        progress = self.progress[name]
+        progress['bytes_total'] = os.path.getsize(filepath)
+        progress['state'] = 'uploading'
+        progress['started'] = True
+        report = {'percent': 0}
+
+        def _progress(nbytes):
+            progress['bytes_sent'] += nbytes
+            if self.progress_callback is not None:
+                self.progress_callback(name, progress['bytes_sent'],
+                                       progress['bytes_total'])
+            if not progress['bytes_total']:
+                return
+            percent = progress['bytes_sent'] * 100 / progress['bytes_total']
+            if percent >= report['percent'] + self.PROGRESS_LOG_STEP:
+                report['percent'] = percent
+                LOG.debug("cloudlet, uploading %s: %d%% (%d/%d bytes)" %
+                          (name, percent, progress['bytes_sent'],
+                           progress['bytes_total']))
+
+        LOG.info("cloudlet, start uploading %s" % name)
+        start = time.time()
+        self.upload_func(filepath, meta_id, metadata, _progress)
+        progress['seconds'] = time.time() - start
+        progress['state'] = 'done'
+        LOG.info("cloudlet, %s upload complete" % name)
@@ -0,0 +1,277 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import logging
+import os
+import struct
+import time
+import zipfile
+import zlib
+
+import eventlet
+from eventlet import event
+from eventlet import greenio
+
+LOG = logging.getLogger(__name__)
+
+
+# zip64 data descriptor: signature, CRC, compressed and uncompressed size
+_DATA_DESCRIPTOR = struct.Struct("<4sLQQ")
+
+
+class _CountingWriter(object):
+
+    """Write-only file that tells zipfile how much it has written"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.offset = 0
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        self.fileobj.flush()
+
+
+def _read_chunks(path, chunk_size):
+    with open(path, "rb") as in_file:
+        while True:
+            data = in_file.read(chunk_size)
+            if not data:
+                break
+            yield data
+
+
+def write_zip_stream(fileobj, paths, chunk_size=1024 * 1024):
+    """Write files into fileobj as a stored zip archive without seeking.
+
+    Like zipfile of Python 3 on a stream, each member's CRC and sizes
+    follow its data in a data descriptor, so the archive can be written to
+    a pipe. zipfile writes the headers and the central directory.
+    """
+    writer = _CountingWriter(fileobj)
+    archive = zipfile.ZipFile(writer, "w", zipfile.ZIP_STORED,
+                              allowZip64=True)
+    try:
+        for path in paths:
+            date_time = time.localtime(os.path.getmtime(path))[:6]
+            if date_time[0] < 1980:
+                date_time = (1980, 1, 1, 0, 0, 0)
+            zinfo = zipfile.ZipInfo(os.path.basename(path), date_time)
+            zinfo.compress_type = zipfile.ZIP_STORED
+            zinfo.external_attr = 0644 << 16
+            zinfo.flag_bits |= 0x08
+            # sizes are not known up front, every member has zip64 sizes
+            zinfo.extract_version = zinfo.create_version = 45
+            zinfo.header_offset = writer.tell()
+            writer.write(zinfo.FileHeader(zip64=True))
+            crc = 0
+            size = 0
+            for data in _read_chunks(path, chunk_size):
+                crc = zlib.crc32(data, crc)
+                size += len(data)
+                writer.write(data)
+            zinfo.CRC = crc & 0xffffffff
+            zinfo.compress_size = zinfo.file_size = size
+            writer.write(_DATA_DESCRIPTOR.pack("PK\x07\x08", zinfo.CRC,
+                                               size, size))
+            archive.filelist.append(zinfo)
+            archive.NameToInfo[zinfo.filename] = zinfo
+    except Exception:
+        # the archive is abandoned, do not let zipfile finish it
+        archive.fp = None
+        raise
+    archive.close()
+
+
+class OverlayPackageStream(object):
+
+    """VM overlay package streamed to the image service as it is written
+
+    write_package() packages the overlay files into a pipe, and the image
+    service reads the other end. The pipe applies backpressure to the
+    writer.
+    """
+
+    def __init__(self):
+        read_fd, write_fd = os.pipe()
+        self.reader = greenio.GreenPipe(read_fd, 'rb', 0)
+        self.writer = greenio.GreenPipe(write_fd, 'wb', 0)
+        self.complete = False
+
+    def write_package(self, paths):
+        try:
+            write_zip_stream(self.writer, paths)
+            self.complete = True
+        finally:
+            # the reader sees EOF, and fails unless the package is complete
+            self.writer.close()
+
+    def read(self, size=-1):
+        data = self.reader.read(size)
+        if not data and not self.complete:
+            raise IOError("VM overlay package is incomplete")
+        return data
+
+    def __iter__(self):
+        while True:
+            data = self.read(64 * 1024)
+            if not data:
+                break
+            yield data
+
+    def close(self):
+        """Stop reading, making the writer fail instead of blocking"""
+        self.reader.close()
+
+
+class GrowingZipReader(object):
+
+    """Read a zip archive while another process writes it with zipfile
+
+    zipfile rewrites the local header of a member once the member's data is
+    written, and only appends otherwise. Bytes are therefore handed out
+    only up to the local header of the member being written, which is
+    final once its sizes are filled in or the next record follows it. After
+    the writer finishes, the rest of the file is read as it is. A file that
+    does not look like such an archive is read only after the writer
+    finishes.
+    """
+
+    LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+    LOCAL_HEADER_SIG = 0x04034b50
+    RECORD_SIGS = ("PK\x03\x04", "PK\x01\x02", "PK\x06\x06", "PK\x05\x06")
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, path):
+        self.path = path
+        self.fileobj = None
+        self.offset = 0             # bytes handed out
+        self.stable_end = 0         # bytes that do not change anymore
+        self.member_offset = 0      # local header of the member written
+        self.following = True
+        self.writer_done = event.Event()
+
+    def finish(self, success):
+        """Tell whether the writer completed the archive"""
+        if not self.writer_done.ready():
+            self.writer_done.send(success)
+
+    def wait_created(self):
+        """Wait until the writer creates the file. Return False if it
+        finished without creating it
+        """
+        while not os.path.exists(self.path):
+            if self.writer_done.ready():
+                return os.path.exists(self.path)
+            eventlet.sleep(self.POLL_INTERVAL)
+        return True
+
+    def _advance(self):
+        """Move stable_end past members whose local headers are final"""
+        if not self.following:
+            return
+        file_size = os.fstat(self.fileobj.fileno()).st_size
+        while self.member_offset is not None:
+            self.fileobj.seek(self.member_offset)
+            header = self.fileobj.read(self.LOCAL_HEADER.size)
+            if len(header) < 4:
+                return
+            if header[:4] in self.RECORD_SIGS[1:]:
+                # central directory and end records are only appended
+                self.member_offset = None
+                break
+            if header[:4] != self.RECORD_SIGS[0]:
+                LOG.debug("cloudlet, cannot follow %s while it is written" %
+                          self.path)
+                self.following = False
+                return
+            if len(header) < self.LOCAL_HEADER.size:
+                return
+            fields = self.LOCAL_HEADER.unpack(header)
+            compress_size, name_len, extra_len = fields[7], fields[9], \
+                fields[10]
+            extra = self.fileobj.read(name_len + extra_len)[name_len:]
+            if len(extra) < extra_len:
+                return
+            if compress_size == 0xffffffff:
+                # zip64 extra field holds uncompressed and compressed size
+                compress_size = 0
+                pos = 0
+                while pos + 4 <= len(extra):
+                    tag, size = struct.unpack("<HH", extra[pos:pos + 4])
+                    if tag == 0x0001 and size >= 16:
+                        compress_size = struct.unpack(
+                            "<Q", extra[pos + 12:pos + 20])[0]
+                        break
+                    pos += 4 + size
+            data_offset = self.member_offset + self.LOCAL_HEADER.size + \
+                name_len + extra_len
+            if compress_size == 0:
+                # not filled in yet, unless the member is empty
+                self.fileobj.seek(data_offset)
+                if self.fileobj.read(4) not in self.RECORD_SIGS:
+                    return
+            next_offset = data_offset + compress_size
+            if next_offset > file_size:
+                return
+            self.member_offset = next_offset
+            self.stable_end = next_offset
+        self.stable_end = file_size
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = 1024 * 1024
+        while True:
+            if self.fileobj is None and os.path.exists(self.path):
+                # unbuffered, so rewritten headers are not read from a buffer
+                self.fileobj = open(self.path, "rb", 0)
+            if self.writer_done.ready():
+                if not self.writer_done.wait():
+                    raise IOError("VM residue is incomplete")
+                if self.fileobj is None:
+                    return ''
+                limit = os.fstat(self.fileobj.fileno()).st_size
+            elif self.fileobj is not None:
+                self._advance()
+                limit = self.stable_end
+            else:
+                limit = 0
+            if self.offset < limit:
+                self.fileobj.seek(self.offset)
+                data = self.fileobj.read(min(size, limit - self.offset))
+                self.offset += len(data)
+                return data
+            if self.writer_done.ready():
+                return ''
+            eventlet.sleep(self.POLL_INTERVAL)
+
+    def __iter__(self):
+        while True:
+            data = self.read(64 * 1024)
+            if not data:
+                break
+            yield data
+
+    def close(self):
+        if self.fileobj is not None:
+            self.fileobj.close()
+            self.fileobj = None
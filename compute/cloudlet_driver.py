@@ -19,22 +19,44 @@
 
 import os
 import uuid
-import hashlib
+import functools
 import subprocess
-import select
 import shutil
 import StringIO
+import time
+import contextlib
+import bz2
+import zlib
+import httplib
+import socket
+import signal
+from hashlib import sha256
 from urlparse import urlsplit
 from tempfile import mkdtemp    # replace it to util.tempdir
 
+import eventlet
+from eventlet import queue
+from eventlet.green import subprocess as green_subprocess
+from eventlet import tpool
+from oslo.config import cfg
+
 from nova.virt.libvirt import blockinfo
 from nova.compute import power_state
 from nova import exception
 from nova import utils
+from nova import context as nova_context
 from nova.virt import driver
+from nova.virt import event as virtevent
+from nova.virt import configdrive
+from nova.virt.disk import api as disk
+from nova.api.metadata import base as instance_metadata
 from nova.virt.libvirt import utils as libvirt_utils
 from nova.image import glance
 from nova.compute import task_states
+from nova.compute import utils as compute_utils
+from nova import rpc
+from nova.objects import flavor as flavor_obj
+from nova.objects import instance as instance_obj
 from nova.openstack.common import fileutils
 try:
     # icehouse
@@ -42,11 +64,43 @@ try:
 except ImportError as e:
     # kilo
     from nova.i18n import _
+try:
+    # icehouse
+    from nova.openstack.common import excutils
+except ImportError as e:
+    # kilo
+    from oslo_utils import excutils
+try:
+    # icehouse
+    from nova.openstack.common import jsonutils
+except ImportError as e:
+    # kilo
+    from oslo_serialization import jsonutils
 from nova.openstack.common import loopingcall
 
 from nova.virt.libvirt import driver as libvirt_driver
 from nova.compute.cloudlet_api import CloudletAPI
 
+from cloudlet_common.basecache import CloudletBaseCache
+from cloudlet_common.chunkbitmap import ChunkBitmap
+from cloudlet_common.forwarder import HandoffPortForwarder
+from cloudlet_common.handoffmode import HandoffModeSelector
+from cloudlet_common.handoffprogress import HandoffProgress
+from cloudlet_common.handoffprogress import allocated_bytes
+from cloudlet_common.metrics import CloudletMetrics
+from cloudlet_common.overlaycache import OverlayCache
+from cloudlet_common.pagecache import BaseVMPageCacheWarmer
+from cloudlet_common.metrics import PhaseTimer
+from cloudlet_common.hashdict import BaseHashDictCache
+from cloudlet_common.registry import CloudletVMRegistry
+from cloudlet_common.scheduler import CloudletWorkScheduler
+from cloudlet_common.synthesiscache import SynthesisCache
+from cloudlet_common.synthesiscache import copy_chunks
+from cloudlet_common.uploader import BaseVMUploader
+from cloudlet_common.uploader import ProgressFile
+from cloudlet_common.zipstream import GrowingZipReader
+from cloudlet_common.zipstream import OverlayPackageStream
+
 from xml.etree import ElementTree
 from elijah.provisioning import synthesis
 from elijah.provisioning import handoff
@@ -55,6 +109,10 @@ try:
 except ImportError as e:
     import msgpack
 from elijah.provisioning import compression
+try:
+    from lzma import LZMADecompressor
+except ImportError as e:
+    LZMADecompressor = None
 from elijah.provisioning.package import VMOverlayPackage
 from elijah.provisioning.configuration import Const as Cloudlet_Const
 from elijah.provisioning.configuration import Options
@@ -64,16 +122,543 @@ import logging
 LOG = logging.getLogger(__name__)
 synthesis.LOG = LOG  # overwrite cloudlet's own log
 
+cloudlet_opts = [
+    cfg.IntOpt('base_upload_workers',
+               default=4,
+               help='Number of base VM artifacts (disk, memory and their '
+                    'hash lists) uploaded to glance at the same time'),
+    cfg.StrOpt('base_cache_subdirectory_name',
+               default='_cloudlet_base',
+               help='Directory under instances_path where base VMs are '
+                    'cached, keyed by their base_sha256_uuid'),
+    cfg.IntOpt('base_cache_max_gb',
+               default=0,
+               help='Disk budget of the base VM cache in GB. Base VMs that '
+                    'are neither pinned nor used by a running instance are '
+                    'evicted beyond this budget. 0 means unlimited'),
+    cfg.StrOpt('base_cache_eviction_policy',
+               default='lru',
+               help='Which base VM to evict first: lru (least recently '
+                    'used) or lfu (least frequently used)'),
+    cfg.ListOpt('base_cache_pinned',
+                default=[],
+                help='base_sha256_uuid of base VMs never evicted from the '
+                     'base VM cache'),
+    cfg.IntOpt('base_hashdict_cache_size',
+               default=4,
+               help='Number of base VMs whose disk and memory hash '
+                    'dictionaries are kept in memory for VM handoff'),
+    cfg.BoolOpt('preload_base_hashdict',
+                default=True,
+                help='Load hash dictionaries of a base VM in the background '
+                     'as soon as a synthesized VM starts from it, instead of '
+                     'at its first VM handoff'),
+    cfg.BoolOpt('share_base_hash_index',
+                default=True,
+                help='Pass handoff-proc the path of the memory-mapped hash '
+                     'index of a base VM instead of copying its hash '
+                     'dictionaries into the handoff data file. handoff-proc '
+                     'reads it with cloudlet_common.hashindex, which has to '
+                     'be installed next to nova'),
+    cfg.BoolOpt('handoff_local_relay',
+                default=False,
+                help='Relay the stream of a network VM handoff through a '
+                     'local port, which counts the bytes sent for progress '
+                     'reports and adaptive handoff mode selection at the '
+                     'cost of an extra hop through 127.0.0.1'),
+    cfg.BoolOpt('streaming_synthesis',
+                default=True,
+                help='Decompress VM overlay blobs while the following blobs '
+                     'are still being downloaded'),
+    cfg.IntOpt('synthesis_buffer_blobs',
+               default=4,
+               help='Maximum number of downloaded, still compressed VM '
+                    'overlay blobs kept in memory by streaming synthesis'),
+    cfg.BoolOpt('overlay_cache_enabled',
+                default=True,
+                help='Keep decompressed VM overlays so that synthesizing '
+                     'the same overlay again skips download and '
+                     'decompression'),
+    cfg.StrOpt('overlay_cache_subdirectory_name',
+               default='_cloudlet_overlay',
+               help='Directory under instances_path where decompressed VM '
+                    'overlays are cached'),
+    cfg.IntOpt('overlay_cache_max_gb',
+               default=0,
+               help='Disk budget of the VM overlay cache in GB. Least '
+                    'recently used overlays not in use are evicted beyond '
+                    'this budget. 0 means unlimited'),
+    cfg.StrOpt('synthesis_cache_subdirectory_name',
+               default='_cloudlet_synthesis',
+               help='Directory under instances_path where launch disks and '
+                    'memory snapshots of synthesized VMs are cached'),
+    cfg.IntOpt('synthesis_cache_max_gb',
+               default=0,
+               help='Disk budget of the synthesized VM cache in GB. Only '
+                    'flavors with the extra spec cloudlet:synthesis_cache '
+                    'set to true use the cache. 0 disables the cache'),
+    cfg.ListOpt('page_cache_warm_base_vms',
+                default=[],
+                deprecated_name='warm_pool_base_vms',
+                help='base_sha256_uuid of base VMs whose artifacts are '
+                     'fetched and pinned ahead of use on this compute node, '
+                     'with their memory snapshots kept in the page cache, in '
+                     'priority order. This is not a pool of pre-resumed '
+                     'domains: the name, UUID and NICs of a domain are '
+                     'fixed when it is restored, so a running domain cannot '
+                     'be handed to a new instance. A resume still restores '
+                     'the VM, only without reading from disk or glance'),
+    cfg.IntOpt('page_cache_warm_reserved_memory_mb',
+               default=2048,
+               deprecated_name='warm_pool_reserved_memory_mb',
+               help='Available memory in MB below which warmed base VMs are '
+                    'dropped from the page cache, lowest priority first'),
+    cfg.IntOpt('page_cache_warm_interval',
+               default=30,
+               deprecated_name='warm_pool_refresh_interval',
+               help='Interval in seconds between warming base VMs into the '
+                    'page cache'),
+    cfg.IntOpt('boot_event_timeout',
+               default=10,
+               help='Seconds to wait for libvirt lifecycle events reporting '
+                    'a spawned VM as running before falling back to '
+                    'polling its power state'),
+    cfg.StrOpt('metrics_file',
+               default='$instances_path/cloudlet_metrics.prom',
+               help='File where phase timings and cache counters of this '
+                    'compute node are written in Prometheus text format. '
+                    'Empty disables it'),
+    cfg.FloatOpt('base_progress_interval',
+                 default=2.0,
+                 help='Minimum interval in seconds between saving base VM '
+                      'creation progress to the instance'),
+    cfg.FloatOpt('handoff_progress_interval',
+                 default=1.0,
+                 help='Interval in seconds between measuring VM handoff '
+                      'progress and saving it to the instance'),
+    cfg.IntOpt('handoff_dest_prepare_timeout',
+               default=600,
+               help='Seconds to wait for a handoff destination to fetch its '
+                    'base VM before the source VM is paused for streaming. '
+                    'The source streams anyway once it expires'),
+    cfg.StrOpt('vm_registry_journal',
+               default='$instances_path/cloudlet_vms.journal',
+               help='Journal of synthesized and resumed base VMs of this '
+                    'compute node, used to reattach them after a restart. '
+                    'Empty disables it'),
+    cfg.IntOpt('max_concurrent_operations',
+               default=4,
+               help='Cloudlet operations (synthesis, overlay creation, base '
+                    'VM creation and VM handoff) running at once on a '
+                    'compute node, 0 for no limit'),
+    cfg.IntOpt('max_concurrent_handoff',
+               default=2,
+               help='VM handoffs, sent or received, running at once'),
+    cfg.IntOpt('max_concurrent_synthesis',
+               default=2,
+               help='VM syntheses running at once'),
+    cfg.IntOpt('max_concurrent_overlay',
+               default=1,
+               help='VM overlay creations running at once'),
+    cfg.IntOpt('max_concurrent_base',
+               default=1,
+               help='Base VM creations running at once'),
+    cfg.IntOpt('max_queued_synthesis',
+               default=8,
+               help='VM syntheses waiting for a slot beyond which a new '
+                    'one is sent back to the scheduler for another compute '
+                    'node, 0 for no limit'),
+    cfg.BoolOpt('overlay_streaming_upload',
+                default=True,
+                help='Upload a VM overlay to glance while it is packaged, '
+                     'instead of writing the package to local disk first. '
+                     'Disable it if the image service cannot accept uploads '
+                     'of unknown size'),
+    cfg.BoolOpt('handoff_mode_adaptive',
+                default=True,
+                help='Choose VM handoff compression from the bandwidth '
+                     'to the destination, measured from the bytes relayed '
+                     'by earlier handoffs, and idle CPU cores, instead of '
+                     'the default of handoff-proc. Needs '
+                     'handoff_local_relay for network handoffs'),
+    cfg.IntOpt('handoff_default_bandwidth_mbps',
+               default=100,
+               help='Bandwidth assumed to a VM handoff destination that has '
+                    'not been measured yet, in Mbps'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(cloudlet_opts, group='cloudlet')
+
+
+def _decompress_lzma(data):
+    decompressor = LZMADecompressor()
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+def _decompress_gzip(data):
+    return zlib.decompress(data, zlib.MAX_WBITS | 16)
+
+
+def _overlay_blob_decompressors():
+    """Return decompress functions of VM overlay blobs by compression type"""
+    decompressors = dict()
+    compression_types = (
+        ('COMPRESSION_LZMA', _decompress_lzma if LZMADecompressor else None),
+        ('COMPRESSION_BZIP2', bz2.decompress),
+        ('COMPRESSION_GZIP', _decompress_gzip),
+        )
+    for const_name, decompress in compression_types:
+        comp_type = getattr(Cloudlet_Const, const_name, None)
+        if comp_type is not None and decompress is not None:
+            decompressors[comp_type] = decompress
+    return decompressors
+
+
+class _ReattachedFuse(object):
+
+    """FUSE of a synthesized VM launched by a previous nova-compute"""
+
+    def __init__(self, mountpoint, modified_disk_chunks, pid=None):
+        self.mountpoint = mountpoint
+        self.modified_disk_chunks = modified_disk_chunks
+        self.pid = pid
+
+    def terminate(self):
+        if self.mountpoint and os.path.ismount(self.mountpoint):
+            try:
+                utils.execute('fusermount', '-u', '-z', self.mountpoint,
+                              run_as_root=True)
+            except Exception as e:
+                LOG.warning(_("cloudlet, cannot unmount %s: %s" %
+                              (self.mountpoint, str(e))))
+        if self.pid:
+            try:
+                os.kill(self.pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+
+class ReattachedVM(object):
+
+    """Synthesized VM launched by a previous nova-compute process
+
+    It has what VM handoff and cleanup use, rebuilt from the journal.
+    Chunks the VM modifies are reported to the process that launched it,
+    so they are not known after a restart. Every chunk of its disk counts
+    as modified, which costs more deduplication at handoff but sends the
+    right disk. disk_size is None if the size of the disk is not known.
+    """
+
+    def __init__(self, record, machine):
+        mountpoint = record.get('fuse_mountpoint', None)
+        self.disk_size = record.get('disk_size', None)
+        if not self.disk_size and mountpoint:
+            try:
+                self.disk_size = os.path.getsize(
+                    os.path.join(mountpoint, 'disk', 'image'))
+            except OSError:
+                self.disk_size = None
+        modified_disk_chunks = ChunkBitmap()
+        if self.disk_size:
+            chunk_count = (self.disk_size + Cloudlet_Const.CHUNK_SIZE - 1) // \
+                Cloudlet_Const.CHUNK_SIZE
+            modified_disk_chunks.add_runs([0, chunk_count])
+        self.fuse = _ReattachedFuse(mountpoint,
+                                    modified_disk_chunks,
+                                    record.get('fuse_pid', None))
+        self.qemu_logfile = record.get('qemu_logfile', None)
+        self.qmp_channel = record.get('qmp_channel', None)
+        self.launch_files = record.get('launch_files', [])
+        self.machine = machine
+
+    def terminate(self):
+        self.fuse.terminate()
+        for path in self.launch_files:
+            if path and os.path.exists(path):
+                os.remove(path)
+
 
 class CloudletDriver(libvirt_driver.LibvirtDriver):
 
     def __init__(self, read_only=False):
         super(CloudletDriver, self).__init__(read_only)
 
-        # manage VM overlay list
-        self.resumed_vm_dict = dict()
-        # manage synthesized VM list
-        self.synthesized_vm_dics = dict()
+        # resumed base VMs and synthesized VMs, journaled across restarts
+        self.vm_registry = CloudletVMRegistry(
+            CONF.cloudlet.vm_registry_journal)
+        # base VMs cached at this compute node
+        self.base_cache = CloudletBaseCache(
+            os.path.join(libvirt_driver.CONF.instances_path,
+                         CONF.cloudlet.base_cache_subdirectory_name),
+            libvirt_utils.fetch_image,
+            legacy_dir=os.path.join(
+                libvirt_driver.CONF.instances_path,
+                libvirt_driver.CONF.image_cache_subdirectory_name),
+            max_bytes=CONF.cloudlet.base_cache_max_gb * 1024 * 1024 * 1024,
+            policy=CONF.cloudlet.base_cache_eviction_policy,
+            pinned=CONF.cloudlet.base_cache_pinned)
+        # decompressed VM overlays
+        self.overlay_cache = None
+        if CONF.cloudlet.overlay_cache_enabled:
+            self.overlay_cache = OverlayCache(
+                os.path.join(libvirt_driver.CONF.instances_path,
+                             CONF.cloudlet.overlay_cache_subdirectory_name),
+                max_bytes=CONF.cloudlet.overlay_cache_max_gb * 1024 * 1024 * 1024)
+        # launch images of synthesized VMs
+        self.synthesis_cache = None
+        if CONF.cloudlet.synthesis_cache_max_gb > 0:
+            self.synthesis_cache = SynthesisCache(
+                os.path.join(libvirt_driver.CONF.instances_path,
+                             CONF.cloudlet.synthesis_cache_subdirectory_name),
+                CONF.cloudlet.synthesis_cache_max_gb * 1024 * 1024 * 1024)
+        # hash dictionaries of base VMs used for VM handoff
+        # counts bytes of network VM handoffs leaving this node
+        self.handoff_relay = HandoffPortForwarder(bind_address='127.0.0.1')
+        self.base_hashdict_cache = BaseHashDictCache(
+            CONF.cloudlet.base_hashdict_cache_size,
+            self._parse_base_hashdict,
+            use_index=CONF.cloudlet.share_base_hash_index)
+        # phase timings of the last cloudlet operation of each instance
+        self.phase_timings = dict()
+        self.metrics = CloudletMetrics(CONF.cloudlet.metrics_file)
+        # instance uuid -> lifecycle transitions of a VM being spawned
+        self._boot_waiters = dict()
+        # base VMs kept in the page cache
+        self.base_warmer = BaseVMPageCacheWarmer(
+            self.base_cache, CONF.cloudlet.page_cache_warm_base_vms,
+            CONF.cloudlet.page_cache_warm_reserved_memory_mb * 1024 * 1024,
+            pinned=CONF.cloudlet.base_cache_pinned)
+        # admission control of cloudlet operations on this node
+        self.work_scheduler = CloudletWorkScheduler(
+            CONF.cloudlet.max_concurrent_operations,
+            {CloudletWorkScheduler.HANDOFF:
+             CONF.cloudlet.max_concurrent_handoff,
+             CloudletWorkScheduler.SYNTHESIS:
+             CONF.cloudlet.max_concurrent_synthesis,
+             CloudletWorkScheduler.OVERLAY:
+             CONF.cloudlet.max_concurrent_overlay,
+             CloudletWorkScheduler.BASE: CONF.cloudlet.max_concurrent_base},
+            {CloudletWorkScheduler.SYNTHESIS:
+             CONF.cloudlet.max_queued_synthesis})
+        # instance uuid -> seconds its cloudlet operation waited for a slot
+        self._queue_waits = dict()
+        # instance uuid -> seconds waited for the handoff destination
+        self._dest_prepare_waits = dict()
+        # bandwidth measured to handoff destinations
+        self.handoff_mode_selector = HandoffModeSelector(
+            CONF.cloudlet.handoff_default_bandwidth_mbps * 1000 * 1000 / 8)
+
+    def pop_phase_timings(self, instance_uuid):
+        """Return phase timings of the last cloudlet operation of the
+        instance, to be sent with its notification
+        """
+        return self.phase_timings.pop(instance_uuid, {})
+
+    @contextlib.contextmanager
+    def cloudlet_slot(self, operation, instance_uuid):
+        """Run the block once the work scheduler admits the operation. The
+        time spent waiting is recorded with the phases of the operation
+        """
+        start = time.time()
+        with self.work_scheduler.slot(operation):
+            self._queue_waits[instance_uuid] = time.time() - start
+            try:
+                yield
+            except Exception:
+                with excutils.save_and_reraise_exception():
+                    self._queue_waits.pop(instance_uuid, None)
+
+    def _record_phases(self, context, instance, phase_timer, notify=False):
+        queue_wait = self._queue_waits.pop(instance['uuid'], None)
+        if queue_wait is not None:
+            phase_timer.add('queue_wait', queue_wait)
+        timings = phase_timer.to_dict()
+        LOG.info(_("cloudlet, %s phases: %s" % (
+            phase_timer.operation,
+            ", ".join("%s=%.3fs" % (name, seconds)
+                      for name, seconds in sorted(timings.items())))),
+            instance=instance)
+        self.metrics.observe(phase_timer.operation, timings)
+        self._write_metrics()
+        if not notify:
+            # compute manager sends them with its notification
+            self.phase_timings[instance['uuid']] = timings
+        else:
+            # spawn is driven by the stock compute manager, so notify here
+            notifier = rpc.get_notifier('compute', libvirt_driver.CONF.host)
+            compute_utils.notify_about_instance_usage(
+                notifier, context, instance,
+                "cloudlet.%s" % phase_timer.operation,
+                extra_usage_info={'cloudlet_phases': timings})
+        return timings
+
+    def _metric_counters(self):
+        counters = list()
+        caches = (('base', self.base_cache),
+                  ('overlay', self.overlay_cache),
+                  ('synthesis', self.synthesis_cache),
+                  ('base_warmer', self.base_warmer))
+        for cache_name, cache in caches:
+            if cache is None:
+                continue
+            for event_name, count in sorted(cache.stats.items()):
+                counters.append(('counter', 'cloudlet_cache_events_total',
+                                 {'cache': cache_name, 'event': event_name},
+                                 count))
+            if hasattr(cache, 'total_size'):
+                counters.append(('gauge', 'cloudlet_cache_bytes',
+                                 {'cache': cache_name}, cache.total_size()))
+        counters.append(('gauge', 'cloudlet_base_warm_hit_ratio', {},
+                         "%.3f" % self.base_warmer.hit_rate()))
+        scheduler = self.work_scheduler
+        for operation in sorted(scheduler.PRIORITIES):
+            labels = {'operation': operation}
+            counters.append(('gauge', 'cloudlet_operations_running', labels,
+                             scheduler.running[operation]))
+            counters.append(('gauge', 'cloudlet_operations_queued', labels,
+                             scheduler.queue_depth(operation)))
+            counters.append(('counter', 'cloudlet_operations_total', labels,
+                             scheduler.stats[operation]))
+            counters.append(('counter', 'cloudlet_operations_refused_total',
+                             labels,
+                             scheduler.stats['%s_refused' % operation]))
+        return counters
+
+    def _write_metrics(self):
+        try:
+            self.metrics.write(self._metric_counters())
+        except (IOError, OSError) as e:
+            LOG.warning(_("cloudlet, failed to write metrics file: %s" %
+                          str(e)))
+
+    def emit_event(self, event):
+        """Wake up spawn waiting for the VM to run, then dispatch the
+        event as libvirt driver does
+        """
+        if isinstance(event, virtevent.LifecycleEvent):
+            waiter = self._boot_waiters.get(event.get_instance_uuid(), None)
+            if waiter is not None:
+                waiter.put(event.get_transition())
+        super(CloudletDriver, self).emit_event(event)
+
+    def init_host(self, host):
+        super(CloudletDriver, self).init_host(host)
+        self._reacquire_base_vms(host)
+        self._reattach_cloudlet_vms()
+        if self.base_warmer.base_uuids:
+            timer = loopingcall.FixedIntervalLoopingCall(
+                self._warm_base_vms)
+            timer.start(interval=CONF.cloudlet.page_cache_warm_interval,
+                        initial_delay=0)
+
+    def _reacquire_base_vms(self, host):
+        """Mark base VMs used by instances of this host as in use again, so
+        that they are not evicted after a restart
+        """
+        context = nova_context.get_admin_context()
+        try:
+            instances = instance_obj.InstanceList.get_by_host(
+                context, host, expected_attrs=['system_metadata'])
+        except Exception as e:
+            LOG.warning(_("cloudlet, cannot list instances to protect their "
+                          "base VMs from eviction: %s" % str(e)))
+            return
+        for instance in instances:
+            image_meta = utils.get_image_from_system_metadata(
+                instance.system_metadata)
+            base_sha256_uuid, memory_snap_id, _, _ = \
+                self._get_basevm_meta_info(image_meta)
+            if memory_snap_id is None:
+                continue
+            self.base_cache.acquire(base_sha256_uuid, instance.uuid)
+            LOG.debug(_("cloudlet, base VM %s is in use by %s" %
+                        (base_sha256_uuid, instance.uuid)))
+
+    def _reattach_cloudlet_vms(self):
+        """Take back synthesized VMs that outlived a previous nova-compute
+        and clean up after those that did not
+        """
+        records = self.vm_registry.load()
+        for instance_uuid, record in records.items():
+            # records of VMs neither reattached nor cleaned up stay in the
+            # journal for the next restart
+            if record.get('kind') != CloudletVMRegistry.SYNTHESIZED:
+                # pipeline state of VM_Overlay is gone with the process
+                LOG.warning(_("cloudlet, cannot reattach resumed base VM "
+                              "of %s, overlay creation has to restart" %
+                              instance_uuid))
+                continue
+            machine = None
+            try:
+                machine = self._conn.lookupByName(record['domain'])
+            except libvirt_driver.libvirt.libvirtError as e:
+                if e.get_error_code() != \
+                        libvirt_driver.libvirt.VIR_ERR_NO_DOMAIN:
+                    LOG.warning(_("cloudlet, cannot look up domain of "
+                                  "synthesized VM %s, leaving it as is: %s" %
+                                  (instance_uuid, str(e))))
+                    continue
+            vm = ReattachedVM(record, machine)
+            if machine is None or not record.get('fuse_mountpoint') or \
+                    not os.path.ismount(record['fuse_mountpoint']):
+                LOG.info(_("cloudlet, cleaning up stale synthesized VM %s" %
+                           instance_uuid))
+                try:
+                    vm.terminate()
+                except Exception as e:
+                    LOG.warning(_("cloudlet, failed to clean up %s: %s" %
+                                  (instance_uuid, str(e))))
+                    continue
+                self.vm_registry.pop(CloudletVMRegistry.SYNTHESIZED,
+                                     instance_uuid)
+                continue
+            if not vm.disk_size:
+                # handoff would send the base disk for the modified one
+                LOG.warning(_("cloudlet, cannot tell the disk size of "
+                              "synthesized VM %s, it cannot be handed off "
+                              "and %s has to be unmounted by hand" %
+                              (instance_uuid, record['fuse_mountpoint'])))
+                continue
+            LOG.info(_("cloudlet, reattached synthesized VM %s" %
+                       instance_uuid))
+            self.vm_registry.add(CloudletVMRegistry.SYNTHESIZED,
+                                 instance_uuid, record['domain'], vm)
+
+    def _warm_base_vms(self):
+        context = nova_context.get_admin_context()
+        try:
+            self.base_warmer.refresh(context, functools.partial(
+                self._find_basevm_image_ids, context))
+        except Exception as e:
+            LOG.warning(_("cloudlet, failed to warm base VMs: %s" % str(e)))
+        LOG.debug(_("cloudlet, base VMs in page cache %s, hit rate %.2f" %
+                    (sorted(self.base_warmer.warm),
+                     self.base_warmer.hit_rate())))
+
+    def _find_basevm_image_ids(self, context, base_sha256_uuid):
+        """Return glance image ids of the base VM in the form used by the
+        base VM cache, or None if glance does not have it
+        """
+        image_service = glance.get_default_image_service()
+        filters = {
+            'property-%s' % CloudletAPI.PROPERTY_KEY_CLOUDLET_TYPE:
+            CloudletAPI.IMAGE_TYPE_BASE_DISK,
+            'property-%s' % CloudletAPI.PROPERTY_KEY_BASE_UUID:
+            base_sha256_uuid,
+            }
+        for image_meta in image_service.detail(context, filters=filters):
+            memory_snap_id, diskhash_snap_id, memhash_snap_id = \
+                self._get_basevm_meta_info(image_meta)[1:]
+            if memory_snap_id is None:
+                continue
+            return {
+                CloudletBaseCache.ARTIFACT_DISK: image_meta['id'],
+                CloudletBaseCache.ARTIFACT_MEMORY: memory_snap_id,
+                CloudletBaseCache.ARTIFACT_DISK_HASH: diskhash_snap_id,
+                CloudletBaseCache.ARTIFACT_MEMORY_HASH: memhash_snap_id,
+                }
+        return None
 
     def _get_snapshot_metadata(self, virt_dom, context, instance, snapshot_id):
         _image_service = glance.get_remote_image_service(context, snapshot_id)
@@ -107,8 +692,10 @@ class CloudletDriver(libvirt_driver.LibvirtDriver):
         return metadata
 
     def _update_to_glance(self, context, image_service, filepath,
-                          meta_id, metadata):
+                          meta_id, metadata, progress_callback=None):
         with libvirt_utils.file_open(filepath) as image_file:
+            if progress_callback is not None:
+                image_file = ProgressFile(image_file, progress_callback)
             image_service.update(context,
                                  meta_id,
                                  metadata,
@@ -130,8 +717,11 @@ class CloudletDriver(libvirt_driver.LibvirtDriver):
         except exception.InstanceNotFound:
             raise exception.InstanceNotRunning(instance_id=instance['uuid'])
 
+        phase_timer = PhaseTimer('base')
+        self._save_base_progress(instance, CloudletAPI.BASE_PHASE_DISK_SNAPSHOT)
         # pause VM
-        self.pause(instance)
+        with phase_timer.phase('pause'):
+            self.pause(instance)
 
         (image_service, image_id) = glance.get_remote_image_service(
             context, instance['image_ref'])
@@ -169,7 +759,8 @@ class CloudletDriver(libvirt_driver.LibvirtDriver):
             try:
                 out_path = os.path.join(tmpdir, snapshot_name)
                 # At this point, base vm should be "raw" format
-                snapshot_backend.snapshot_extract(out_path, "raw")
+                with phase_timer.phase('disk_snapshot'):
+                    snapshot_backend.snapshot_extract(out_path, "raw")
             finally:
                 # snapshotting logic is changed since icehouse.
                 #  : cannot find snapshot_create and snapshot_delete.
@@ -183,28 +774,131 @@ class CloudletDriver(libvirt_driver.LibvirtDriver):
             diskhash_path = os.path.join(tmpdir, snapshot_name+"-disk_hash")
             memhash_path = os.path.join(tmpdir, snapshot_name+"-mem_hash")
 
+            # upload each artifact as soon as it is final. The base disk
+            # refers to the other three, so the references are added only
+            # once they are uploaded.
+            progress_state = {'phase': CloudletAPI.BASE_PHASE_MEMORY_SNAPSHOT,
+                              'last_saved': 0}
+
+            def _upload_progress(name, bytes_sent, bytes_total):
+                now = time.time()
+                if now - progress_state['last_saved'] < \
+                        CONF.cloudlet.base_progress_interval:
+                    return
+                progress_state['last_saved'] = now
+                self._save_base_progress(instance, progress_state['phase'],
+                                         uploader)
+            uploader = BaseVMUploader(
+                functools.partial(self._update_to_glance, context,
+                                  image_service),
+                CONF.cloudlet.base_upload_workers,
+                progress_callback=_upload_progress,
+                delete_func=functools.partial(image_service.delete, context),
+                update_func=functools.partial(image_service.update, context,
+                                              purge_props=False))
+            uploader.add("base memory", basemem_path,
+                         memory_meta_id, mem_metadata)
+            uploader.add("base disk hash", diskhash_path,
+                         diskhash_meta_id, diskhash_metadata)
+            uploader.add("base memory hash", memhash_path,
+                         memoryhash_meta_id, memhash_metadata)
+            uploader.add("base disk", out_path,
+                         disk_meta_id, disk_metadata,
+                         depends_on=("base memory", "base disk hash",
+                                     "base memory hash"),
+                         final_metadata={'properties': {
+                             CloudletAPI.IMAGE_TYPE_BASE_MEM: memory_meta_id,
+                             CloudletAPI.IMAGE_TYPE_BASE_DISK_HASH:
+                             diskhash_meta_id,
+                             CloudletAPI.IMAGE_TYPE_BASE_MEM_HASH:
+                             memoryhash_meta_id,
+                             }})
+            # the VM is paused and its disk extracted, so the disk uploads
+            # while the memory snapshot and hash lists are generated
+            uploader.mark_ready("base disk")
+
             update_task_state(task_state=task_states.IMAGE_UPLOADING,
                               expected_state=task_states.IMAGE_PENDING_UPLOAD)
-            synthesis._create_baseVM(self._conn,
-                                     virt_dom,
-                                     out_path,
-                                     basemem_path,
-                                     diskhash_path,
-                                     memhash_path,
-                                     nova_util=libvirt_utils)
-
-            self._update_to_glance(context, image_service, out_path,
-                                   disk_meta_id, disk_metadata)
-            LOG.info(_("Base disk upload complete"), instance=instance)
-            self._update_to_glance(context, image_service, basemem_path,
-                                   memory_meta_id, mem_metadata)
-            LOG.info(_("Base memory image upload complete"), instance=instance)
-            self._update_to_glance(context, image_service, diskhash_path,
-                                   diskhash_meta_id, diskhash_metadata)
-            LOG.info(_("Base disk upload complete"), instance=instance)
-            self._update_to_glance(context, image_service, memhash_path,
-                                   memoryhash_meta_id, memhash_metadata)
-            LOG.info(_("Base memory image upload complete"), instance=instance)
+            self._save_base_progress(instance, progress_state['phase'],
+                                     uploader)
+            try:
+                # run in a native thread so that uploads keep going while
+                # the memory snapshot and hash lists are generated
+                with phase_timer.phase('memory_snapshot_and_hashing'):
+                    tpool.execute(synthesis._create_baseVM,
+                                  self._conn,
+                                  virt_dom,
+                                  out_path,
+                                  basemem_path,
+                                  diskhash_path,
+                                  memhash_path,
+                                  nova_util=libvirt_utils)
+            except Exception:
+                with excutils.save_and_reraise_exception():
+                    uploader.abort()
+            # _create_baseVM does not report when the memory snapshot alone
+            # is final, so it is uploaded once the whole step returns
+            uploader.mark_ready("base memory")
+            uploader.mark_ready("base disk hash")
+            uploader.mark_ready("base memory hash")
+            progress_state['phase'] = CloudletAPI.BASE_PHASE_UPLOADING
+            self._save_base_progress(instance, progress_state['phase'],
+                                     uploader)
+            with phase_timer.phase('glance_upload_wait'):
+                uploader.wait()
+            for name, progress in uploader.progress.items():
+                phase_timer.add('glance_upload.%s' % name.replace(' ', '_'),
+                                progress.get('seconds', 0.0))
+            self._save_base_progress(instance, progress_state['phase'],
+                                     uploader)
+            LOG.info(_("Base VM upload complete"), instance=instance)
+        self._record_phases(context, instance, phase_timer)
+
+    def save_instance(self, instance, update_func=None,
+                      expected_task_state=None):
+        """Apply update_func to the instance and save it
+
+        Progress is saved from green threads while the compute manager
+        saves task states, so saves of an instance are serialized. A
+        progress save then never carries a task state change that is not
+        yet checked against its expected task state.
+        """
+        @utils.synchronized('cloudlet-instance-%s' % instance['uuid'])
+        def _save():
+            if update_func is not None:
+                update_func()
+            instance.save(expected_task_state=expected_task_state)
+        _save()
+
+    def _save_base_progress(self, instance, phase, uploader=None):
+        def _update():
+            system_meta = instance.system_metadata
+            system_meta[CloudletAPI.SYSMETA_BASE_PHASE] = phase
+            if uploader is not None:
+                bytes_done = sum(progress['bytes_sent']
+                                 for progress in uploader.progress.values())
+                bytes_total = sum(progress['bytes_total'] or 0
+                                  for progress in uploader.progress.values())
+                now = time.time()
+                if bytes_done > 0 and \
+                        CloudletAPI.SYSMETA_BASE_UPLOAD_STARTED_AT \
+                        not in system_meta:
+                    system_meta[CloudletAPI.SYSMETA_BASE_UPLOAD_STARTED_AT] = \
+                        "%.3f" % now
+                system_meta[CloudletAPI.SYSMETA_BASE_BYTES_DONE] = \
+                    str(bytes_done)
+                system_meta[CloudletAPI.SYSMETA_BASE_BYTES_TOTAL] = \
+                    str(bytes_total)
+                system_meta[CloudletAPI.SYSMETA_BASE_UPDATED_AT] = \
+                    "%.3f" % now
+                if bytes_total:
+                    instance.progress = bytes_done * 100 / bytes_total
+            instance.system_metadata = system_meta
+        try:
+            self.save_instance(instance, _update)
+        except Exception as e:
+            # progress report should not fail base VM creation
+            LOG.debug("cloudlet, cannot save base VM progress: %s" % str(e))
 
     def _create_network_only(self, xml, instance, network_info,
                              block_device_info=None):
@@ -245,19 +939,17 @@ class CloudletDriver(libvirt_driver.LibvirtDriver):
         except exception.InstanceNotFound:
             raise exception.InstanceNotRunning(instance_id=instance['uuid'])
 
+        phase_timer = PhaseTimer('overlay')
         # make sure base vm is cached
         (image_service, image_id) = glance.get_remote_image_service(
             context, instance['image_ref'])
         image_meta = image_service.show(context, image_id)
-        base_sha256_uuid, memory_snap_id, diskhash_snap_id, memhash_snap_id = \
-            self._get_basevm_meta_info(image_meta)
-        self._get_cache_image(context, instance, image_meta['id'])
-        self._get_cache_image(context, instance, memory_snap_id)
-        self._get_cache_image(context, instance, diskhash_snap_id)
-        self._get_cache_image(context, instance, memhash_snap_id)
+        self._wait_basevm(
+            self._prefetch_basevm(context, instance, image_meta), phase_timer)
 
         # pause VM
-        self.pause(instance)
+        with phase_timer.phase('pause'):
+            self.pause(instance)
 
         # create VM overlay
         (image_service, image_id) = glance.get_remote_image_service(
@@ -267,24 +959,75 @@ class CloudletDriver(libvirt_driver.LibvirtDriver):
         update_task_state(task_state=task_states.IMAGE_PENDING_UPLOAD,
                           expected_state=None)
 
-        vm_overlay = self.resumed_vm_dict.get(instance['uuid'], None)
+        vm_overlay = self.vm_registry.pop(CloudletVMRegistry.RESUMED,
+                                          instance['uuid'])
         if vm_overlay is None:
             raise exception.InstanceNotRunning(instance_id=instance['uuid'])
-        del self.resumed_vm_dict[instance['uuid']]
-        vm_overlay.create_overlay()
-        overlay_zip = vm_overlay.overlay_zipfile
-        LOG.info("overlay : %s" % str(overlay_zip))
+        streamed = False
+        if CONF.cloudlet.overlay_streaming_upload:
+            streamed = self._create_overlay_streaming(
+                context, image_service, vm_overlay, overlay_id,
+                meta_metadata, update_task_state, phase_timer)
+        else:
+            with phase_timer.phase('create_overlay'):
+                vm_overlay.create_overlay()
+        overlay_zip = getattr(vm_overlay, 'overlay_zipfile', None)
 
-        update_task_state(task_state=task_states.IMAGE_UPLOADING,
-                          expected_state=task_states.IMAGE_PENDING_UPLOAD)
+        if not streamed:
+            # spill to disk: upload the package elijah wrote
+            LOG.info("overlay : %s" % str(overlay_zip))
+            update_task_state(task_state=task_states.IMAGE_UPLOADING,
+                              expected_state=task_states.IMAGE_PENDING_UPLOAD)
 
-        # export to glance
-        self._update_to_glance(context, image_service, overlay_zip,
-                               overlay_id, meta_metadata)
+            # export to glance
+            with phase_timer.phase('glance_upload'):
+                self._update_to_glance(context, image_service, overlay_zip,
+                                       overlay_id, meta_metadata)
         LOG.info(_("overlay_vm upload complete"), instance=instance)
 
-        if os.path.exists(overlay_zip):
+        if overlay_zip and os.path.exists(overlay_zip):
             os.remove(overlay_zip)
+        self._record_phases(context, instance, phase_timer)
+
+    def _create_overlay_streaming(self, context, image_service, vm_overlay,
+                                  overlay_id, metadata, update_task_state,
+                                  phase_timer):
+        """Create the VM overlay and upload its package to glance as it is
+        packaged. Return False if elijah packaged it on disk instead.
+        """
+        # elijah leaves the overlay files unpackaged, they are packaged
+        # straight into the upload stream
+        vm_overlay.options.ZIP_CONTAINER = False
+        with phase_timer.phase('create_overlay'):
+            vm_overlay.create_overlay()
+        metafile = getattr(vm_overlay, 'overlay_metafile', None)
+        if getattr(vm_overlay, 'overlay_zipfile', None) or not metafile:
+            return False
+        paths = [metafile] + list(vm_overlay.overlay_files)
+
+        update_task_state(task_state=task_states.IMAGE_UPLOADING,
+                          expected_state=task_states.IMAGE_PENDING_UPLOAD)
+        stream = OverlayPackageStream()
+        package_thread = eventlet.spawn(stream.write_package, paths)
+        try:
+            try:
+                with phase_timer.phase('glance_upload'):
+                    image_service.update(context, overlay_id, metadata,
+                                         stream)
+            except Exception:
+                with excutils.save_and_reraise_exception():
+                    stream.close()
+                    try:
+                        package_thread.wait()
+                    except Exception as e:
+                        LOG.debug("cloudlet, overlay packaging failed: %s" %
+                                  str(e))
+            package_thread.wait()
+        finally:
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+        return True
 
     def perform_vmhandoff(self, context, instance, handoff_url,
                           update_task_state, residue_glance_id=None):
@@ -297,167 +1040,356 @@ class CloudletDriver(libvirt_driver.LibvirtDriver):
                 virt_dom = self._host.get_domain(instance)
         except exception.InstanceNotFound:
             raise exception.InstanceNotRunning(instance_id=instance['uuid'])
-        synthesized_vm = self.synthesized_vm_dics.get(instance['uuid'], None)
+        synthesized_vm = self.vm_registry.get(CloudletVMRegistry.SYNTHESIZED,
+                                              instance['uuid'])
         if synthesized_vm is None:
             raise exception.InstanceNotRunning(instance_id=instance['uuid'])
+        if self._launched_from_synthesis_cache(instance['uuid']):
+            # its disk and memory are not tracked against the base VM
+            msg = "cannot handoff VM launched from synthesized VM cache"
+            raise exception.ImageNotFound(msg)
 
         # get the file path for Base VM and VM overlay
         (image_service, image_id) = glance.get_remote_image_service(
             context, instance['image_ref'])
         image_meta = image_service.show(context, image_id)
-        base_sha256_uuid, memory_snap_id, diskhash_snap_id, memhash_snap_id = \
-            self._get_basevm_meta_info(image_meta)
-        basedisk_path = self._get_cache_image(
-            context, instance, image_meta['id'])
-        basemem_path = self._get_cache_image(context, instance, memory_snap_id)
-        diskhash_path = self._get_cache_image(
-            context, instance, diskhash_snap_id)
-        memhash_path = self._get_cache_image(
-            context, instance, memhash_snap_id)
-        base_vm_paths = [basedisk_path, basemem_path,
-                         diskhash_path, memhash_path]
+        phase_timer = PhaseTimer('handoff')
+        base_sha256_uuid = self._get_basevm_meta_info(image_meta)[0]
+        base_vm_paths = self._wait_basevm(
+            self._prefetch_basevm(context, instance, image_meta), phase_timer)
+        dest_wait = self._dest_prepare_waits.pop(instance['uuid'], None)
+        if dest_wait is not None:
+            phase_timer.add('handoff_dest_prepare', dest_wait)
 
         update_task_state(task_state=task_states.IMAGE_PENDING_UPLOAD,
                           expected_state=None)
-        try:
-            residue_filepath = self._handoff_send(
-                base_vm_paths, base_sha256_uuid, synthesized_vm, handoff_url
-            )
-        except handoff.HandoffError as e:
-            msg = "failed to perform VM handoff:\n"
-            msg += str(e)
-            raise exception.ImageNotFound(msg)
+        # handoff data and residue are staged here until the handoff ends
+        with utils.tempdir(prefix="cloudlet-residue-") as staging_dir:
+            residue_reader = None
+            upload_thread = None
+            if residue_glance_id and \
+                    urlsplit(handoff_url).scheme == "file":
+                # upload the residue to glance while handoff-proc writes it
+                meta_metadata = self._get_snapshot_metadata(
+                    virt_dom, context, instance, residue_glance_id)
+                residue_reader = GrowingZipReader(
+                    os.path.join(staging_dir, Cloudlet_Const.OVERLAY_ZIP))
+                upload_thread = eventlet.spawn(
+                    self._upload_residue, context, image_service,
+                    residue_glance_id, meta_metadata, residue_reader,
+                    update_task_state, phase_timer)
+            try:
+                with phase_timer.phase('handoff_send'):
+                    self._handoff_send(base_vm_paths, base_sha256_uuid,
+                                       synthesized_vm, handoff_url,
+                                       staging_dir, instance=instance)
+            except handoff.HandoffError as e:
+                self._stop_residue_upload(residue_reader, upload_thread)
+                msg = "failed to perform VM handoff:\n"
+                msg += str(e)
+                raise exception.ImageNotFound(msg)
+            except Exception:
+                with excutils.save_and_reraise_exception():
+                    self._stop_residue_upload(residue_reader, upload_thread)
+
+            self.vm_registry.pop(CloudletVMRegistry.SYNTHESIZED,
+                                 instance['uuid'])
+            if residue_reader is not None:
+                residue_reader.finish(True)
+                try:
+                    upload_thread.wait()
+                finally:
+                    residue_reader.close()
+                LOG.info(_("VM residue upload complete"), instance=instance)
+        self._record_phases(context, instance, phase_timer)
+
+    def wait_handoff_dest(self, instance, status_url, token):
+        """Wait until the handoff destination is ready for the VM, which
+        keeps running meanwhile. It is called before the handoff takes its
+        slot: two cloudlets handing off to each other would otherwise hold
+        the slots their destination VMs need.
+        """
+        start = time.time()
+        self._wait_handoff_dest_ready(status_url, token)
+        self._dest_prepare_waits[instance['uuid']] = time.time() - start
 
-        del self.synthesized_vm_dics[instance['uuid']]
-        if residue_filepath:
-            LOG.info("residue saved at %s" % residue_filepath)
-        if residue_filepath and residue_glance_id:
-            # export to glance
-            (image_service, image_id) = glance.get_remote_image_service(
-                context, instance['image_ref'])
-            meta_metadata = self._get_snapshot_metadata(
-                virt_dom,
-                context,
-                instance,
-                residue_glance_id)
-            update_task_state(task_state=task_states.IMAGE_UPLOADING,
-                              expected_state=task_states.IMAGE_PENDING_UPLOAD)
-            self._update_to_glance(context, image_service, residue_filepath,
-                                   residue_glance_id, meta_metadata)
-        # clean up
-        LOG.info(_("VM residue upload complete"), instance=instance)
-        if residue_filepath and os.path.exists(residue_filepath):
-            os.remove(residue_filepath)
+    def _wait_handoff_dest_ready(self, status_url, token):
+        """Wait until the destination VM has its base VM and listens for
+        the handoff stream, backing off from 0.5 s up to 5 s between checks
+        """
+        url = urlsplit(status_url)
+        headers = {"X-Auth-Token": token, "Content-type": "application/json"}
+        timeout = CONF.cloudlet.handoff_dest_prepare_timeout
+        deadline = time.time() + timeout
+        delay = 0.5
+        while True:
+            base_phase = None
+            conn = httplib.HTTPConnection(url.netloc, timeout=30)
+            try:
+                conn.request("GET", url.path, None, headers)
+                response = conn.getresponse()
+                data = response.read()
+                if response.status == 200:
+                    handoff_status = jsonutils.loads(data).get(
+                        "cloudlet-handoff", None) or {}
+                    base_phase = handoff_status.get("base", None)
+            except (httplib.HTTPException, socket.error) as e:
+                LOG.debug("cannot get handoff status from %s: %s" %
+                          (status_url, str(e)))
+            finally:
+                conn.close()
+            if base_phase == CloudletAPI.HANDOFF_BASE_READY:
+                return
+            if base_phase == CloudletAPI.HANDOFF_BASE_ERROR:
+                msg = "Handoff destination %s cannot get its base VM" %\
+                    status_url
+                raise exception.ImageNotFound(msg)
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                LOG.warning("handoff destination %s is not ready in %d "
+                            "seconds, streaming anyway" %
+                            (status_url, timeout))
+                return
+            eventlet.sleep(min(delay, remaining))
+            delay = min(delay * 2, 5)
+
+    def _stop_residue_upload(self, residue_reader, upload_thread):
+        """Fail the residue upload of a failed handoff"""
+        if residue_reader is None:
+            return
+        residue_reader.finish(False)
+        try:
+            upload_thread.wait()
+        except Exception as e:
+            LOG.debug("cloudlet, residue upload failed: %s" % str(e))
+        residue_reader.close()
+
+    def _upload_residue(self, context, image_service, residue_glance_id,
+                        metadata, residue_reader, update_task_state,
+                        phase_timer):
+        if not residue_reader.wait_created():
+            return
+        update_task_state(task_state=task_states.IMAGE_UPLOADING,
+                          expected_state=task_states.IMAGE_PENDING_UPLOAD)
+        with phase_timer.phase('glance_upload'):
+            image_service.update(context, residue_glance_id, metadata,
+                                 residue_reader)
 
     def _handoff_send(self, base_vm_paths, base_hashvalue,
-                      synthesized_vm, handoff_url):
+                      synthesized_vm, handoff_url, staging_dir,
+                      instance=None):
+        """Send the VM to handoff_url. Handoff data, and the residue of a
+        file:// handoff, are written to staging_dir
         """
-        """
-        # preload basevm hash dictionary for creating residue
+        # basevm hash dictionary for creating residue
         (basedisk_path, basemem_path,
          diskhash_path, memhash_path) = base_vm_paths
-        preload_thread = handoff.PreloadResidueData(diskhash_path, memhash_path)
-        preload_thread.start()
-        preload_thread.join()
+        basedisk_hashdict, basemem_hashdict = self.base_hashdict_cache.get(
+            base_hashvalue, diskhash_path, memhash_path)
 
         options = Options()
         options.TRIM_SUPPORT = True
         options.FREE_SUPPORT = True
         options.DISK_ONLY = False
 
-        # Set up temp file path for data structure and residue
-        residue_tmp_dir = mkdtemp(prefix="cloudlet-residue-")
-        handoff_send_datafile = os.path.join(residue_tmp_dir, "handoff_data")
+        # file path for data structure and residue
+        handoff_send_datafile = os.path.join(staging_dir, "handoff_data")
 
+        relay_port = None
         residue_zipfile = None
         dest_handoff_url = handoff_url
         parsed_handoff_url = urlsplit(handoff_url)
+        progress = HandoffProgress('sending')
         if parsed_handoff_url.scheme == "file":
             residue_zipfile = os.path.join(
-                residue_tmp_dir, Cloudlet_Const.OVERLAY_ZIP)
+                staging_dir, Cloudlet_Const.OVERLAY_ZIP)
             dest_handoff_url = "file://%s" % os.path.abspath(residue_zipfile)
+            progress.bytes_func = functools.partial(allocated_bytes,
+                                                    residue_zipfile)
+        elif parsed_handoff_url.scheme == "tcp" and \
+                CONF.cloudlet.handoff_local_relay:
+            relay_port = self.handoff_relay.forward(
+                parsed_handoff_url.hostname, parsed_handoff_url.port)
+            stream = self.handoff_relay.streams[relay_port]
+            dest_handoff_url = "tcp://127.0.0.1:%d" % relay_port
+            progress.bytes_func = lambda: stream['bytes_to_dest']
 
-        # handoff mode --> fix it to be serializable
-        handoff_mode = None  # use default
-
-        # data structure for handoff sending
-        handoff_ds_send = handoff.HandoffDataSend()
-        LOG.debug("save handoff data to %s" % handoff_send_datafile)
-        if hasattr(self, "uri"):
-            # icehouse
-            libvirt_uri = self.uri()
-        else:
-            # kilo
-            libvirt_uri = self._uri()
-        handoff_ds_send.save_data(
-            base_vm_paths, base_hashvalue,
-            preload_thread.basedisk_hashdict,
-            preload_thread.basemem_hashdict,
-            options, dest_handoff_url, handoff_mode,
-            synthesized_vm.fuse.mountpoint, synthesized_vm.qemu_logfile,
-            synthesized_vm.qmp_channel, synthesized_vm.machine.ID(),
-            synthesized_vm.fuse.modified_disk_chunks, libvirt_uri,
-        )
-
-        LOG.debug("start handoff send process")
-        handoff_ds_send.to_file(handoff_send_datafile)
-        cmd = ["/usr/local/bin/handoff-proc", "%s" % handoff_send_datafile]
-        LOG.debug("subprocess: %s" % cmd)
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, close_fds=True)
-
-        def _wait_for_handoff_send(print_log=False):
-            """Called at an interval until VM synthesis finishes."""
-            returncode = proc.poll()
-            if returncode is None:
-                # keep record stdout
-                LOG.debug("waiting for finishing handoff send")
-                in_ready, _, _ = select.select([proc.stdout], [], [])
-                try:
-                    buf = os.read(proc.stdout.fileno(), 1024*100)
-                    if print_log:
-                        LOG.debug(buf)
-                except OSError as e:
-                    if e.errno == errno.EAGAIN or e.errno == errno.EWOULDBLOCK:
-                        return
+        try:
+            # handoff mode chosen for the link, None to use the default
+            mode_tuner = None
+            handoff_mode = None
+            if CONF.cloudlet.handoff_mode_adaptive and \
+                    progress.bytes_func is not None:
+                destination = parsed_handoff_url.hostname or \
+                    parsed_handoff_url.scheme
+                mode_tuner = self.handoff_mode_selector.tuner(destination)
+                handoff_mode = mode_tuner.mode()
+                LOG.debug("handoff mode to %s: %s" %
+                          (destination, handoff_mode))
+
+            # data structure for handoff sending
+            handoff_ds_send = handoff.HandoffDataSend()
+            LOG.debug("save handoff data to %s" % handoff_send_datafile)
+            if hasattr(self, "uri"):
+                # icehouse
+                libvirt_uri = self.uri()
             else:
-                raise loopingcall.LoopingCallDone()
-        timer = loopingcall.FixedIntervalLoopingCall(
-            _wait_for_handoff_send,
-            print_log=True)
-        timer.start(interval=0.5).wait()
+                # kilo
+                libvirt_uri = self._uri()
+
+            # handoff-proc takes the chunk numbers as a plain list
+            modified_disk_chunks = list(
+                synthesized_vm.fuse.modified_disk_chunks)
+
+            # with share_base_hash_index, hash indexes are saved as their path,
+            # so that handoff-proc maps them instead of parsing a copy
+            handoff_ds_send.save_data(
+                base_vm_paths, base_hashvalue,
+                basedisk_hashdict, basemem_hashdict,
+                options, dest_handoff_url, handoff_mode,
+                synthesized_vm.fuse.mountpoint, synthesized_vm.qemu_logfile,
+                synthesized_vm.qmp_channel, synthesized_vm.machine.ID(),
+                modified_disk_chunks, libvirt_uri,
+            )
+            handoff_ds_send.to_file(handoff_send_datafile)
+
+            LOG.debug("start handoff send process")
+            cmd = ["/usr/local/bin/handoff-proc", "%s" % handoff_send_datafile]
+            self._run_handoff_proc(cmd, instance, progress, mode_tuner)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                if relay_port is not None:
+                    # handoff-proc is gone, nothing connects to the relay
+                    self.handoff_relay.close(relay_port)
         LOG.info("Handoff send finishes")
         return residue_zipfile
 
-    def _get_cache_image(self, context, instance, snapshot_id, suffix=''):
-        def basepath(fname='', suffix=suffix):
-            return os.path.join(libvirt_utils.get_instance_path(instance),
-                                fname + suffix)
-
-        def raw(fname, image_type='raw'):
-            return self.image_backend.image(instance, fname, image_type)
+    def _run_handoff_proc(self, cmd, instance=None, progress=None,
+                          mode_tuner=None):
+        """Run handoff-proc or handoff-server-proc until it exits, and
+        follow the progress measured meanwhile. With mode_tuner, the rate
+        measured is observed for the next handoff to the destination.
+        """
+        LOG.debug("subprocess: %s" % cmd)
+        if progress is None:
+            progress = HandoffProgress(os.path.basename(cmd[0]))
+        proc = green_subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                      close_fds=True)
+        follower = eventlet.spawn(self._follow_handoff_progress,
+                                  progress, instance)
+        # exit is noticed as soon as the output ends
+        for line in iter(proc.stdout.readline, ''):
+            progress.feed(line)
+        returncode = proc.wait()
+        follower.kill()
+        progress.sample()
+        if mode_tuner is not None and returncode == 0:
+            mode_tuner.finish(progress)
+        LOG.info("%s finished (%d bytes, %.1f MB/s)" %
+                 (os.path.basename(cmd[0]), progress.bytes_sent,
+                  progress.throughput() / 1024 / 1024))
+        if returncode != 0:
+            msg = "%s exited with %d\n" % (cmd[0], returncode)
+            msg += "\n".join(progress.output_tail)
+            raise handoff.HandoffError(msg)
+        return progress
+
+    def _follow_handoff_progress(self, progress, instance):
+        while True:
+            eventlet.sleep(CONF.cloudlet.handoff_progress_interval)
+            if not progress.sample():
+                continue
+            if instance is not None:
+                self._save_handoff_progress(instance, progress)
+
+    def _save_handoff_progress(self, instance, progress):
+        def _update():
+            instance.progress = progress.percent()
+            system_meta = instance.system_metadata
+            system_meta['cloudlet_handoff_phase'] = str(progress.phase)
+            system_meta['cloudlet_handoff_bytes'] = str(progress.bytes_sent)
+            system_meta['cloudlet_handoff_throughput'] = \
+                str(int(progress.throughput()))
+            instance.system_metadata = system_meta
+        try:
+            self.save_instance(instance, _update)
+        except Exception as e:
+            # progress report should not fail VM handoff
+            LOG.debug("cloudlet, cannot save handoff progress: %s" % str(e))
+
+    def _prefetch_basevm(self, context, instance, image_meta,
+                         acquire=False):
+        """Start fetching base disk, memory, disk hash and memory hash into
+        the base VM cache. Call wait() on the returned handle to get paths.
+        """
+        base_sha256_uuid, memory_snap_id, diskhash_snap_id, memhash_snap_id = \
+            self._get_basevm_meta_info(image_meta)
+        if memory_snap_id is None:
+            msg = "image does not have properties for cloudlet base VM"
+            raise exception.ImageNotFound(msg)
+        image_ids = {
+            CloudletBaseCache.ARTIFACT_DISK: image_meta['id'],
+            CloudletBaseCache.ARTIFACT_MEMORY: memory_snap_id,
+            CloudletBaseCache.ARTIFACT_DISK_HASH: diskhash_snap_id,
+            CloudletBaseCache.ARTIFACT_MEMORY_HASH: memhash_snap_id,
+            }
+        return self.base_cache.prefetch(context, instance, base_sha256_uuid,
+                                        image_ids, acquire=acquire)
+
+    def _get_cached_basevm(self, context, instance, image_meta,
+                           acquire=False):
+        """Return paths of base disk, memory, disk hash and memory hash
+        from the base VM cache, fetching them from glance on a miss
+        """
+        return self._prefetch_basevm(context, instance, image_meta,
+                                     acquire=acquire).wait()
 
-        # ensure directories exist and are writable
-        fileutils.ensure_tree(basepath(suffix=''))
-        fname = hashlib.sha1(snapshot_id).hexdigest()
-        LOG.debug(_("cloudlet, caching file at %s" % fname))
+    def _wait_basevm(self, base_prefetch, phase_timer, instance=None):
+        """Wait for the base VM and record how long each artifact took to
+        fetch. With an instance about to run from the base VM, also check
+        that its flavor's root disk can hold the base disk.
+        """
+        with phase_timer.phase('base_wait'):
+            base_vm_paths = base_prefetch.wait()
+        for artifact, seconds in base_prefetch.fetch_timings.items():
+            phase_timer.add('base_fetch.%s' % artifact, seconds)
+        if instance is not None:
+            self._verify_base_disk_size(instance, base_vm_paths[0])
+        return base_vm_paths
+
+    def _verify_base_disk_size(self, instance, basedisk_path):
+        # same check as the libvirt image backend does for cached images
         size = instance['root_gb'] * 1024 * 1024 * 1024
-        if size == 0:
-            size = None
-
-        raw('disk').cache(fetch_func=libvirt_utils.fetch_image,
-                          context=context,
-                          filename=fname,
-                          size=size,
-                          image_id=snapshot_id,
-                          user_id=instance['user_id'],
-                          project_id=instance['project_id'])
-
-        # from cache method at virt/libvirt/imagebackend.py
-        abspath = os.path.join(
-            libvirt_driver.CONF.instances_path,
-            libvirt_driver.CONF.image_cache_subdirectory_name,
-            fname)
-        return abspath
+        if size and size < disk.get_disk_size(basedisk_path):
+            LOG.error(_("cloudlet, flavor root disk of %(size)s bytes is "
+                        "smaller than base disk %(path)s") %
+                      {'size': size, 'path': basedisk_path},
+                      instance=instance)
+            raise exception.FlavorDiskTooSmall()
+
+    @staticmethod
+    def _parse_base_hashdict(diskhash_path, memhash_path):
+        # run in place rather than as a thread, since it is called from a
+        # native thread of tpool
+        loader = handoff.PreloadResidueData(diskhash_path, memhash_path)
+        loader.run()
+        if loader.basedisk_hashdict is None or \
+                loader.basemem_hashdict is None:
+            msg = "Cannot load hash dictionaries from %s and %s" % \
+                (diskhash_path, memhash_path)
+            raise handoff.HandoffError(msg)
+        return loader.basedisk_hashdict, loader.basemem_hashdict
+
+    def _preload_base_hashdict(self, base_sha256_uuid, base_prefetch):
+        """Load hash dictionaries needed for VM handoff in the background,
+        so that a later handoff does not have to parse them
+        """
+        if not CONF.cloudlet.preload_base_hashdict:
+            return
+        (basedisk_path, basemem_path,
+         diskhash_path, memhash_path) = base_prefetch.wait()
+        self.base_hashdict_cache.preload(base_sha256_uuid,
+                                         diskhash_path, memhash_path)
 
     def _polish_VM_configuration(self, xml):
         # remove cpu element
@@ -533,6 +1465,7 @@ class CloudletDriver(libvirt_driver.LibvirtDriver):
             original_meta.append(metadata_dict)
             target_instance['metadata'] = original_meta
 
+        phase_timer = PhaseTimer('spawn')
         # get meta info related to VM synthesis
         base_sha256_uuid, memory_snap_id, diskhash_snap_id, memhash_snap_id = \
             self._get_basevm_meta_info(image_meta)
@@ -545,108 +1478,198 @@ class CloudletDriver(libvirt_driver.LibvirtDriver):
             if "handoff_info" in instance_meta.keys():
                 handoff_info = instance_meta.get("handoff_info")
 
+        if (overlay_url is not None) and (handoff_info is None) and \
+                self.work_scheduler.is_full(CloudletWorkScheduler.SYNTHESIS):
+            # let the scheduler try another compute node
+            self.work_scheduler.refuse(CloudletWorkScheduler.SYNTHESIS)
+            reason = "too many VM syntheses are waiting at this node"
+            raise exception.RescheduledException(
+                instance_uuid=instance['uuid'], reason=reason)
+
+        # fetch base VM in the background while preparing the instance
+        base_prefetch = None
+        if memory_snap_id is not None:
+            base_prefetch = self._prefetch_basevm(context, instance,
+                                                  image_meta, acquire=True)
+        if handoff_info is not None:
+            # the handoff source waits for this VM to become ready
+            self._save_handoff_base_phase(
+                instance, CloudletAPI.HANDOFF_BASE_FETCHING)
+
         # original openstack logic
-        disk_info = blockinfo.get_disk_info(
-            libvirt_driver.CONF.libvirt.virt_type,
-            instance,
-            block_device_info,
-            image_meta)
-
-        if hasattr(self, 'to_xml'):  # icehouse
-            xml = self.to_xml(context, instance, network_info,
-                              disk_info, image_meta,
-                              block_device_info=block_device_info,
-                              write_to_disk=True)
-        elif hasattr(self, '_get_guest_xml'):  # kilo
-            xml = self._get_guest_xml(context, instance, network_info,
-                                      disk_info, image_meta,
-                                      block_device_info=block_device_info,
-                                      write_to_disk=True)
-
-        # handle xml configuration to make a portable VM
-        xml_obj = ElementTree.fromstring(xml)
-        xml = self._polish_VM_configuration(xml_obj)
-
-        # avoid injecting key, password, and metadata since we're resuming VM
-        original_inject_password = libvirt_driver.CONF.libvirt.inject_password
-        original_inject_key = libvirt_driver.CONF.libvirt.inject_key
-        original_metadata = instance.get('metadata')
-        libvirt_driver.CONF.libvirt.inject_password = None
-        libvirt_driver.CONF.libvirt.inject_key = None
-        instance['metadata'] = {}
-
-        self._create_image(context, instance,
-                           disk_info['mapping'],
-                           network_info=network_info,
-                           block_device_info=block_device_info,
-                           files=injected_files,
-                           admin_pass=admin_password)
-
-        # revert back the configuration
-        libvirt_driver.CONF.libvirt.inject_password = original_inject_password
-        libvirt_driver.CONF.libvirt.inject_key = original_inject_key
-        instance['metadata'] = original_metadata
+        with phase_timer.phase('xml'):
+            disk_info = blockinfo.get_disk_info(
+                libvirt_driver.CONF.libvirt.virt_type,
+                instance,
+                block_device_info,
+                image_meta)
+
+            if hasattr(self, 'to_xml'):  # icehouse
+                xml = self.to_xml(context, instance, network_info,
+                                  disk_info, image_meta,
+                                  block_device_info=block_device_info,
+                                  write_to_disk=True)
+            elif hasattr(self, '_get_guest_xml'):  # kilo
+                xml = self._get_guest_xml(context, instance, network_info,
+                                          disk_info, image_meta,
+                                          block_device_info=block_device_info,
+                                          write_to_disk=True)
+
+            # handle xml configuration to make a portable VM
+            xml_obj = ElementTree.fromstring(xml)
+            xml = self._polish_VM_configuration(xml_obj)
+
+        with phase_timer.phase('image_prep'):
+            if (overlay_url is not None) or (handoff_info is not None) or \
+                    (memory_snap_id is not None):
+                # VM runs from launch disk or cached base disk, so skip
+                # creating root disk and injecting files into it since we're
+                # resuming VM
+                self._create_cloudlet_image(instance,
+                                            network_info=network_info,
+                                            files=injected_files,
+                                            admin_pass=admin_password)
+            else:
+                self._create_image(context, instance,
+                                   disk_info['mapping'],
+                                   network_info=network_info,
+                                   block_device_info=block_device_info,
+                                   files=injected_files,
+                                   admin_pass=admin_password)
+
+        # lifecycle events of the VM tell when it is running
+        self._boot_waiters[str(instance['uuid'])] = queue.LightQueue()
 
         if (overlay_url is not None) and (handoff_info is None):
             # spawn instance using VM synthesis
             LOG.debug(_('cloudlet, synthesis start'))
             # append metadata to the instance
-            self._create_network_only(xml, instance, network_info,
-                                      block_device_info)
-            synthesized_vm = self._spawn_using_synthesis(context, instance,
-                                                         xml, image_meta,
-                                                         overlay_url)
+            with phase_timer.phase('network'):
+                self._create_network_only(xml, instance, network_info,
+                                          block_device_info)
+            with self.cloudlet_slot(CloudletWorkScheduler.SYNTHESIS,
+                                    instance['uuid']):
+                synthesized_vm = self._spawn_using_synthesis(
+                    context, instance, xml, image_meta, overlay_url,
+                    base_prefetch, phase_timer)
             instance_uuid = str(instance.get('uuid', ''))
-            self.synthesized_vm_dics[instance_uuid] = synthesized_vm
+            self.vm_registry.add(CloudletVMRegistry.SYNTHESIZED,
+                                 instance_uuid, instance['name'],
+                                 synthesized_vm)
+            if not self._launched_from_synthesis_cache(instance_uuid):
+                self._preload_base_hashdict(base_sha256_uuid, base_prefetch)
         elif handoff_info is not None:
             # spawn instance using VM handoff
             LOG.debug(_('cloudlet, Handoff start'))
-            self._create_network_only(xml, instance, network_info,
-                                      block_device_info)
-            synthesized_vm = self._spawn_using_handoff(context, instance,
-                                                       xml, image_meta,
-                                                       handoff_info)
+            with phase_timer.phase('network'):
+                self._create_network_only(xml, instance, network_info,
+                                          block_device_info)
+            with self.cloudlet_slot(CloudletWorkScheduler.HANDOFF,
+                                    instance['uuid']):
+                synthesized_vm = self._spawn_using_handoff(
+                    context, instance, xml, image_meta, handoff_info,
+                    base_prefetch, phase_timer)
             instance_uuid = str(instance.get('uuid', ''))
-            self.synthesized_vm_dics[instance_uuid] = synthesized_vm
-            pass
+            self.vm_registry.add(CloudletVMRegistry.SYNTHESIZED,
+                                 instance_uuid, instance['name'],
+                                 synthesized_vm)
+            self._preload_base_hashdict(base_sha256_uuid, base_prefetch)
         elif memory_snap_id is not None:
             # resume from memory snapshot
             LOG.debug(_('cloudlet, resume from memory snapshot'))
-            # append metadata to the instance
-            basedisk_path = self._get_cache_image(context, instance,
-                                                  image_meta['id'])
-            basemem_path = self._get_cache_image(context, instance,
-                                                 memory_snap_id)
-            diskhash_path = self._get_cache_image(context, instance,
-                                                  diskhash_snap_id)
-            memhash_path = self._get_cache_image(context, instance,
-                                                 memhash_snap_id)
-
             LOG.debug(_('cloudlet, creating network'))
-            self._create_network_only(xml, instance, network_info,
-                                      block_device_info)
-            LOG.debug(_('cloudlet, resuming base vm'))
-            self.resume_basevm(instance, xml, basedisk_path, basemem_path,
-                               diskhash_path, memhash_path, base_sha256_uuid)
+            with phase_timer.phase('network'):
+                self._create_network_only(xml, instance, network_info,
+                                          block_device_info)
+            basedisk_path, basemem_path, diskhash_path, memhash_path = \
+                self._wait_basevm(base_prefetch, phase_timer,
+                                  instance=instance)
+            if self.base_warmer.record_resume(base_sha256_uuid):
+                LOG.debug(_('cloudlet, resuming base vm from page cache'))
+            else:
+                LOG.debug(_('cloudlet, resuming base vm'))
+            with phase_timer.phase('resume'):
+                self.resume_basevm(instance, xml, basedisk_path,
+                                   basemem_path, diskhash_path, memhash_path,
+                                   base_sha256_uuid)
         else:
-            self._create_domain_and_network(context,
-                                            xml,
-                                            instance,
-                                            network_info,
-                                            block_device_info)
+            with phase_timer.phase('create_domain'):
+                self._create_domain_and_network(context,
+                                                xml,
+                                                instance,
+                                                network_info,
+                                                block_device_info)
 
         LOG.debug(_("Instance is running"), instance=instance)
 
-        def _wait_for_boot():
-            """Called at an interval until the VM is running."""
-            state = self.get_info(instance).state
+        with phase_timer.phase('boot_wait'):
+            if not self._wait_for_boot_event(instance):
+                LOG.debug(_("cloudlet, no lifecycle event, polling VM state"),
+                          instance=instance)
+
+                def _wait_for_boot():
+                    """Called at an interval until the VM is running."""
+                    state = self.get_info(instance).state
 
-            if state == power_state.RUNNING:
-                raise loopingcall.LoopingCallDone()
-        timer = loopingcall.FixedIntervalLoopingCall(_wait_for_boot)
-        timer.start(interval=0.5).wait()
+                    if state == power_state.RUNNING:
+                        raise loopingcall.LoopingCallDone()
+                timer = loopingcall.FixedIntervalLoopingCall(_wait_for_boot)
+                timer.start(interval=0.5).wait()
         LOG.info(_("Instance spawned successfully."),
                  instance=instance)
+        self._record_phases(context, instance, phase_timer, notify=True)
+
+    def _wait_for_boot_event(self, instance):
+        """Wait for lifecycle events until the VM is running. Returns
+        False if it is not running within boot_event_timeout
+        """
+        waiter = self._boot_waiters.get(str(instance['uuid']), None)
+        if waiter is None:
+            return False
+        deadline = time.time() + CONF.cloudlet.boot_event_timeout
+        try:
+            while self.get_info(instance).state != power_state.RUNNING:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                try:
+                    transition = waiter.get(timeout=remaining)
+                except queue.Empty:
+                    return False
+                LOG.debug(_("cloudlet, lifecycle event %s" % transition),
+                          instance=instance)
+            return True
+        finally:
+            self._boot_waiters.pop(str(instance['uuid']), None)
+
+    def _create_cloudlet_image(self, instance, network_info=None,
+                               files=None, admin_pass=None):
+        """Create only what a resumed cloudlet VM uses from the instance
+        directory: console log and config drive if required
+        """
+        instance_dir = libvirt_utils.get_instance_path(instance)
+        fileutils.ensure_tree(instance_dir)
+        LOG.info(_('Creating cloudlet image'), instance=instance)
+
+        console_log = self._get_console_log_path(instance)
+        if hasattr(self, '_chown_console_log_for_instance'):
+            # console.log may already exist
+            self._chown_console_log_for_instance(instance)
+        libvirt_utils.write_to_file(console_log, '', 7)
+
+        if configdrive.required_by(instance):
+            LOG.info(_('Using config drive'), instance=instance)
+            extra_md = {}
+            if admin_pass:
+                extra_md['admin_pass'] = admin_pass
+            inst_md = instance_metadata.InstanceMetadata(
+                instance, content=files, extra_md=extra_md,
+                network_info=network_info)
+            configdrive_path = os.path.join(instance_dir, 'disk.config')
+            with configdrive.ConfigDriveBuilder(instance_md=inst_md) as cdb:
+                LOG.info(_('Creating config drive at %s' % configdrive_path),
+                         instance=instance)
+                cdb.make_drive(configdrive_path)
 
     def _destroy(self, instance):
         """overwrite original libvirt_driver's _destroy method
@@ -655,15 +1678,17 @@ class CloudletDriver(libvirt_driver.LibvirtDriver):
 
         # get meta info related to VM synthesis
         instance_uuid = str(instance.get('uuid', ''))
+        self._boot_waiters.pop(instance_uuid, None)
 
         # check resumed base VM list
-        vm_overlay = self.resumed_vm_dict.get(instance_uuid, None)
+        vm_overlay = self.vm_registry.pop(CloudletVMRegistry.RESUMED,
+                                          instance_uuid)
         if vm_overlay is not None:
             vm_overlay.terminate()
-            del self.resumed_vm_dict[instance['uuid']]
 
         # check synthesized VM list
-        synthesized_VM = self.synthesized_vm_dics.get(instance_uuid, None)
+        synthesized_VM = self.vm_registry.pop(CloudletVMRegistry.SYNTHESIZED,
+                                              instance_uuid)
         if synthesized_VM is not None:
             LOG.info(_("Deallocate all resources of synthesized VM"),
                      instance=instance)
@@ -672,7 +1697,13 @@ class CloudletDriver(libvirt_driver.LibvirtDriver):
                 # since OpenStack will do that
                 synthesized_VM.machine = None
             synthesized_VM.terminate()
-            del self.synthesized_vm_dics[instance_uuid]
+
+        # base VM can be evicted from the cache from now on
+        self.base_cache.release(instance_uuid)
+        if self.overlay_cache is not None:
+            self.overlay_cache.release(instance_uuid)
+        if self.synthesis_cache is not None:
+            self.synthesis_cache.release(instance_uuid)
 
     def resume_basevm(self, instance, xml, base_disk, base_memory,
                       base_diskmeta, base_memmeta, base_hashvalue):
@@ -693,54 +1724,80 @@ class CloudletDriver(libvirt_driver.LibvirtDriver):
                                           nova_util=libvirt_utils,
                                           nova_conn=self._conn)
         virt_dom = vm_overlay.resume_basevm()
-        self.resumed_vm_dict[instance['uuid']] = vm_overlay
+        self.vm_registry.add(CloudletVMRegistry.RESUMED, instance['uuid'],
+                             instance['name'], vm_overlay)
         synthesis.rettach_nic(virt_dom, vm_overlay.old_xml_str, xml)
 
     def _spawn_using_synthesis(self, context, instance, xml,
-                               image_meta, overlay_url):
-        # download vm overlay
-        overlay_package = VMOverlayPackage(overlay_url)
-        meta_raw = overlay_package.read_meta()
-        meta_info = msgpack.unpackb(meta_raw)
-        basevm_sha256 = meta_info.get(Cloudlet_Const.META_BASE_VM_SHA256, None)
+                               image_meta, overlay_url, base_prefetch,
+                               phase_timer):
+        if base_prefetch is None:
+            msg = "image does not have properties for cloudlet base VM"
+            raise exception.ImageNotFound(msg)
         image_properties = image_meta.get("properties", None)
         if image_properties is None:
             msg = "image does not have properties for cloudlet metadata"
             raise exception.ImageNotFound(msg)
         image_sha256 = image_properties.get(CloudletAPI.PROPERTY_KEY_BASE_UUID)
 
-        # check basevm
-        if basevm_sha256 != image_sha256:
-            msg = "requested base vm is not compatible with openstack base disk %s != %s" \
-                % (basevm_sha256, image_sha256)
-            raise exception.ImageNotFound(msg)
-        memory_snap_id = str(
-            image_properties.get(CloudletAPI.IMAGE_TYPE_BASE_MEM))
-        diskhash_snap_id = str(
-            image_properties.get(CloudletAPI.IMAGE_TYPE_BASE_DISK_HASH))
-        memhash_snap_id = str(
-            image_properties.get(CloudletAPI.IMAGE_TYPE_BASE_MEM_HASH))
-        basedisk_path = self._get_cache_image(context, instance,
-                                              image_meta['id'])
-        basemem_path = self._get_cache_image(context, instance, memory_snap_id)
-        diskhash_path = self._get_cache_image(context, instance,
-                                              diskhash_snap_id)
-        memhash_path = self._get_cache_image(context, instance, memhash_snap_id)
-
-        # download blob
-        fileutils.ensure_tree(libvirt_utils.get_instance_path(instance))
-        decomp_overlay = os.path.join(libvirt_utils.get_instance_path(instance),
-            'decomp_overlay')
-
-        meta_info = compression.decomp_overlayzip(overlay_url, decomp_overlay)
+        def _check_basevm(meta_info):
+            basevm_sha256 = meta_info.get(Cloudlet_Const.META_BASE_VM_SHA256,
+                                          None)
+            if basevm_sha256 != image_sha256:
+                msg = "requested base vm is not compatible with openstack base disk %s != %s" \
+                    % (basevm_sha256, image_sha256)
+                raise exception.ImageNotFound(msg)
+
+        def _download_overlay(decomp_overlay, overlay_package):
+            # download blob while base VM is being fetched
+            meta_info = msgpack.unpackb(overlay_package.read_meta())
+            _check_basevm(meta_info)
+            return self._decomp_overlay(overlay_url, overlay_package,
+                                        meta_info, decomp_overlay,
+                                        phase_timer)
+
+        instance_uuid = str(instance['uuid'])
+        use_synthesis_cache = self._use_synthesis_cache(context, instance)
+        with phase_timer.phase('overlay_meta'):
+            # read meta first; overlay is not needed on a synthesis cache hit
+            overlay_package = VMOverlayPackage(overlay_url)
+            meta_info = msgpack.unpackb(overlay_package.read_meta())
+            _check_basevm(meta_info)
+            overlay_id = sha256(msgpack.packb(meta_info)).hexdigest()
+
+        if use_synthesis_cache:
+            cached_images = self.synthesis_cache.get(image_sha256, overlay_id,
+                                                     instance_uuid)
+            if cached_images is not None:
+                # runs without the base VM, so there is no need to wait
+                LOG.info(_("Starting VM from synthesized VM cache"),
+                         instance=instance)
+                return self._launch_from_synthesis_cache(
+                    xml, cached_images[0], cached_images[1], phase_timer)
+
+        if self.overlay_cache is not None:
+            meta_info, decomp_overlay, overlay_id = self.overlay_cache.get(
+                overlay_url, instance_uuid,
+                lambda decomp_path: _download_overlay(decomp_path,
+                                                      overlay_package))
+            _check_basevm(meta_info)
+        else:
+            fileutils.ensure_tree(libvirt_utils.get_instance_path(instance))
+            decomp_overlay = os.path.join(
+                libvirt_utils.get_instance_path(instance), 'decomp_overlay')
+            _download_overlay(decomp_overlay, overlay_package)
+        basedisk_path, basemem_path, diskhash_path, memhash_path = \
+            self._wait_basevm(base_prefetch, phase_timer,
+                              instance=instance)
 
         # recover VM
-        launch_disk, launch_mem, fuse, delta_proc, fuse_proc = \
-            synthesis.recover_launchVM(basedisk_path, meta_info,
-                                       decomp_overlay,
-                                       base_mem=basemem_path,
-                                       base_diskmeta=diskhash_path,
-                                       base_memmeta=memhash_path)
+        with phase_timer.phase('recover_launch_vm'):
+            launch_disk, launch_mem, fuse, delta_proc, fuse_proc = \
+                synthesis.recover_launchVM(basedisk_path, meta_info,
+                                           decomp_overlay,
+                                           base_mem=basemem_path,
+                                           base_diskmeta=diskhash_path,
+                                           base_memmeta=memhash_path)
         # resume VM
         LOG.info(_("Starting VM synthesis"), instance=instance)
         synthesized_vm = synthesis.SynthesizedVM(launch_disk, launch_mem, fuse,
@@ -751,37 +1808,227 @@ class CloudletDriver(libvirt_driver.LibvirtDriver):
                                                  nova_util=libvirt_utils
                                                  )
         # testing non-thread resume
-        delta_proc.start()
-        fuse_proc.start()
-        delta_proc.join()
-        fuse_proc.join()
+        with phase_timer.phase('delta_fuse_join'):
+            delta_proc.start()
+            fuse_proc.start()
+            delta_proc.join()
+            fuse_proc.join()
         LOG.info(_("Finish VM synthesis"), instance=instance)
-        synthesized_vm.resume()
+        self._release_decomp_overlay(instance_uuid, decomp_overlay)
+        pristine_disk = None
+        if use_synthesis_cache:
+            # the VM writes into its launch disk once resumed
+            with phase_timer.phase('synthesis_cache_snapshot'):
+                pristine_disk = self._snapshot_launch_disk(launch_disk,
+                                                           meta_info)
+        with phase_timer.phase('resume'):
+            synthesized_vm.resume()
         # rettach NIC
-        synthesis.rettach_nic(synthesized_vm.machine,
-                              synthesized_vm.old_xml_str, xml)
+        with phase_timer.phase('nic_reattach'):
+            synthesis.rettach_nic(synthesized_vm.machine,
+                                  synthesized_vm.old_xml_str, xml)
+
+        if pristine_disk is not None:
+            # off the critical path of this spawn
+            eventlet.spawn_n(self._cache_synthesized_vm, image_sha256,
+                             overlay_id, meta_info, pristine_disk,
+                             launch_mem, basedisk_path, basemem_path)
+        return synthesized_vm
 
+    def _release_decomp_overlay(self, instance_uuid, decomp_overlay):
+        """The decompressed overlay is no longer needed by this instance"""
+        if self.overlay_cache is not None:
+            self.overlay_cache.release(instance_uuid)
+        elif os.path.exists(decomp_overlay):
+            os.remove(decomp_overlay)
+
+    @staticmethod
+    def _overlay_chunks(meta_info):
+        """Return sets of disk and memory chunks carried by the VM overlay"""
+        disk_chunks = set()
+        memory_chunks = set()
+        for blob_info in meta_info[Cloudlet_Const.META_OVERLAY_FILES]:
+            disk_chunks.update(
+                blob_info[Cloudlet_Const.META_OVERLAY_FILE_DISK_CHUNKS])
+            memory_chunks.update(
+                blob_info[Cloudlet_Const.META_OVERLAY_FILE_MEMORY_CHUNKS])
+        return disk_chunks, memory_chunks
+
+    def _snapshot_launch_disk(self, launch_disk, meta_info):
+        """Copy the chunks of the launch disk recovered from the VM overlay
+        into a sparse file, before the resumed VM modifies them
+        """
+        disk_chunks = self._overlay_chunks(meta_info)[0]
+        snapshot_path = launch_disk + ".pristine"
+        with open(snapshot_path, "wb") as f:
+            f.truncate(os.path.getsize(launch_disk))
+        try:
+            tpool.execute(copy_chunks, launch_disk, snapshot_path,
+                          disk_chunks, Cloudlet_Const.CHUNK_SIZE)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                os.remove(snapshot_path)
+        return snapshot_path
+
+    def _cache_synthesized_vm(self, base_sha256_uuid, overlay_id, meta_info,
+                              pristine_disk, launch_mem, basedisk_path,
+                              basemem_path):
+        """Store launch images of a synthesized VM in the synthesis cache
+
+        Each cached image is the base VM image with the chunks of the VM
+        overlay written over it, as cloudletfs presented it at resume. Disk
+        chunks come from the snapshot taken before resume; the memory
+        snapshot is not written once the VM is restored.
+        """
+        disk_chunks, memory_chunks = self._overlay_chunks(meta_info)
+
+        def _write_image(base_path, overlay_path, chunks, size, image_path):
+            utils.execute('cp', '--sparse=always', base_path, image_path)
+            with open(image_path, "r+b") as f:
+                f.truncate(size)
+            tpool.execute(copy_chunks, overlay_path, image_path, chunks,
+                          Cloudlet_Const.CHUNK_SIZE)
+
+        def _fill(disk_path, memory_path):
+            _write_image(basedisk_path, pristine_disk, disk_chunks,
+                         meta_info[Cloudlet_Const.META_RESUME_VM_DISK_SIZE],
+                         disk_path)
+            _write_image(basemem_path, launch_mem, memory_chunks,
+                         meta_info[Cloudlet_Const.META_RESUME_VM_MEMORY_SIZE],
+                         memory_path)
+
+        try:
+            self.synthesis_cache.add(base_sha256_uuid, overlay_id, _fill)
+            LOG.info(_("cloudlet, cached synthesized VM %s" % overlay_id))
+        except Exception as e:
+            LOG.warning(_("cloudlet, failed to cache synthesized VM: %s"
+                          % str(e)))
+        finally:
+            os.remove(pristine_disk)
+
+    def _launched_from_synthesis_cache(self, instance_uuid):
+        return self.synthesis_cache is not None and \
+            self.synthesis_cache.is_used_by(instance_uuid)
+
+    def _use_synthesis_cache(self, context, instance):
+        if self.synthesis_cache is None:
+            return False
+        if hasattr(instance, 'get_flavor'):
+            # kilo
+            flavor = instance.get_flavor()
+        else:
+            # icehouse
+            flavor = flavor_obj.Flavor.get_by_id(
+                context, instance['instance_type_id'])
+        extra_specs = flavor.extra_specs or {}
+        value = extra_specs.get('cloudlet:synthesis_cache', 'false')
+        return str(value).lower() in ('true', '1', 'yes')
+
+    def _launch_from_synthesis_cache(self, xml, cached_disk, cached_memory,
+                                     phase_timer):
+        """Start VM over cached launch images without applying VM overlay
+        """
+        launch_disk_size = os.path.getsize(cached_disk)
+        launch_memory_size = os.path.getsize(cached_memory)
+        snapshot_directory = libvirt_driver.CONF.libvirt.snapshots_directory
+        fileutils.ensure_tree(snapshot_directory)
+        with utils.tempdir(dir=snapshot_directory) as tmpdir:
+            uuidhex = uuid.uuid4().hex
+            launch_diskpath = os.path.join(tmpdir, uuidhex + "-launch-disk")
+            launch_memorypath = os.path.join(
+                tmpdir, uuidhex + "-launch-memory")
+            for path, size in ((launch_diskpath, launch_disk_size),
+                               (launch_memorypath, launch_memory_size)):
+                with open(path, "wb") as f:
+                    f.truncate(size)
+            # every chunk comes from the cached images
+            with phase_timer.phase('resume'):
+                synthesized_vm = self._handoff_launch_vm(
+                    xml, cached_disk, cached_memory,
+                    launch_diskpath, launch_memorypath,
+                    launch_disk_size, launch_memory_size, "", "")
+            with phase_timer.phase('nic_reattach'):
+                synthesis.rettach_nic(synthesized_vm.machine,
+                                      synthesized_vm.old_xml_str, xml)
         return synthesized_vm
 
+    def _decomp_overlay(self, overlay_url, overlay_package, meta_info,
+                        decomp_overlay, phase_timer):
+        """Download VM overlay blobs and decompress them into a single file
+
+        Each blob is decompressed in a native thread while the next blobs are
+        downloaded, with at most synthesis_buffer_blobs compressed blobs
+        buffered. Falls back to compression.decomp_overlayzip if streaming
+        synthesis is disabled or a blob uses an unknown compression.
+        """
+        decompressors = _overlay_blob_decompressors()
+        default_comp_type = getattr(Cloudlet_Const, 'COMPRESSION_LZMA', None)
+        comp_key = getattr(Cloudlet_Const, 'META_OVERLAY_FILE_COMPRESSION',
+                           None)
+        blobs = list()
+        for blob_info in meta_info[Cloudlet_Const.META_OVERLAY_FILES]:
+            comp_type = default_comp_type
+            if comp_key is not None:
+                comp_type = blob_info.get(comp_key, default_comp_type)
+            blobs.append((blob_info[Cloudlet_Const.META_OVERLAY_FILE_NAME],
+                          decompressors.get(comp_type, None)))
+        if not CONF.cloudlet.streaming_synthesis or \
+                any(decompress is None for _name, decompress in blobs):
+            with phase_timer.phase('overlay_download_and_decompression'):
+                return compression.decomp_overlayzip(overlay_url,
+                                                     decomp_overlay)
+
+        blob_queue = queue.LightQueue(
+            max(1, CONF.cloudlet.synthesis_buffer_blobs))
+
+        def _download():
+            start = time.time()
+            try:
+                for blob_name, decompress in blobs:
+                    blob_queue.put((decompress,
+                                    overlay_package.read_blob(blob_name)))
+            except Exception as e:
+                blob_queue.put((None, e))
+                return
+            phase_timer.add('overlay_download', time.time() - start)
+            blob_queue.put((None, None))
+
+        downloader = eventlet.spawn(_download)
+        try:
+            with open(decomp_overlay, "w+b") as out_fd:
+                while True:
+                    decompress, blob = blob_queue.get()
+                    if decompress is None:
+                        if blob is not None:
+                            raise blob
+                        break
+                    with phase_timer.phase('decompression'):
+                        decomp_blob = tpool.execute(decompress, blob)
+                    out_fd.write(decomp_blob)
+        finally:
+            downloader.kill()
+        return meta_info
+
     def _spawn_using_handoff(self, context, instance, xml,
-                             image_meta, handoff_info):
+                             image_meta, handoff_info, base_prefetch,
+                             phase_timer):
+        try:
+            if base_prefetch is None:
+                msg = "image does not have properties for cloudlet base VM"
+                raise exception.ImageNotFound(msg)
+            base_vm_paths = self._wait_basevm(base_prefetch, phase_timer,
+                                              instance=instance)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                self._save_handoff_base_phase(
+                    instance, CloudletAPI.HANDOFF_BASE_ERROR)
+        # handoff-server-proc below starts listening right away
+        self._save_handoff_base_phase(instance,
+                                      CloudletAPI.HANDOFF_BASE_READY)
         image_properties = image_meta.get("properties", None)
-        memory_snap_id = str(
-            image_properties.get(CloudletAPI.IMAGE_TYPE_BASE_MEM))
-        diskhash_snap_id = str(
-            image_properties.get(CloudletAPI.IMAGE_TYPE_BASE_DISK_HASH))
-        memhash_snap_id = str(
-            image_properties.get(CloudletAPI.IMAGE_TYPE_BASE_MEM_HASH))
-        basedisk_path = self._get_cache_image(context, instance,
-                                              image_meta['id'])
-        basemem_path = self._get_cache_image(context, instance, memory_snap_id)
-        diskhash_path = self._get_cache_image(context, instance,
-                                              diskhash_snap_id)
-        memhash_path = self._get_cache_image(context, instance,
-                                             memhash_snap_id)
-        base_vm_paths = [basedisk_path, basemem_path,
-                         diskhash_path, memhash_path]
         image_sha256 = image_properties.get(CloudletAPI.PROPERTY_KEY_BASE_UUID)
+        basedisk_path, basemem_path, diskhash_path, memhash_path = \
+            base_vm_paths
 
         snapshot_directory = libvirt_driver.CONF.libvirt.snapshots_directory
         fileutils.ensure_tree(snapshot_directory)
@@ -795,23 +2042,28 @@ class CloudletDriver(libvirt_driver.LibvirtDriver):
             handoff_recv_datafile = os.path.join(tmp_dir, "handoff-data")
             # recv handoff data and synthesize disk img and memory snapshot
             try:
-                ret_values = self._handoff_recv(base_vm_paths, image_sha256,
-                                                handoff_recv_datafile,
-                                                launch_diskpath,
-                                                launch_memorypath)
+                with phase_timer.phase('handoff_recv'):
+                    ret_values = self._handoff_recv(base_vm_paths,
+                                                    image_sha256,
+                                                    handoff_recv_datafile,
+                                                    launch_diskpath,
+                                                    launch_memorypath,
+                                                    instance=instance)
                 # start VM
                 launch_disk_size, launch_memory_size, \
                     disk_overlay_map, memory_overlay_map = ret_values
-                synthesized_vm = self._handoff_launch_vm(
-                    xml, basedisk_path, basemem_path,
-                    launch_diskpath, launch_memorypath,
-                    int(launch_disk_size), int(launch_memory_size),
-                    disk_overlay_map, memory_overlay_map,
-                )
+                with phase_timer.phase('resume'):
+                    synthesized_vm = self._handoff_launch_vm(
+                        xml, basedisk_path, basemem_path,
+                        launch_diskpath, launch_memorypath,
+                        int(launch_disk_size), int(launch_memory_size),
+                        disk_overlay_map, memory_overlay_map,
+                    )
 
                 # rettach NIC
-                synthesis.rettach_nic(synthesized_vm.machine,
-                                      synthesized_vm.old_xml_str, xml)
+                with phase_timer.phase('nic_reattach'):
+                    synthesis.rettach_nic(synthesized_vm.machine,
+                                          synthesized_vm.old_xml_str, xml)
             except handoff.HandoffError as e:
                 msg = "failed to perform VM handoff:\n"
                 msg += str(e)
@@ -825,9 +2077,20 @@ class CloudletDriver(libvirt_driver.LibvirtDriver):
                     os.remove(launch_memorypath)
         return synthesized_vm
 
+    def _save_handoff_base_phase(self, instance, phase):
+        def _update():
+            system_meta = instance.system_metadata
+            system_meta[CloudletAPI.SYSMETA_HANDOFF_BASE] = phase
+            instance.system_metadata = system_meta
+        try:
+            self.save_instance(instance, _update)
+        except Exception as e:
+            # the source streams anyway once it stops waiting
+            LOG.debug("cloudlet, cannot save handoff readiness: %s" % str(e))
+
     def _handoff_recv(self, base_vm_paths, base_hashvalue,
                       handoff_recv_datafile, launch_diskpath,
-                      launch_memorypath):
+                      launch_memorypath, instance=None):
         # data structure for handoff receiving
         handoff_ds_recv = handoff.HandoffDataRecv()
         handoff_ds_recv.save_data(
@@ -839,20 +2102,14 @@ class CloudletDriver(libvirt_driver.LibvirtDriver):
         LOG.debug("start handoff recv process")
         cmd = ["/usr/local/bin/handoff-server-proc", "-d",
                "%s" % handoff_recv_datafile]
-        LOG.debug("subprocess: %s" % cmd)
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, close_fds=True)
-
-        stdout_buf, _ = proc.communicate()
-
+        progress = HandoffProgress('receiving', functools.partial(
+            allocated_bytes, launch_diskpath, launch_memorypath))
+        self._run_handoff_proc(cmd, instance, progress)
         LOG.info("Handoff recv finishes")
-        returncode = proc.poll()
-        if returncode is not 0:
-            msg = "Failed to receive handoff data"
-            raise handoff.HandoffError(msg)
 
         # parse output: this will be fixed at cloudlet deamon
         keyword, disksize, memorysize, disk_overlay_map, memory_overlay_map =\
-            stdout_buf.split("\n")[-1].split("\t")
+            progress.last_line().split("\t")
         if keyword.lower() != "openstack":
             raise handoff.HandoffError("Failed to parse returned data")
         return disksize, memorysize, disk_overlay_map, memory_overlay_map
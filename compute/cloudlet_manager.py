@@ -19,6 +19,7 @@
 import functools
 
 from nova.compute import task_states
+from nova.compute.cloudlet_api import CloudletAPI
 try:
     # icehouse
     from nova.openstack.common.gettextutils import _
@@ -31,6 +32,7 @@ from nova.objects import block_device as block_device_obj
 from nova.objects import quotas as quotas_obj
 from nova.compute import manager as compute_manager
 from nova.virt import driver
+from nova.image import glance
 from nova import rpc
 from nova import exception
 from nova import utils
@@ -73,19 +75,35 @@ class CloudletComputeManager(compute_manager.ComputeManager):
         def callback_update_task_state(
                 task_state,
                 expected_state=task_states.IMAGE_SNAPSHOT):
-            instance.task_state = task_state
-            instance.save(expected_task_state=expected_state)
+            def _set_task_state():
+                instance.task_state = task_state
+            # the driver saves progress of the same instance meanwhile
+            self.driver.save_instance(instance, _set_task_state,
+                                      expected_state)
             return instance
 
-        self.driver.cloudlet_base(
-            context,
-            instance,
-            vm_name,
-            disk_meta_id,
-            memory_meta_id,
-            diskhash_meta_id,
-            memoryhash_meta_id,
-            callback_update_task_state)
+        try:
+            with self.driver.cloudlet_slot(
+                    self.driver.work_scheduler.BASE, instance['uuid']):
+                self.driver.cloudlet_base(
+                    context,
+                    instance,
+                    vm_name,
+                    disk_meta_id,
+                    memory_meta_id,
+                    diskhash_meta_id,
+                    memoryhash_meta_id,
+                    callback_update_task_state)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                self._set_cloudlet_base_phase(context, instance,
+                                              CloudletAPI.BASE_PHASE_ERROR)
+        # the instance is terminated below and its system metadata with it,
+        # so the final phase is also kept on the base disk image
+        self._set_cloudlet_base_phase(context, instance,
+                                      CloudletAPI.BASE_PHASE_COMPLETE,
+                                      disk_meta_id)
+        self._notify_cloudlet_phases(context, instance, "cloudlet.base")
         instance = self._instance_update(
             context,
             instance['uuid'],
@@ -111,12 +129,19 @@ class CloudletComputeManager(compute_manager.ComputeManager):
         def callback_update_task_state(
                 task_state,
                 expected_state=task_states.IMAGE_SNAPSHOT):
-            instance.task_state = task_state
-            instance.save(expected_task_state=expected_state)
+            def _set_task_state():
+                instance.task_state = task_state
+            # the driver saves progress of the same instance meanwhile
+            self.driver.save_instance(instance, _set_task_state,
+                                      expected_state)
             return instance
 
-        self.driver.create_overlay_vm(context, instance, overlay_name,
-                                      overlay_id, callback_update_task_state)
+        with self.driver.cloudlet_slot(self.driver.work_scheduler.OVERLAY,
+                                       instance['uuid']):
+            self.driver.create_overlay_vm(context, instance, overlay_name,
+                                          overlay_id,
+                                          callback_update_task_state)
+        self._notify_cloudlet_phases(context, instance, "cloudlet.overlay")
         self.cloudlet_terminate_instance(context, instance,reservations)
 
     @compute_manager.object_compat
@@ -124,7 +149,8 @@ class CloudletComputeManager(compute_manager.ComputeManager):
     @compute_manager.reverts_task_state
     @compute_manager.wrap_instance_fault
     def cloudlet_handoff(self, context, instance,reservations, handoff_url,
-                         residue_glance_id=None):
+                         residue_glance_id=None, dest_status_url=None,
+                         dest_token=None):
         """
         Perform VM handoff
         """
@@ -134,15 +160,63 @@ class CloudletComputeManager(compute_manager.ComputeManager):
         def callback_update_task_state(
                 task_state,
                 expected_state=task_states.IMAGE_SNAPSHOT):
-            instance.task_state = task_state
-            instance.save(expected_task_state=expected_state)
+            def _set_task_state():
+                instance.task_state = task_state
+            # the driver saves progress of the same instance meanwhile
+            self.driver.save_instance(instance, _set_task_state,
+                                      expected_state)
             return instance
 
-        self.driver.perform_vmhandoff(context, instance, handoff_url,
-                                      callback_update_task_state,
-                                      residue_glance_id)
+        if dest_status_url is not None:
+            # dest_token is the user's token of the destination cloud, which
+            # this node has no credentials for. It only authenticates the
+            # status checks of the destination VM, and is not stored.
+            self.driver.wait_handoff_dest(instance, dest_status_url,
+                                          dest_token)
+        with self.driver.cloudlet_slot(self.driver.work_scheduler.HANDOFF,
+                                       instance['uuid']):
+            self.driver.perform_vmhandoff(context, instance, handoff_url,
+                                          callback_update_task_state,
+                                          residue_glance_id)
+        self._notify_cloudlet_phases(context, instance, "cloudlet.handoff")
         self.cloudlet_terminate_instance(context, instance,reservations)
 
+    def _set_cloudlet_base_phase(self, context, instance, phase,
+                                 disk_meta_id=None):
+        """Save the final phase of base VM creation reported by
+        os-cloudlet status API, also to the base disk image if given
+        """
+        def _set_phase():
+            system_meta = instance.system_metadata
+            system_meta[CloudletAPI.SYSMETA_BASE_PHASE] = phase
+            instance.system_metadata = system_meta
+        try:
+            self.driver.save_instance(instance, _set_phase)
+        except Exception as e:
+            LOG.warning(_("Cannot save base VM creation phase: %s" % str(e)),
+                        instance=instance)
+        if disk_meta_id is None:
+            return
+        bytes_total = instance.system_metadata.get(
+            CloudletAPI.SYSMETA_BASE_BYTES_TOTAL, "0")
+        properties = {CloudletAPI.PROPERTY_KEY_BASE_PHASE: phase,
+                      CloudletAPI.PROPERTY_KEY_BASE_BYTES: bytes_total}
+        try:
+            glance.get_default_image_service().update(
+                context, disk_meta_id, {'properties': properties},
+                purge_props=False)
+        except Exception as e:
+            LOG.warning(_("Cannot save base VM creation phase to image "
+                          "%s: %s" % (disk_meta_id, str(e))),
+                        instance=instance)
+
+    def _notify_cloudlet_phases(self, context, instance, event_suffix):
+        """Send time spent in each phase of the cloudlet operation"""
+        timings = self.driver.pop_phase_timings(instance['uuid'])
+        self._notify_about_instance_usage(
+            context, instance, event_suffix,
+            extra_usage_info={'cloudlet_phases': timings})
+
     # Direct call to terminate_instance at the manager.py will cause
     # "InstanceActionNotFound_Remote" exception at wrap_instance_event decorator
     # since the VM is already terminated.
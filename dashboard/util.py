@@ -72,7 +72,13 @@ def get_cloudlet_type(instance):
 def find_basevm_by_sha256(request, sha256_value):
     from openstack_dashboard.api import glance
 
-    public = {"is_public": True, "status": "active"}
+    # let glance filter base disks of the base VM instead of listing all
+    public = {"is_public": True, "status": "active",
+              "properties": {
+                  CLOUDLET_TYPE.PROPERTY_KEY_CLOUDLET_TYPE:
+                  CLOUDLET_TYPE.IMAGE_TYPE_BASE_DISK,
+                  CLOUDLET_TYPE.PROPERTY_KEY_BASE_UUID: sha256_value,
+                  }}
     image_detail = glance.image_list_detailed(request, filters=public)
     if len(image_detail) == 2:  # icehouse
         public_images, _more_images = image_detail
@@ -17,6 +17,7 @@ compute_node_list = ['krha@cloudlet.krha.kr']
 # constant
 CLOUDLET_PROVISIONING_REPO = "https://github.com/cmusatyalab/elijah-provisioning.git"
 NOVA_PACKAGE_PATH = "/usr/lib/python2.7/dist-packages/nova"
+CLOUDLET_COMMON_PATH = "/usr/lib/python2.7/dist-packages/cloudlet_common"
 NOVA_CONF_PATH = "/etc/nova/nova.conf"
 NOVA_COMPUTE_CONF_PATH = "/etc/nova/nova-compute.conf"
 DASHBOARD_PROJECT_PATH = "/usr/share/openstack-dashboard/openstack_dashboard/dashboards/project"
@@ -63,6 +64,20 @@ def _replace_configuration(filepath, option_key, option_value, insert_at=1):
     sudo("chown %s:%s %s" % (original_uid, original_gid, filepath))
 
 
+def _deploy_cloudlet_common():
+    global CLOUDLET_COMMON_PATH
+
+    src_dir = os.path.abspath("./cloudlet_common")
+    sudo("mkdir -p %s" % CLOUDLET_COMMON_PATH)
+    for filename in sorted(os.listdir(src_dir)):
+        if not filename.endswith(".py"):
+            continue
+        src_file = os.path.join(src_dir, filename)
+        dest_filepath = os.path.join(CLOUDLET_COMMON_PATH, filename)
+        if put(src_file, dest_filepath, use_sudo=True, mode=0644).failed:
+            abort("Cannot copy %s to %s" % (src_file, CLOUDLET_COMMON_PATH))
+
+
 def deploy_cloudlet_api():
     global NOVA_PACKAGE_PATH
 
@@ -82,6 +97,7 @@ def deploy_cloudlet_api():
         dest_filepath = os.path.join(target_dir, os.path.basename(src_file))
         if put(src_file, dest_filepath, use_sudo=True, mode=0644).failed:
             abort("Cannot copy %s to %s" % (src_file, lib_dir))
+    _deploy_cloudlet_common()
 
     sudo("service nova-api restart", shell=False)
 
@@ -127,6 +143,7 @@ def deploy_compute_manager():
         dest_filepath = os.path.join(target_dir, os.path.basename(src_file))
         if put(src_file, dest_filepath, use_sudo=True, mode=0644).failed:
             abort("Cannot copy %s to %s" % (src_file, lib_dir))
+    _deploy_cloudlet_common()
 
     sudo("service nova-compute restart", shell=False)
 
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# cloudlet_common is imported from the checkout, not from dist-packages
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
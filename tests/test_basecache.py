@@ -0,0 +1,124 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+import eventlet
+
+from cloudlet_common.basecache import CloudletBaseCache
+
+INSTANCE = {'uuid': 'instance-1', 'user_id': 'user', 'project_id': 'project'}
+IMAGE_IDS = dict((artifact, 'image-%s' % artifact)
+                 for artifact in CloudletBaseCache.ARTIFACTS)
+
+
+class CloudletBaseCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.root, 'cache')
+        self.legacy_dir = os.path.join(self.root, '_base')
+        os.makedirs(self.legacy_dir)
+        self.fetched = list()
+        self.fail_image_id = None
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _fetch(self, context, path, image_id, user_id, project_id):
+        self.fetched.append(image_id)
+        with open(path, 'wb') as f:
+            f.write('x' * 4096)
+        eventlet.sleep(0)
+        if image_id == self.fail_image_id:
+            raise IOError("glance went away")
+
+    def _cache(self, **kwargs):
+        return CloudletBaseCache(self.cache_dir, self._fetch,
+                                 legacy_dir=self.legacy_dir, **kwargs)
+
+    def test_miss_then_hit(self):
+        cache = self._cache()
+        paths = cache.get(None, INSTANCE, 'base-a', IMAGE_IDS)
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+        self.assertEqual(4, len(self.fetched))
+        self.assertEqual(paths, cache.get(None, INSTANCE, 'base-a',
+                                          IMAGE_IDS))
+        self.assertEqual(4, len(self.fetched))
+        self.assertEqual(1, cache.stats['hits'])
+
+    def test_shares_inflight_fetch(self):
+        cache = self._cache()
+        first = cache.prefetch(None, INSTANCE, 'base-a', IMAGE_IDS)
+        second = cache.prefetch(None, INSTANCE, 'base-a', IMAGE_IDS)
+        self.assertEqual(first.wait(), second.wait())
+        self.assertEqual(4, len(self.fetched))
+        self.assertEqual(1, cache.stats['shared_fetches'])
+
+    def test_failed_fetch_leaves_nothing_behind(self):
+        cache = self._cache()
+        self.fail_image_id = IMAGE_IDS[CloudletBaseCache.ARTIFACT_MEMORY]
+        self.assertRaises(IOError, cache.get, None, INSTANCE, 'base-a',
+                          IMAGE_IDS)
+        self.assertEqual([], os.listdir(self.cache_dir))
+        self.assertEqual(0, cache.total_size())
+
+    def test_scan_drops_partial_entries(self):
+        partial_dir = os.path.join(self.cache_dir, 'base-a')
+        os.makedirs(partial_dir)
+        with open(os.path.join(partial_dir, 'disk.part'), 'wb') as f:
+            f.write('x')
+        cache = self._cache()
+        self.assertEqual({}, cache.entries)
+        self.assertFalse(os.path.exists(partial_dir))
+
+    def test_adopts_legacy_cache(self):
+        legacy_paths = dict()
+        for artifact, image_id in IMAGE_IDS.items():
+            legacy_paths[artifact] = os.path.join(
+                self.legacy_dir, hashlib.sha1(image_id).hexdigest())
+            with open(legacy_paths[artifact], 'wb') as f:
+                f.write(artifact)
+        cache = self._cache()
+        paths = cache.get(None, INSTANCE, 'base-a', IMAGE_IDS)
+        self.assertEqual([], self.fetched)
+        self.assertEqual(4, cache.stats['legacy_adopted'])
+        with open(paths[1]) as f:
+            self.assertEqual(CloudletBaseCache.ARTIFACT_MEMORY, f.read())
+        # VMs resumed before the upgrade may still run on the legacy disk
+        self.assertEqual(
+            [legacy_paths[CloudletBaseCache.ARTIFACT_DISK]],
+            [path for path in legacy_paths.values() if os.path.exists(path)])
+
+    def test_evicts_least_recently_used(self):
+        cache = self._cache()
+        cache.get(None, INSTANCE, 'base-a', IMAGE_IDS)
+        cache.max_bytes = cache.total_size() + 1
+        cache.get(None, INSTANCE, 'base-b', IMAGE_IDS)
+        self.assertEqual(['base-b'], cache.entries.keys())
+        self.assertEqual(1, cache.stats['evictions'])
+
+    def test_keeps_base_vms_in_use(self):
+        cache = self._cache()
+        cache.get(None, INSTANCE, 'base-a', IMAGE_IDS, acquire=True)
+        cache.max_bytes = cache.total_size() + 1
+        cache.get(None, INSTANCE, 'base-b', IMAGE_IDS)
+        self.assertEqual(['base-a'], cache.entries.keys())
+        cache.release(INSTANCE['uuid'])
+        self.assertEqual({}, cache.users)
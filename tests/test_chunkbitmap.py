@@ -0,0 +1,43 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import unittest
+
+from cloudlet_common.chunkbitmap import ChunkBitmap
+
+
+class ChunkBitmapTestCase(unittest.TestCase):
+
+    def test_add_and_contains(self):
+        bitmap = ChunkBitmap([5, 3, 5, 100])
+        bitmap.add(4)
+        self.assertEqual(4, len(bitmap))
+        self.assertIn(3, bitmap)
+        self.assertIn(100, bitmap)
+        self.assertNotIn(6, bitmap)
+        self.assertNotIn(100000, bitmap)
+        self.assertEqual([3, 4, 5, 100], list(bitmap))
+
+    def test_runs(self):
+        bitmap = ChunkBitmap(runs=[0, 3, 7, 1, 9, 2])
+        self.assertEqual([0, 1, 2, 7, 9, 10], list(bitmap))
+        self.assertEqual(6, len(bitmap))
+
+    def test_empty(self):
+        bitmap = ChunkBitmap()
+        self.assertEqual(0, len(bitmap))
+        self.assertEqual([], list(bitmap))
+        self.assertNotIn(0, bitmap)
@@ -0,0 +1,106 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import socket
+import unittest
+
+import eventlet
+
+from cloudlet_common.forwarder import HandoffPortForwarder
+
+
+class HandoffPortForwarderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dest = eventlet.listen(('127.0.0.1', 0))
+        self.addCleanup(self.dest.close)
+        self.dest_port = self.dest.getsockname()[1]
+
+    def _echo_once(self):
+        conn, _ = self.dest.accept()
+        received = list()
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                break
+            received.append(data)
+        conn.sendall('done')
+        conn.close()
+        return ''.join(received)
+
+    def _relay(self, forwarder):
+        server = eventlet.spawn(self._echo_once)
+        port = forwarder.forward('127.0.0.1', self.dest_port)
+        stream = forwarder.streams[port]
+        client = eventlet.connect(('127.0.0.1', port))
+        payload = 'x' * (300 * 1024)
+        client.sendall(payload)
+        client.shutdown(socket.SHUT_WR)
+        reply = ''
+        while True:
+            data = client.recv(65536)
+            if not data:
+                break
+            reply += data
+        client.close()
+        self.assertEqual(payload, server.wait())
+        self.assertEqual('done', reply)
+        stream['thread'].wait()
+        self.assertEqual(len(payload), stream['bytes_to_dest'])
+        self.assertEqual(4, stream['bytes_from_dest'])
+        self.assertNotIn(port, forwarder.streams)
+
+    def test_relay_splice(self):
+        forwarder = HandoffPortForwarder(bind_address='127.0.0.1')
+        if forwarder.splice is None:
+            self.skipTest("splice(2) is not available")
+        self._relay(forwarder)
+
+    def test_relay_buffer(self):
+        forwarder = HandoffPortForwarder(bind_address='127.0.0.1')
+        forwarder.splice = None
+        self._relay(forwarder)
+
+    def test_close_before_connect(self):
+        forwarder = HandoffPortForwarder(bind_address='127.0.0.1')
+        port = forwarder.forward('127.0.0.1', self.dest_port)
+        forwarder.close(port)
+        eventlet.sleep(0)
+        self.assertNotIn(port, forwarder.streams)
+        self.assertRaises(socket.error, eventlet.connect,
+                          ('127.0.0.1', port))
+        # closing a finished stream does nothing
+        forwarder.close(port)
+
+    def test_close_while_waiting(self):
+        free_port = self._free_port()
+        forwarder = HandoffPortForwarder(port_range=(free_port, free_port),
+                                         bind_address='127.0.0.1')
+        port = forwarder.forward('127.0.0.1', self.dest_port)
+        self.assertEqual(free_port, port)
+        # let it wait for a client
+        eventlet.sleep(0)
+        forwarder.close(port)
+        self.assertNotIn(port, forwarder.streams)
+        self.assertEqual([port], forwarder.free_ports)
+        self.assertRaises(socket.error, eventlet.connect,
+                          ('127.0.0.1', port))
+
+    def _free_port(self):
+        sock = eventlet.listen(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
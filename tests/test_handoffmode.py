@@ -0,0 +1,68 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import unittest
+
+try:
+    from elijah.provisioning.configuration import Const as Cloudlet_Const
+    from elijah.provisioning.configuration import VMOverlayCreationMode
+
+    from cloudlet_common.handoffmode import HandoffModeSelector
+except ImportError:
+    HandoffModeSelector = None
+
+MB = 1024 * 1024
+
+
+@unittest.skipIf(HandoffModeSelector is None,
+                 "elijah-provisioning is not installed")
+class HandoffModeSelectorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.selector = HandoffModeSelector(100 * MB)
+
+    def test_slow_link_compresses_harder(self):
+        fast = self.selector.choose('fast', 8)
+        self.selector.bandwidth['slow'] = 1 * MB
+        slow = self.selector.choose('slow', 8)
+        self.assertTrue(slow[4] <= fast[4])
+
+    def test_observe_link_bound(self):
+        profile = self.selector.PROFILES[0]
+        self.selector.observe('dest', profile, 8, 10 * MB)
+        self.assertEqual(55 * MB, self.selector.bandwidth['dest'])
+
+    def test_to_mode(self):
+        profile = self.selector.choose('dest', 3)
+        mode = self.selector.to_mode(profile, 3)
+        self.assertTrue(isinstance(mode, VMOverlayCreationMode))
+        self.assertEqual(getattr(Cloudlet_Const, profile[0]),
+                         mode.COMPRESSION_ALGORITHM_TYPE)
+        self.assertEqual(profile[1], mode.COMPRESSION_ALGORITHM_SPEED)
+        self.assertEqual(profile[2], mode.DISK_DIFF_ALGORITHM)
+        self.assertEqual(profile[2], mode.MEMORY_DIFF_ALGORITHM)
+        # everything else, including the cores, comes from elijah
+        expected = VMOverlayCreationMode.\
+            get_pipelined_multi_process_finite_queue(num_cores=3)
+        overridden = ('COMPRESSION_ALGORITHM_TYPE',
+                      'COMPRESSION_ALGORITHM_SPEED',
+                      'DISK_DIFF_ALGORITHM', 'MEMORY_DIFF_ALGORITHM')
+        for name, value in vars(expected).items():
+            if name not in overridden:
+                self.assertEqual(value, getattr(mode, name))
+
+    def test_no_profile(self):
+        self.assertIsNone(self.selector.to_mode(None, 4))
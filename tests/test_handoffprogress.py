@@ -0,0 +1,73 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+from cloudlet_common.handoffprogress import HandoffProgress
+from cloudlet_common.handoffprogress import allocated_bytes
+
+
+class HandoffProgressTestCase(unittest.TestCase):
+
+    def test_samples_growing_bytes(self):
+        counts = [100, 100, 50, 300]
+        progress = HandoffProgress('sending', lambda: counts.pop(0),
+                                   bytes_total=400)
+        self.assertTrue(progress.sample())
+        self.assertFalse(progress.sample())
+        self.assertFalse(progress.sample())
+        self.assertTrue(progress.sample())
+        self.assertEqual(300, progress.bytes_sent)
+        self.assertEqual(75, progress.percent())
+
+    def test_unknown_total(self):
+        progress = HandoffProgress('receiving')
+        self.assertFalse(progress.sample())
+        self.assertEqual(None, progress.percent())
+
+    def test_sample_ignores_missing_files(self):
+        def _fail():
+            raise OSError("gone")
+        progress = HandoffProgress('receiving', _fail)
+        self.assertFalse(progress.sample())
+
+    def test_keeps_output_tail(self):
+        progress = HandoffProgress('sending')
+        self.assertEqual('', progress.last_line())
+        for index in range(HandoffProgress.TAIL_LINES + 10):
+            progress.feed("line %d\n" % index)
+        self.assertEqual(HandoffProgress.TAIL_LINES,
+                         len(progress.output_tail))
+        self.assertEqual("line %d" % (HandoffProgress.TAIL_LINES + 9),
+                         progress.last_line())
+
+
+class AllocatedBytesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_counts_only_allocated_blocks(self):
+        sparse_path = os.path.join(self.root, 'sparse')
+        with open(sparse_path, 'wb') as f:
+            f.truncate(1024 * 1024 * 1024)
+        self.assertTrue(allocated_bytes(sparse_path) < 1024 * 1024)
+        self.assertEqual(0, allocated_bytes(os.path.join(self.root, 'no')))
@@ -0,0 +1,76 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+from cloudlet_common.hashdict import BaseHashDictCache
+from cloudlet_common.hashindex import BaseHashIndex
+
+
+class BaseHashDictCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.diskhash_path = os.path.join(self.root, 'disk_hash')
+        self.memhash_path = os.path.join(self.root, 'mem_hash')
+        self.parsed = list()
+        self.fail = False
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _parse(self, diskhash_path, memhash_path):
+        self.parsed.append((diskhash_path, memhash_path))
+        if self.fail:
+            raise IOError("cannot read hash list")
+        return ({'disk-sha': 1}, {'mem-sha': 2})
+
+    def test_loads_once_per_base_vm(self):
+        cache = BaseHashDictCache(2, self._parse)
+        cache.preload('base-a', self.diskhash_path, self.memhash_path)
+        hashdicts = cache.get('base-a', self.diskhash_path, self.memhash_path)
+        self.assertEqual(({'disk-sha': 1}, {'mem-sha': 2}), hashdicts)
+        self.assertEqual(1, len(self.parsed))
+
+    def test_drops_least_recently_used(self):
+        cache = BaseHashDictCache(1, self._parse)
+        cache.get('base-a', self.diskhash_path, self.memhash_path)
+        cache.get('base-b', self.diskhash_path, self.memhash_path)
+        self.assertEqual(['base-b'], list(cache.entries))
+
+    def test_failed_load_is_retried(self):
+        cache = BaseHashDictCache(2, self._parse)
+        self.fail = True
+        self.assertRaises(IOError, cache.get, 'base-a',
+                          self.diskhash_path, self.memhash_path)
+        self.assertEqual({}, dict(cache.entries))
+        self.fail = False
+        cache.get('base-a', self.diskhash_path, self.memhash_path)
+        self.assertEqual(2, len(self.parsed))
+
+    def test_index_is_reused_by_a_new_cache(self):
+        cache = BaseHashDictCache(2, self._parse, use_index=True)
+        diskindex, memindex = cache.get('base-a', self.diskhash_path,
+                                        self.memhash_path)
+        self.assertTrue(isinstance(diskindex, BaseHashIndex))
+        self.assertEqual(1, diskindex.get('disk-sha'))
+        cache = BaseHashDictCache(2, self._parse, use_index=True)
+        diskindex, memindex = cache.get('base-a', self.diskhash_path,
+                                        self.memhash_path)
+        self.assertEqual(2, memindex.get('mem-sha'))
+        self.assertEqual(1, len(self.parsed))
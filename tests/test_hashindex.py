@@ -0,0 +1,98 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import os
+import pickle
+import shutil
+import struct
+import tempfile
+import unittest
+
+import mock
+
+from cloudlet_common.hashindex import BaseHashIndex
+
+
+class BaseHashIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(BaseHashIndexTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'disk-hash.index')
+        self.hashdict = dict(('%064x' % (number * 7919), [number, 4096])
+                             for number in range(500))
+        BaseHashIndex.build(self.path, self.hashdict)
+        self.index = BaseHashIndex(self.path)
+
+    def test_lookup(self):
+        self.assertFalse(os.path.exists(self.path + '.part'))
+        self.assertEqual(len(self.hashdict), len(self.index))
+        for key, value in self.hashdict.items():
+            self.assertIn(key, self.index)
+            self.assertTrue(self.index.has_key(key))
+            self.assertEqual(value, self.index[key])
+            self.assertEqual(value, self.index.get(key))
+
+    def test_missing_key(self):
+        missing = '%064x' % 1
+        self.assertNotIn(missing, self.index)
+        self.assertIsNone(self.index.get(missing))
+        self.assertEqual('default', self.index.get(missing, 'default'))
+        self.assertRaises(KeyError, self.index.__getitem__, missing)
+        self.assertNotIn('', self.index)
+        self.assertNotIn('f' * 65, self.index)
+
+    def test_iteration(self):
+        self.assertEqual(sorted(self.hashdict), sorted(self.index.keys()))
+        self.assertEqual(self.hashdict, dict(self.index.iteritems()))
+        self.assertEqual(sorted(self.hashdict.values()),
+                         sorted(self.index.values()))
+
+    def test_empty(self):
+        path = os.path.join(self.tmpdir, 'empty.index')
+        BaseHashIndex.build(path, dict())
+        index = BaseHashIndex(path)
+        self.assertEqual(0, len(index))
+        self.assertNotIn('%064x' % 0, index)
+
+    def test_pickled_as_path(self):
+        copied = pickle.loads(pickle.dumps(self.index))
+        self.assertEqual(self.path, copied.path)
+        key = sorted(self.hashdict)[0]
+        self.assertEqual(self.hashdict[key], copied[key])
+
+    def test_invalid_file(self):
+        path = os.path.join(self.tmpdir, 'invalid.index')
+        with open(path, 'wb') as f:
+            f.write('X' * BaseHashIndex.HEADER.size)
+        self.assertRaises(ValueError, BaseHashIndex, path)
+
+    def test_previous_format_is_invalid(self):
+        path = os.path.join(self.tmpdir, 'old.index')
+        with open(path, 'wb') as f:
+            f.write(struct.pack("!8sQ", "CLHIDX01", 0))
+        self.assertRaises(ValueError, BaseHashIndex, path)
+
+    def test_colliding_slots(self):
+        # every key lands in slot 0, lookups have to probe
+        path = os.path.join(self.tmpdir, 'collide.index')
+        hashdict = dict(('key%d' % number, number) for number in range(20))
+        with mock.patch.object(BaseHashIndex, '_hash', return_value=0):
+            BaseHashIndex.build(path, hashdict)
+            index = BaseHashIndex(path)
+            for key, value in hashdict.items():
+                self.assertEqual(value, index[key])
+            self.assertNotIn('key20', index)
@@ -0,0 +1,76 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+from cloudlet_common.metrics import CloudletMetrics
+from cloudlet_common.metrics import PhaseTimer
+
+
+class PhaseTimerTestCase(unittest.TestCase):
+
+    def test_adds_up_phases(self):
+        timer = PhaseTimer('spawn')
+        timer.add('resume', 1.0)
+        timer.add('resume', 0.5)
+        try:
+            with timer.phase('network'):
+                raise ValueError()
+        except ValueError:
+            pass
+        timings = timer.to_dict()
+        self.assertEqual(1.5, timings['resume'])
+        self.assertTrue('network' in timings)
+        self.assertTrue('total' in timings)
+        self.assertEqual(['resume', 'network'], list(timer.phases))
+
+
+class CloudletMetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'cloudlet.prom')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_writes_histograms_and_counters(self):
+        metrics = CloudletMetrics(self.path)
+        metrics.observe('spawn', {'resume': 0.3})
+        metrics.observe('spawn', {'resume': 20})
+        metrics.write([('counter', 'cloudlet_cache_events_total',
+                        {'cache': 'base', 'event': 'hits'}, 3)])
+        with open(self.path) as f:
+            lines = f.read().splitlines()
+        labels = 'operation="spawn",phase="resume"'
+        self.assertTrue('cloudlet_phase_seconds_bucket{%s,le="0.5"} 1' %
+                        labels in lines)
+        self.assertTrue('cloudlet_phase_seconds_bucket{%s,le="+Inf"} 2' %
+                        labels in lines)
+        self.assertTrue('cloudlet_phase_seconds_count{%s} 2' % labels
+                        in lines)
+        self.assertTrue('# TYPE cloudlet_cache_events_total counter' in lines)
+        self.assertTrue('cloudlet_cache_events_total{cache="base",'
+                        'event="hits"} 3' in lines)
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+
+    def test_no_path_writes_nothing(self):
+        metrics = CloudletMetrics('')
+        metrics.observe('spawn', {'resume': 0.3})
+        metrics.write([])
+        self.assertEqual([], os.listdir(self.root))
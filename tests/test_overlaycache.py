@@ -0,0 +1,94 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+from cloudlet_common.overlaycache import OverlayCache
+
+
+class OverlayCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.root, 'cache')
+        self.overlay_path = os.path.join(self.root, 'overlay.zip')
+        self._write_overlay('v1')
+        self.downloads = 0
+        self.fail = False
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write_overlay(self, content):
+        with open(self.overlay_path, 'wb') as f:
+            f.write(content)
+
+    def _download(self, decomp_path):
+        self.downloads += 1
+        with open(decomp_path, 'wb') as f:
+            f.write('decompressed')
+        if self.fail:
+            raise IOError("connection reset")
+        with open(self.overlay_path) as f:
+            return {'version': f.read()}
+
+    def test_hit_after_miss(self):
+        cache = OverlayCache(self.cache_dir)
+        meta_info, path, overlay_id = cache.get(self.overlay_path, 'vm-1',
+                                                self._download)
+        self.assertEqual({'version': 'v1'}, meta_info)
+        self.assertTrue(os.path.exists(path))
+        cache.release('vm-1')
+        # entries survive a restart
+        cache = OverlayCache(self.cache_dir)
+        self.assertEqual((meta_info, path, overlay_id),
+                         cache.get(self.overlay_path, 'vm-2',
+                                   self._download))
+        self.assertEqual(1, self.downloads)
+        self.assertEqual(1, cache.stats['hits'])
+
+    def test_changed_overlay_in_use_gets_private_copy(self):
+        cache = OverlayCache(self.cache_dir)
+        shared = cache.get(self.overlay_path, 'vm-1', self._download)
+        self._write_overlay('v2-longer')
+        meta_info, path, overlay_id = cache.get(self.overlay_path, 'vm-2',
+                                                self._download)
+        self.assertEqual({'version': 'v2-longer'}, meta_info)
+        self.assertNotEqual(shared[1], path)
+        self.assertNotEqual(shared[2], overlay_id)
+        cache.release('vm-2')
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(shared[1]))
+
+    def test_failed_download_leaves_nothing_behind(self):
+        cache = OverlayCache(self.cache_dir)
+        self.fail = True
+        self.assertRaises(IOError, cache.get, self.overlay_path, 'vm-1',
+                          self._download)
+        self.assertEqual([], os.listdir(self.cache_dir))
+        self.assertEqual(0, cache.total_size())
+
+    def test_evicts_overlays_not_in_use(self):
+        cache = OverlayCache(self.cache_dir, max_bytes=1)
+        cache.get(self.overlay_path, 'vm-1', self._download)
+        cache.release('vm-1')
+        other_path = os.path.join(self.root, 'other.zip')
+        shutil.copy(self.overlay_path, other_path)
+        cache.get(other_path, 'vm-2', self._download)
+        self.assertEqual(1, len(cache.entries))
+        self.assertEqual(1, cache.stats['evictions'])
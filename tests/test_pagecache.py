@@ -0,0 +1,82 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from cloudlet_common.basecache import CloudletBaseCache
+from cloudlet_common.pagecache import BaseVMPageCacheWarmer
+
+IMAGE_IDS = dict((artifact, 'image-%s' % artifact)
+                 for artifact in CloudletBaseCache.ARTIFACTS)
+
+
+class _Context(object):
+    user_id = 'user'
+    project_id = 'project'
+
+
+class BaseVMPageCacheWarmerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.base_cache = CloudletBaseCache(self.root, self._fetch)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _fetch(self, context, path, image_id, user_id, project_id):
+        with open(path, 'wb') as f:
+            f.write('x' * 1024)
+
+    def _refresh(self, warmer, mem_available):
+        with mock.patch('cloudlet_common.pagecache._mem_available',
+                        return_value=mem_available):
+            warmer.refresh(_Context(), lambda base_uuid: IMAGE_IDS)
+
+    def test_warms_and_pins_in_priority_order(self):
+        warmer = BaseVMPageCacheWarmer(self.base_cache, ['base-a', 'base-b'],
+                                       reserved_bytes=0)
+        self._refresh(warmer, None)
+        self.assertEqual(set(['base-a', 'base-b']), warmer.warm)
+        self.assertEqual(set(['base-a', 'base-b']), self.base_cache.pinned)
+        self.assertTrue(warmer.record_resume('base-a'))
+        self.assertFalse(warmer.record_resume('base-c'))
+        self.assertEqual(0.5, warmer.hit_rate())
+
+    def test_stops_at_the_reserve(self):
+        warmer = BaseVMPageCacheWarmer(self.base_cache, ['base-a', 'base-b'],
+                                       reserved_bytes=1000)
+        self._refresh(warmer, 2500)
+        self.assertEqual(set(['base-a']), warmer.warm)
+
+    def test_drops_lowest_priority_under_pressure(self):
+        warmer = BaseVMPageCacheWarmer(self.base_cache, ['base-a', 'base-b'],
+                                       reserved_bytes=1000,
+                                       pinned=['base-b'])
+        self.base_cache.pin('base-b')
+        self._refresh(warmer, None)
+        self._refresh(warmer, 10)
+        self.assertEqual(set(['base-a']), warmer.warm)
+        # pinned by configuration, so it stays pinned
+        self.assertTrue('base-b' in self.base_cache.pinned)
+        self._refresh(warmer, 10)
+        self.assertEqual(set(), warmer.warm)
+        self.assertEqual(set(['base-b']), self.base_cache.pinned)
+        self.assertEqual(2, warmer.stats['releases'])
@@ -0,0 +1,103 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cloudlet_common.registry import CloudletVMRegistry
+
+
+class _Fuse(object):
+
+    def __init__(self, mountpoint):
+        self.mountpoint = mountpoint
+        self.pid = 1234
+
+
+class _SynthesizedVM(object):
+
+    def __init__(self, mountpoint):
+        self.fuse = _Fuse(mountpoint)
+        self.qemu_logfile = '/tmp/qemu.log'
+        self.qmp_channel = '/tmp/qmp'
+        self.launch_disk = '/tmp/launch_disk'
+        self.launch_mem = '/tmp/launch_mem'
+
+
+class CloudletVMRegistryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.journal = os.path.join(self.tmpdir, 'journal')
+        self.mountpoint = os.path.join(self.tmpdir, 'fuse')
+        os.makedirs(os.path.join(self.mountpoint, 'disk'))
+        with open(os.path.join(self.mountpoint, 'disk', 'image'), 'w') as f:
+            f.write('x' * 4096)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_synthesized_record(self):
+        registry = CloudletVMRegistry(self.journal)
+        vm = _SynthesizedVM(self.mountpoint)
+        registry.add(registry.SYNTHESIZED, 'uuid-1', 'instance-1', vm)
+        self.assertIs(vm, registry.get(registry.SYNTHESIZED, 'uuid-1'))
+
+        record = CloudletVMRegistry(self.journal).load()['uuid-1']
+        self.assertEqual('instance-1', record['domain'])
+        self.assertEqual(self.mountpoint, record['fuse_mountpoint'])
+        self.assertEqual(1234, record['fuse_pid'])
+        self.assertEqual(4096, record['disk_size'])
+        self.assertEqual(['/tmp/launch_disk', '/tmp/launch_mem'],
+                         record['launch_files'])
+
+    def test_pop_removes_record(self):
+        registry = CloudletVMRegistry(self.journal)
+        registry.add(registry.RESUMED, 'uuid-1', 'instance-1', object())
+        registry.add(registry.RESUMED, 'uuid-2', 'instance-2', object())
+        registry.pop(registry.RESUMED, 'uuid-1')
+        self.assertEqual(['uuid-2'],
+                         CloudletVMRegistry(self.journal).load().keys())
+
+    def test_skipped_records_survive_load(self):
+        registry = CloudletVMRegistry(self.journal)
+        registry.add(registry.RESUMED, 'uuid-1', 'instance-1', object())
+        registry.add(registry.RESUMED, 'uuid-2', 'instance-2', object())
+
+        restarted = CloudletVMRegistry(self.journal)
+        self.assertEqual(['uuid-1', 'uuid-2'], sorted(restarted.load()))
+        # uuid-1 is cleaned up, uuid-2 is left for the next restart
+        restarted.pop(restarted.RESUMED, 'uuid-1')
+        self.assertEqual(['uuid-2'],
+                         CloudletVMRegistry(self.journal).load().keys())
+        self.assertIsNone(restarted.get(restarted.RESUMED, 'uuid-2'))
+
+    def test_torn_line_is_ignored(self):
+        registry = CloudletVMRegistry(self.journal)
+        registry.add(registry.RESUMED, 'uuid-1', 'instance-1', object())
+        with open(self.journal, 'a') as journal:
+            journal.write('{"op": "add", "uu')
+        self.assertEqual(['uuid-1'],
+                         CloudletVMRegistry(self.journal).load().keys())
+
+    def test_compaction(self):
+        registry = CloudletVMRegistry(self.journal)
+        for index in range(registry.COMPACT_MIN_LINES + 1):
+            registry.add(registry.RESUMED, 'uuid-1', 'instance-1', object())
+        with open(self.journal) as journal:
+            self.assertEqual(1, len(journal.readlines()))
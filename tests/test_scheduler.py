@@ -0,0 +1,130 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import unittest
+
+import eventlet
+
+from cloudlet_common.scheduler import CloudletWorkScheduler
+
+
+class CloudletWorkSchedulerTestCase(unittest.TestCase):
+
+    def _scheduler(self, max_total=0, limits=None, max_queued=None):
+        return CloudletWorkScheduler(
+            max_total, limits or dict(), max_queued or dict())
+
+    def _spawn_waiting(self, scheduler, operation, admitted):
+        def _run():
+            with scheduler.slot(operation):
+                admitted.append(operation)
+        thread = eventlet.spawn(_run)
+        # let it queue up
+        eventlet.sleep(0)
+        return thread
+
+    def test_admits_by_priority(self):
+        scheduler = self._scheduler(max_total=1)
+        Scheduler = CloudletWorkScheduler
+        admitted = list()
+        with scheduler.slot(Scheduler.BASE):
+            threads = [self._spawn_waiting(scheduler, operation, admitted)
+                       for operation in (Scheduler.OVERLAY, Scheduler.BASE,
+                                         Scheduler.HANDOFF,
+                                         Scheduler.SYNTHESIS)]
+            self.assertEqual([], admitted)
+            self.assertEqual(1, scheduler.queue_depth(Scheduler.HANDOFF))
+        for thread in threads:
+            thread.wait()
+        self.assertEqual([Scheduler.HANDOFF, Scheduler.SYNTHESIS,
+                          Scheduler.OVERLAY, Scheduler.BASE], admitted)
+
+    def test_admits_in_arrival_order_within_priority(self):
+        scheduler = self._scheduler(max_total=1)
+        SYNTHESIS = CloudletWorkScheduler.SYNTHESIS
+        admitted = list()
+
+        def _run(name):
+            with scheduler.slot(SYNTHESIS):
+                admitted.append(name)
+
+        with scheduler.slot(SYNTHESIS):
+            threads = list()
+            for name in ('first', 'second', 'third'):
+                threads.append(eventlet.spawn(_run, name))
+                eventlet.sleep(0)
+        for thread in threads:
+            thread.wait()
+        self.assertEqual(['first', 'second', 'third'], admitted)
+
+    def test_type_limit(self):
+        Scheduler = CloudletWorkScheduler
+        scheduler = self._scheduler(limits={Scheduler.SYNTHESIS: 1})
+        admitted = list()
+        with scheduler.slot(Scheduler.SYNTHESIS):
+            synthesis = self._spawn_waiting(scheduler, Scheduler.SYNTHESIS,
+                                            admitted)
+            handoff = self._spawn_waiting(scheduler, Scheduler.HANDOFF,
+                                          admitted)
+            handoff.wait()
+            self.assertEqual([Scheduler.HANDOFF], admitted)
+        synthesis.wait()
+        self.assertEqual([Scheduler.HANDOFF, Scheduler.SYNTHESIS], admitted)
+
+    def test_type_at_limit_does_not_block_others(self):
+        Scheduler = CloudletWorkScheduler
+        scheduler = self._scheduler(max_total=2,
+                                    limits={Scheduler.SYNTHESIS: 1})
+        admitted = list()
+        with scheduler.slot(Scheduler.SYNTHESIS):
+            with scheduler.slot(Scheduler.BASE):
+                synthesis = self._spawn_waiting(
+                    scheduler, Scheduler.SYNTHESIS, admitted)
+                overlay = self._spawn_waiting(
+                    scheduler, Scheduler.OVERLAY, admitted)
+                self.assertEqual([], admitted)
+            overlay.wait()
+            self.assertEqual([Scheduler.OVERLAY], admitted)
+        synthesis.wait()
+        self.assertEqual([Scheduler.OVERLAY, Scheduler.SYNTHESIS], admitted)
+
+    def test_is_full(self):
+        Scheduler = CloudletWorkScheduler
+        scheduler = self._scheduler(max_total=1,
+                                    max_queued={Scheduler.SYNTHESIS: 1})
+        admitted = list()
+        self.assertFalse(scheduler.is_full(Scheduler.SYNTHESIS))
+        with scheduler.slot(Scheduler.SYNTHESIS):
+            self.assertFalse(scheduler.is_full(Scheduler.SYNTHESIS))
+            thread = self._spawn_waiting(scheduler, Scheduler.SYNTHESIS,
+                                         admitted)
+            self.assertTrue(scheduler.is_full(Scheduler.SYNTHESIS))
+            # no queue limit for other types
+            self.assertFalse(scheduler.is_full(Scheduler.HANDOFF))
+        thread.wait()
+        self.assertFalse(scheduler.is_full(Scheduler.SYNTHESIS))
+        self.assertEqual(0, sum(scheduler.running.values()))
+
+    def test_cancelled_waiter_leaves_queue(self):
+        Scheduler = CloudletWorkScheduler
+        scheduler = self._scheduler(max_total=1)
+        admitted = list()
+        with scheduler.slot(Scheduler.BASE):
+            thread = self._spawn_waiting(scheduler, Scheduler.OVERLAY,
+                                         admitted)
+            thread.kill()
+            self.assertEqual(0, scheduler.queue_depth(Scheduler.OVERLAY))
+        self.assertEqual([], admitted)
+        self.assertEqual(0, sum(scheduler.running.values()))
@@ -0,0 +1,98 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+from cloudlet_common.synthesiscache import SynthesisCache
+from cloudlet_common.synthesiscache import copy_chunks
+
+
+class CopyChunksTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_copies_chunks_at_their_offsets(self):
+        src_path = os.path.join(self.root, 'src')
+        dest_path = os.path.join(self.root, 'dest')
+        with open(src_path, 'wb') as f:
+            f.write('abcdefghij')
+        with open(dest_path, 'wb') as f:
+            f.write('0' * 10)
+        copy_chunks(src_path, dest_path, [4, 1], 2)
+        with open(dest_path) as f:
+            # the last chunk is short
+            self.assertEqual('00cd0000ij', f.read())
+
+
+class SynthesisCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.root, 'cache')
+        self.fills = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _fill(self, disk_path, memory_path):
+        self.fills += 1
+        for path in (disk_path, memory_path):
+            with open(path, 'wb') as f:
+                f.write('x' * 4096)
+
+    def test_get_after_add(self):
+        cache = SynthesisCache(self.cache_dir, 1024 * 1024)
+        self.assertEqual(None, cache.get('base', 'overlay', 'instance-1'))
+        cache.add('base', 'overlay', self._fill)
+        cache.add('base', 'overlay', self._fill)
+        self.assertEqual(1, self.fills)
+        disk_path, memory_path = cache.get('base', 'overlay', 'instance-1')
+        self.assertTrue(os.path.exists(disk_path))
+        self.assertTrue(cache.is_used_by('instance-1'))
+        cache.release('instance-1')
+        self.assertFalse(cache.is_used_by('instance-1'))
+        # entries survive a restart
+        cache = SynthesisCache(self.cache_dir, 1024 * 1024)
+        self.assertNotEqual(None, cache.get('base', 'overlay', 'instance-2'))
+
+    def test_failed_fill_leaves_nothing_behind(self):
+        cache = SynthesisCache(self.cache_dir, 1024 * 1024)
+
+        def _fail(disk_path, memory_path):
+            with open(disk_path, 'wb') as f:
+                f.write('x')
+            raise IOError("no space left")
+        self.assertRaises(IOError, cache.add, 'base', 'overlay', _fail)
+        self.assertEqual([], os.listdir(self.cache_dir))
+        cache.add('base', 'overlay', self._fill)
+        self.assertEqual(1, len(cache.entries))
+
+    def test_evicts_entries_not_in_use(self):
+        cache = SynthesisCache(self.cache_dir, 1024 * 1024)
+        cache.add('base', 'overlay-a', self._fill)
+        cache.get('base', 'overlay-a', 'instance-1')
+        cache.max_bytes = 0
+        cache.add('base', 'overlay-b', self._fill)
+        self.assertEqual(1, len(cache.entries))
+        self.assertEqual(1, cache.stats['evictions'])
+        self.assertTrue(cache.is_used_by('instance-1'))
+        self.assertNotEqual(None, cache.get('base', 'overlay-a', 'instance-2'))
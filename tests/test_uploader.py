@@ -0,0 +1,87 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+import eventlet
+
+from cloudlet_common.uploader import BaseVMUploader
+
+
+class BaseVMUploaderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.events = list()
+        self.fail_meta_id = None
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _file(self, name):
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as f:
+            f.write('x' * 100)
+        return path
+
+    def _upload(self, filepath, meta_id, metadata, progress_callback):
+        eventlet.sleep(0)
+        if meta_id == self.fail_meta_id:
+            raise IOError("glance went away")
+        progress_callback(os.path.getsize(filepath))
+        self.events.append(('upload', meta_id))
+
+    def _update(self, meta_id, metadata):
+        self.events.append(('update', meta_id, metadata))
+
+    def _delete(self, meta_id):
+        self.events.append(('delete', meta_id))
+
+    def _uploader(self):
+        uploader = BaseVMUploader(self._upload, 4, delete_func=self._delete,
+                                  update_func=self._update)
+        uploader.add("memory", self._file("memory"), 'mem-id', {})
+        uploader.add("disk", self._file("disk"), 'disk-id', {},
+                     depends_on=("memory",),
+                     final_metadata={'properties': {'memory': 'mem-id'}})
+        return uploader
+
+    def test_uploads_disk_before_dependencies_are_ready(self):
+        uploader = self._uploader()
+        uploader.mark_ready("disk")
+        eventlet.sleep(0.01)
+        self.assertEqual([('upload', 'disk-id')], self.events)
+        uploader.mark_ready("memory")
+        uploader.wait()
+        self.assertEqual([('upload', 'disk-id'), ('upload', 'mem-id'),
+                          ('update', 'disk-id',
+                           {'properties': {'memory': 'mem-id'}})],
+                         self.events)
+        self.assertEqual(100, uploader.progress["disk"]['bytes_sent'])
+        self.assertEqual('done', uploader.progress["disk"]['state'])
+
+    def test_failed_dependency_skips_update_and_deletes(self):
+        uploader = self._uploader()
+        self.fail_meta_id = 'mem-id'
+        uploader.mark_ready("disk")
+        uploader.mark_ready("memory")
+        self.assertRaises(IOError, uploader.wait)
+        self.assertNotIn('update', [e[0] for e in self.events])
+        self.assertEqual(sorted([('delete', 'disk-id'),
+                                 ('delete', 'mem-id')]),
+                         sorted(e for e in self.events if e[0] == 'delete'))
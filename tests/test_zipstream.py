@@ -0,0 +1,166 @@
+# Elijah: Cloudlet Infrastructure for Mobile Computing
+#
+#   Copyright (C) 2011-2014 Carnegie Mellon University
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+import zipfile
+
+import eventlet
+
+from cloudlet_common.zipstream import GrowingZipReader
+from cloudlet_common.zipstream import OverlayPackageStream
+from cloudlet_common.zipstream import write_zip_stream
+
+
+class _WriteOnlyFile(object):
+
+    """File that can only be appended to, like a pipe"""
+
+    def __init__(self):
+        self.buf = StringIO.StringIO()
+
+    def write(self, data):
+        self.buf.write(data)
+
+    def flush(self):
+        pass
+
+
+class WriteZipStreamTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(WriteZipStreamTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def _file(self, name, data):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_read_back_with_zipfile(self):
+        contents = {
+            'overlay-meta': 'meta' * 100,
+            'overlay_1.xz': os.urandom(300 * 1024),
+            'empty': '',
+            }
+        paths = [self._file(name, data)
+                 for name, data in sorted(contents.items())]
+        out = _WriteOnlyFile()
+        write_zip_stream(out, paths, chunk_size=64 * 1024)
+
+        archive = zipfile.ZipFile(StringIO.StringIO(out.buf.getvalue()))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(sorted(contents), archive.namelist())
+        for name, data in contents.items():
+            self.assertEqual(data, archive.read(name))
+            info = archive.getinfo(name)
+            self.assertEqual(zipfile.ZIP_STORED, info.compress_type)
+            self.assertEqual(len(data), info.file_size)
+
+    def test_empty_archive(self):
+        out = _WriteOnlyFile()
+        write_zip_stream(out, [])
+        archive = zipfile.ZipFile(StringIO.StringIO(out.buf.getvalue()))
+        self.assertEqual([], archive.namelist())
+
+
+class OverlayPackageStreamTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_read_while_packaged(self):
+        path = os.path.join(self.tmpdir, 'overlay_1.xz')
+        data = os.urandom(512 * 1024)
+        with open(path, 'wb') as f:
+            f.write(data)
+        stream = OverlayPackageStream()
+        writer = eventlet.spawn(stream.write_package, [path])
+        package = ''.join(iter(stream))
+        writer.wait()
+        archive = zipfile.ZipFile(StringIO.StringIO(package))
+        self.assertEqual(data, archive.read('overlay_1.xz'))
+
+    def test_incomplete_package(self):
+        stream = OverlayPackageStream()
+        writer = eventlet.spawn(stream.write_package,
+                                [os.path.join(self.tmpdir, 'missing')])
+        self.assertRaises(IOError, stream.read)
+        self.assertRaises(OSError, writer.wait)
+
+
+class GrowingZipReaderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'overlay.zip')
+        self.reader = GrowingZipReader(self.path)
+        self.addCleanup(self.reader.close)
+
+    def _read_all(self):
+        return ''.join(iter(self.reader))
+
+    def test_read_while_written(self):
+        archive = zipfile.ZipFile(self.path, 'w', zipfile.ZIP_STORED,
+                                  allowZip64=True)
+        archive.writestr('overlay-meta', 'meta' * 100)
+        archive.fp.flush()
+        # the member written is complete, and nothing follows it yet
+        written = self.reader.read()
+        self.assertEqual(os.path.getsize(self.path), len(written))
+
+        second = os.path.join(self.tmpdir, 'overlay_1.xz')
+        with open(second, 'wb') as f:
+            f.write(os.urandom(200 * 1024))
+        archive.write(second, 'overlay_1.xz')
+        archive.close()
+        self.reader.finish(True)
+        data = written + self._read_all()
+
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        archive = zipfile.ZipFile(StringIO.StringIO(data))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(['overlay-meta', 'overlay_1.xz'],
+                         archive.namelist())
+
+    def test_holds_back_header_not_rewritten(self):
+        with open(self.path, 'wb') as f:
+            # local header whose sizes are still zero, followed by data
+            f.write(self.reader.LOCAL_HEADER.pack(
+                self.reader.LOCAL_HEADER_SIG, 20, 0, 0, 0, 0, 0, 0, 0, 4, 0))
+            f.write('name')
+            f.write('data not yet accounted for')
+        self.reader.fileobj = open(self.path, 'rb', 0)
+        self.reader._advance()
+        self.assertEqual(0, self.reader.stable_end)
+
+    def test_failed_writer(self):
+        with open(self.path, 'wb') as f:
+            f.write('PK')
+        self.reader.finish(False)
+        self.assertRaises(IOError, self.reader.read)
+
+    def test_wait_created(self):
+        self.reader.finish(True)
+        self.assertFalse(self.reader.wait_created())
+        self.assertEqual('', self.reader.read())